@@ -0,0 +1,402 @@
+import time
+import asyncio
+import threading
+import logging
+from retry_scheduler import RetryItem, unpack
+
+# Optional dependencies, only the async engine needs them
+try:
+    import aiosmtplib
+except ImportError:
+    aiosmtplib = None
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+# Contacts are read from the blocking source in chunks of this size
+READ_CHUNK = 256
+
+
+class EventLoopThread:
+    """An asyncio event loop running forever on a daemon thread next to Flask's threads"""
+
+    def __init__(self, name='send-loop'):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """Schedule a coroutine from any thread, returns a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+
+def event_loop_thread():
+    """The loop shared by every async campaign, started on first use"""
+    global _loop_thread
+    with _loop_lock:
+        if _loop_thread is None:
+            _loop_thread = EventLoopThread()
+        return _loop_thread
+
+
+async def _new_queue(maxsize):
+    return asyncio.Queue(maxsize=maxsize)
+
+
+class LoopQueue:
+    """An asyncio.Queue on the shared loop with the put() and qsize() of a queue.Queue
+
+    Lets other threads, like the retry scheduler, feed the async engine.
+    """
+
+    def __init__(self, maxsize=0):
+        self.loop_thread = event_loop_thread()
+        self.queue = self.loop_thread.submit(_new_queue(maxsize)).result()
+
+    def put(self, item):
+        if threading.current_thread() is self.loop_thread._thread:
+            # Blocking here would stall the loop, let a task wait for the free slot
+            self.loop_thread.loop.create_task(self.queue.put(item))
+        else:
+            self.loop_thread.submit(self.queue.put(item)).result()
+
+    def qsize(self):
+        return self.queue.qsize()
+
+
+def check_available(use_gmail_oauth):
+    """Raise a readable error when the client library for the transport is missing"""
+    if use_gmail_oauth and aiohttp is None:
+        raise RuntimeError("The async engine needs aiohttp for the Gmail API: pip install aiohttp")
+    if not use_gmail_oauth and aiosmtplib is None:
+        raise RuntimeError("The async engine needs aiosmtplib for SMTP: pip install aiosmtplib")
+
+
+class _AsyncSession:
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+
+class AsyncSMTPPool:
+    """Authenticated aiosmtplib sessions shared by the coroutines of one campaign
+
+    Same recycling rules as SMTPConnectionPool, but a session is borrowed per
+    message instead of pinned to a thread. Only used from the event loop thread.
+    """
+
+    def __init__(self, host, port, username, password, use_ssl=False,
+                 max_messages=100, max_idle=30.0, timeout=60, use_starttls=True, latency=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.use_starttls = use_starttls
+        self.max_messages = max_messages
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.latency = latency
+
+        # Most recently used last, so surplus sessions at the bottom go idle and get recycled
+        self._idle = []
+        self._open = 0
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'reconnects': 0,
+            'recycled': 0
+        }
+
+    def _timed(self, stage, started):
+        if self.latency is None:
+            return time.perf_counter()
+        return self.latency.since(stage, started)
+
+    async def _connect(self):
+        # STARTTLS is issued separately so its handshake is timed on its own
+        smtp = aiosmtplib.SMTP(
+            hostname=self.host, port=self.port, timeout=self.timeout,
+            use_tls=self.use_ssl, start_tls=False)
+        started = time.perf_counter()
+        await smtp.connect()
+        started = self._timed('connect', started)
+        if self.use_starttls and not self.use_ssl:
+            await smtp.starttls()
+            started = self._timed('tls', started)
+        if self.username:
+            await smtp.login(self.username, self.password)
+            self._timed('auth', started)
+        self._open += 1
+        return _AsyncSession(smtp)
+
+    async def _close(self, session):
+        self._open -= 1
+        try:
+            await session.smtp.quit()
+        except Exception:
+            # The connection may already be gone, just drop the socket
+            session.smtp.close()
+
+    async def _acquire(self):
+        while self._idle:
+            session = self._idle.pop()
+            idle = time.monotonic() - session.last_used
+            if session.sent >= self.max_messages or idle >= self.max_idle or not session.smtp.is_connected:
+                self.counters['recycled'] += 1
+                await self._close(session)
+                continue
+            self.counters['hits'] += 1
+            return session
+        self.counters['misses'] += 1
+        return await self._connect()
+
+    def _release(self, session):
+        session.last_used = time.monotonic()
+        self._idle.append(session)
+
+    async def sendmail(self, from_addr, to_addrs, data):
+        """Send a serialized message on a pooled session, reconnecting once if the server dropped us"""
+        session = await self._acquire()
+        try:
+            try:
+                await session.smtp.sendmail(from_addr, to_addrs, data)
+            except aiosmtplib.SMTPServerDisconnected:
+                logger.warning(f"SMTP session to {self.host} disconnected, reconnecting")
+                self.counters['reconnects'] += 1
+                dropped, session = session, None
+                await self._close(dropped)
+                session = await self._connect()
+                await session.smtp.sendmail(from_addr, to_addrs, data)
+        except (aiosmtplib.SMTPResponseException, aiosmtplib.SMTPRecipientsRefused):
+            # The server answered, so the session is still usable for the next message
+            self._release(session)
+            raise
+        except Exception:
+            # Unknown state (socket error, timeout...), never reuse this session
+            if session is not None:
+                await self._close(session)
+            raise
+        session.sent += 1
+        self._release(session)
+
+    async def close(self):
+        sessions, self._idle = self._idle, []
+        for session in sessions:
+            await self._close(session)
+
+    def close_all(self):
+        """Close the idle sessions from another thread"""
+        event_loop_thread().submit(self.close())
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['open_sessions'] = self._open
+        return stats
+
+
+class _Response(dict):
+    """Lower-cased response headers with a status, shaped like httplib2's response"""
+
+    def __init__(self, status, headers):
+        super().__init__((key.lower(), value) for key, value in headers.items())
+        self.status = status
+
+
+class GmailHTTPError(Exception):
+    """Error response of the Gmail API, with the resp/content attributes of googleapiclient's HttpError"""
+
+    def __init__(self, status, headers, content):
+        self.resp = _Response(status, headers)
+        self.content = content
+        super().__init__(f"<HttpError {status}: {content[:500].decode('utf-8', 'replace')}>")
+
+
+class AsyncGmailSender:
+    """messages.send over aiohttp with the OAuth token of a GmailClient"""
+
+    def __init__(self, gmail_client, concurrency=100, timeout=60):
+        self.client = gmail_client
+        self.url = gmail_client.api_endpoint.rstrip('/') + '/gmail/v1/users/me/messages/send'
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._session = None
+        self.counters = {'requests': 0, 'token_refreshes': 0}
+
+    async def _refresh(self, rejected_token=None):
+        # Token refresh is a blocking google-auth call, keep it off the loop
+        self.counters['token_refreshes'] += 1
+        await asyncio.get_running_loop().run_in_executor(None, self.client.ensure_fresh, rejected_token)
+
+    async def send_raw(self, raw):
+        """Send an already base64url encoded RFC 822 message"""
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+        if self.client.needs_refresh():
+            await self._refresh()
+
+        for attempt in range(2):
+            token = self.client.credentials.token
+            self.counters['requests'] += 1
+            async with self._session.post(
+                    self.url, json={'raw': raw}, headers={'Authorization': f'Bearer {token}'}) as response:
+                content = await response.read()
+                if response.status < 400:
+                    return
+                error = GmailHTTPError(response.status, response.headers, content)
+            # A 401 means the token was revoked or expired early, refresh once and retry
+            if response.status != 401 or attempt:
+                raise error
+            await self._refresh(rejected_token=token)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def stats(self):
+        return dict(self.counters)
+
+
+class GroupCommit:
+    """Lets many coroutines wait for a job store commit with a single flush in flight
+
+    Writes submitted before a flush starts are covered by it, coroutines that
+    arrive while it runs share the next one.
+    """
+
+    def __init__(self, flush):
+        self.flush = flush
+        self._next = None
+        self._flushing = False
+
+    async def wait(self):
+        if self._next is None:
+            self._next = asyncio.get_running_loop().create_future()
+        future = self._next
+        if not self._flushing:
+            self._start()
+        await future
+
+    def _start(self):
+        self._flushing = True
+        waiters, self._next = self._next, None
+        flushed = asyncio.get_running_loop().run_in_executor(None, self.flush)
+        flushed.add_done_callback(lambda done: self._done(waiters, done))
+
+    def _done(self, waiters, done):
+        self._flushing = False
+        if done.exception() is not None:
+            waiters.set_exception(done.exception())
+        else:
+            waiters.set_result(None)
+        if self._next is not None:
+            self._start()
+
+
+async def acquire(limiter):
+    """Wait for the shared rate limiter without blocking the loop"""
+    while True:
+        wait = limiter.try_acquire()
+        if wait <= 0:
+            return
+        await asyncio.sleep(min(wait, 1.0))
+
+
+def _read_chunk(contacts):
+    chunk = []
+    for contact in contacts:
+        chunk.append(contact)
+        if len(chunk) >= READ_CHUNK:
+            break
+    return chunk
+
+
+async def run_campaign(contacts, send, prepare, limiter, commit, concurrency, work_queue,
+                       on_sent, on_failure, on_retry, on_error, on_contact_done, on_contacts_read,
+                       prepare_in_executor=True):
+    """Send to every contact with `concurrency` coroutines, mirroring the threaded worker
+
+    contacts is the blocking iterator of queue items, read in the default
+    executor; prepare(item) returns its wire payload, in the executor too
+    unless prepare_in_executor is False (payloads rendered ahead), and
+    send(email, payload) is the transport coroutine. The callbacks are the
+    campaign's status helpers: on_sent(row, email, attempts, wait) records
+    a delivery without waiting, the coroutine then waits on `commit` so a
+    crash never re-sends it; on_failure(row, email, attempt, error), run in
+    the executor as it may write to the suppression list, returns True to
+    retry, and on_retry(item, error) then schedules the RetryItem. Like with the
+    threaded workers the caller ends the run, by putting one None per
+    coroutine on work_queue once on_contact_done counted every contact
+    that on_contacts_read(produced, error) reported.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def produce():
+        produced = 0
+        error = None
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, _read_chunk, contacts)
+                if not chunk:
+                    break
+                for contact in chunk:
+                    await work_queue.put(contact)
+                produced += len(chunk)
+        except Exception as e:
+            logger.error(f"Error reading contacts: {e}")
+            error = e
+        finally:
+            on_contacts_read(produced, error)
+
+    async def send_contact(item):
+        """One attempt, returns False when the contact went to the retry scheduler"""
+        contact, attempt, payload = unpack(item)
+        row, email = contact[0], contact[1]
+        if payload is None:
+            # Rendering here would hold up every send in flight
+            if prepare_in_executor:
+                payload = await loop.run_in_executor(None, prepare, contact)
+            else:
+                payload = prepare(contact)
+        await acquire(limiter)
+        try:
+            await send(email, payload)
+        except Exception as e:
+            # A bounce is written to the suppression list, off the loop
+            if await loop.run_in_executor(None, on_failure, row, email, attempt, e):
+                on_retry(RetryItem(contact, attempt + 1, payload), e)
+                return False
+            return True
+        on_sent(row, email, attempt + 1, wait=False)
+        await commit.wait()
+        return True
+
+    async def consume():
+        while True:
+            item = await work_queue.get()
+            if item is None:
+                return
+            done = True
+            try:
+                done = await send_contact(item)
+            except Exception as e:
+                on_error(unpack(item)[0][0], e)
+            if done:
+                on_contact_done()
+
+    await asyncio.gather(produce(), *(consume() for _ in range(concurrency)))
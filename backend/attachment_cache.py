@@ -0,0 +1,146 @@
+import os
+import time
+import mmap
+import base64
+import threading
+import logging
+from email.mime.base import MIMEBase
+
+logger = logging.getLogger(__name__)
+
+# Encoded attachments kept in memory for all campaigns together
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def list_attachment_files(folder, reserved=()):
+    """Attachment filenames in folder, skipping reserved data files, hidden files and directories"""
+    filenames = []
+    for filename in sorted(os.listdir(folder)):
+        if filename in reserved or filename.startswith('.'):
+            continue
+        if os.path.isfile(os.path.join(folder, filename)):
+            filenames.append(filename)
+    return filenames
+
+
+def _encode_file(path):
+    """Base64 encode a file through mmap so the raw bytes are never copied into Python"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ''
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            # Same output as email.encoders.encode_base64
+            return base64.encodebytes(mapped).decode('ascii')
+
+
+def _timed_encode(path, latency):
+    if latency is None:
+        return _encode_file(path)
+    started = time.perf_counter()
+    encoded = _encode_file(path)
+    latency.since('attachment_encode', started)
+    return encoded
+
+
+def _encoded_size(size):
+    # encodebytes writes 76 characters plus a newline for every 57 input bytes
+    return (size + 2) // 3 * 4 + (size + 56) // 57
+
+
+def _build_part(filename, encoded):
+    part = MIMEBase('application', 'octet-stream')
+    part.set_payload(encoded)
+    part['Content-Transfer-Encoding'] = 'base64'
+    part.add_header('Content-Disposition', f'attachment; filename={filename}')
+    return part
+
+
+class _Attachment:
+    """One attachment file, either encoded once and kept or re-encoded on every use"""
+
+    def __init__(self, filename, path, key, part=None, latency=None):
+        self.filename = filename
+        self.path = path
+        self.key = key
+        self.part = part
+        self.latency = latency
+
+    @property
+    def size(self):
+        return len(self.part.get_payload()) if self.part is not None else 0
+
+    def get_part(self):
+        if self.part is not None:
+            return self.part
+        # Over the memory cap: encode straight from the mapped file
+        return _build_part(self.filename, _timed_encode(self.path, self.latency))
+
+
+class AttachmentCache:
+    """Encoded MIME parts of the attachment folder, keyed by path, mtime and size
+
+    The parts are shared read-only by every message of a campaign. Files that
+    would push the cache over max_bytes are not kept and get encoded per use.
+    """
+
+    def __init__(self, folder, reserved=(), max_bytes=DEFAULT_MAX_BYTES, latency=None):
+        self.folder = folder
+        self.reserved = set(reserved)
+        self.max_bytes = max_bytes
+        # Optional LatencyHistogram for the attachment_encode stage
+        self.latency = latency
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _key(self, path):
+        stat = os.stat(path)
+        return (path, stat.st_mtime_ns, stat.st_size)
+
+    def load(self, filenames=None):
+        """Return the attachments of the folder as a list, encoding only new or changed files
+
+        filenames picks the attachments of one campaign, in that order; the
+        cache is still refreshed for the whole folder.
+        """
+        with self._lock:
+            attachments = []
+            entries = {}
+            used = 0
+            for filename in list_attachment_files(self.folder, self.reserved):
+                path = os.path.join(self.folder, filename)
+                key = self._key(path)
+                entry = self._entries.get(filename)
+                if entry is None or entry.key != key or entry.part is None:
+                    if used + _encoded_size(key[2]) <= self.max_bytes:
+                        logger.debug(f"Encoding attachment {filename} ({key[2]} bytes)")
+                        entry = _Attachment(filename, path, key,
+                                            _build_part(filename, _timed_encode(path, self.latency)))
+                    else:
+                        logger.info(f"Attachment {filename} exceeds the cache limit, encoding per message")
+                        entry = _Attachment(filename, path, key, latency=self.latency)
+                used += entry.size
+                entries[filename] = entry
+                attachments.append(entry)
+            self._entries = entries
+            if filenames is None:
+                return attachments
+            missing = [filename for filename in filenames if filename not in entries]
+            if missing:
+                raise ValueError(f"Unknown attachments: {', '.join(missing)}")
+            return [entries[filename] for filename in filenames]
+
+    def invalidate(self, filename=None):
+        """Forget one cached attachment, or all of them"""
+        with self._lock:
+            if filename is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(filename, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._entries),
+                'cached': sum(1 for entry in self._entries.values() if entry.part is not None),
+                'bytes': sum(entry.size for entry in self._entries.values())
+            }
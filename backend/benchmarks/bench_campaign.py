@@ -0,0 +1,301 @@
+"""End-to-end campaign benchmark against a local SMTP sink and a fake Gmail API
+
+Starts smtp_sink.py and fake_gmail.py as subprocesses, writes synthetic
+contact lists and attachments to a scratch data folder and runs every
+campaign through POST /send-emails. For each run it reports messages per
+second, p50/p99 transmit latency (estimated from the /metrics histogram
+like histogram_quantile), peak RSS and CPU time per message of the server
+process. The servers run in their own processes so their CPU is not counted.
+
+--json saves the results; --baseline compares with a saved run and exits
+with status 1 when a configuration got slower than --tolerance allows.
+
+Run from the backend directory:
+    python benchmarks/bench_campaign.py --rows 1000,100000,1000000 --attachments 0,100,1024 --transports smtp,gmail
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import logging
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+GMAIL_USER = 'bench@example.com'
+TEMPLATES = {
+    'EN': 'Hello [NAME],\n\nThanks for your interest in [COMPANY].\nBest regards\n',
+    'FR': 'Bonjour [NAME],\n\nMerci de votre intérêt pour [COMPANY].\nCordialement\n'
+}
+
+
+def rss_mb():
+    """Current resident set size, from /proc where available"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def cpu_seconds():
+    # Children covers the render processes, which are joined when their campaign ends
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def write_contacts(path, count):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('email,name,language,company\n')
+        for i in range(count):
+            f.write(f'user{i}@example.com,User {i},{"FR" if i % 3 == 0 else "EN"},Company {i % 97}\n')
+
+
+def write_attachment(folder, size_kb):
+    """Replace the attachments of the data folder with one random file of size_kb"""
+    for filename in os.listdir(folder):
+        if filename.startswith('attachment'):
+            os.remove(os.path.join(folder, filename))
+    if size_kb:
+        with open(os.path.join(folder, f'attachment-{size_kb}kb.bin'), 'wb') as f:
+            f.write(os.urandom(size_kb * 1024))
+
+
+def start_process(script, port, args):
+    """Run one of the benchmark servers and wait for its 'listening' line"""
+    command = [sys.executable, os.path.join(BENCH_DIR, script), '--port', str(port),
+               '--latency', str(args.latency), '--error-rate', str(args.error_rate),
+               '--throttle-rate', str(args.throttle_rate), '--seed', str(args.seed)]
+    if script == 'smtp_sink.py':
+        command.append('--quiet')
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if 'listening' not in line:
+        process.kill()
+        raise RuntimeError(f"{script} did not start: {line!r}")
+    return process
+
+
+def histogram_quantile(buckets, counts, q):
+    """Quantile of a bucketed distribution, interpolating inside the bucket like Prometheus"""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    cumulative = 0
+    lower = 0.0
+    for bound, count in zip(buckets + (float('inf'),), counts):
+        if cumulative + count >= rank and count:
+            if bound == float('inf'):
+                return lower
+            return lower + (bound - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = bound
+    return lower
+
+
+def transmit_counts(server):
+    entry = server.stage_latency.totals().get('transmit')
+    return entry[:-1] if entry else [0] * (len(server.stage_latency.buckets) + 1)
+
+
+def campaign_request(args, transport):
+    data = {
+        'subject': 'Benchmark',
+        'pause_between_messages': 0,
+        'retries': args.retries,
+        'max_connections': args.concurrency,
+        'engine': args.engine,
+        'adaptive_concurrency': args.adaptive,
+        'templates': TEMPLATES
+    }
+    if args.render_processes is not None:
+        data['render_processes'] = args.render_processes
+    if transport == 'gmail':
+        data.update({
+            'use_gmail_oauth': True,
+            'gmail_user': GMAIL_USER,
+            'gmail_batch_size': args.gmail_batch_size,
+            # The published Gmail quotas would make this a benchmark of the rate limiter
+            'rate_per_second': 1e9,
+            'rate_per_day': 1e12
+        })
+    else:
+        data.update({
+            'smtp_host': '127.0.0.1',
+            'port': args.smtp_port,
+            'username': 'bench',
+            'password': 'bench',
+            'smtp_starttls': False,
+            'group_recipients': args.group_recipients
+        })
+    return data
+
+
+def run(server, client, args, transport):
+    """One campaign, returns its measurements"""
+    # Recipients refused by earlier runs would be skipped, every run sends to the full list
+    server.suppressions.clear()
+    counts_before = transmit_counts(server)
+    cpu_before = cpu_seconds()
+    response = client.post('/send-emails', json=campaign_request(args, transport))
+    if response.status_code != 200:
+        raise RuntimeError(response.get_json())
+    campaign = server.campaigns.get(response.get_json()['campaignId'])
+
+    started = time.perf_counter()
+    peak_rss = 0.0
+    while not campaign.metrics.completed:
+        peak_rss = max(peak_rss, rss_mb())
+        if time.perf_counter() - started > args.timeout:
+            raise RuntimeError(f"Campaign did not finish within {args.timeout} seconds")
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    cpu = cpu_seconds() - cpu_before
+
+    status = campaign.metrics.snapshot()
+    processed = status['sent'] + status['failed']
+    counts = [after - before for after, before in zip(transmit_counts(server), counts_before)]
+    p50 = histogram_quantile(server.stage_latency.buckets, counts, 0.5)
+    p99 = histogram_quantile(server.stage_latency.buckets, counts, 0.99)
+    return {
+        'sent': status['sent'],
+        'failed': status['failed'],
+        'retried': status['retried'],
+        'seconds': round(elapsed, 3),
+        'per_second': round(processed / elapsed, 1),
+        'p50_ms': round(p50 * 1000, 2) if p50 is not None else None,
+        'p99_ms': round(p99 * 1000, 2) if p99 is not None else None,
+        'peak_rss_mb': round(peak_rss, 1),
+        'cpu_ms_per_message': round(cpu * 1000 / processed, 3) if processed else None,
+        'concurrency': campaign.concurrency.stats() if campaign.concurrency else None
+    }
+
+
+def compare(results, baseline_path, tolerance):
+    """Print the throughput change against a saved run, returns the configurations that regressed"""
+    with open(baseline_path) as f:
+        baseline = {result['config']: result for result in json.load(f)}
+    regressed = []
+    for result in results:
+        before = baseline.get(result['config'])
+        if before is None or not before['per_second']:
+            continue
+        change = result['per_second'] / before['per_second'] - 1
+        print(f"{result['config']:<40} {before['per_second']:>9.0f} -> {result['per_second']:>9.0f} msg/s "
+              f"({change:+.1%})")
+        if change < -tolerance:
+            regressed.append(result['config'])
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', default='1000,100000,1000000', help='comma separated contact list sizes')
+    parser.add_argument('--attachments', default='0,100,1024', help='comma separated attachment sizes in KB')
+    parser.add_argument('--transports', default='smtp,gmail')
+    parser.add_argument('--engine', default='threads', choices=('threads', 'async'))
+    parser.add_argument('--concurrency', type=int, default=50, help='max_connections of every campaign')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='adaptive concurrency, with --concurrency as the ceiling')
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds the servers add per message')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of recipients refused permanently')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of recipients throttled (452/429)')
+    parser.add_argument('--retries', type=int, default=1)
+    parser.add_argument('--render-processes', type=int, default=None, help='default: chosen by the server')
+    parser.add_argument('--gmail-batch-size', type=int, default=0)
+    parser.add_argument('--group-recipients', type=int, default=0)
+    parser.add_argument('--smtp-port', type=int, default=2527)
+    parser.add_argument('--gmail-port', type=int, default=8527)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=3600, help='seconds allowed per campaign')
+    parser.add_argument('--log-level', default='CRITICAL', help='server log level during the runs')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results file of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed throughput drop against the baseline')
+    args = parser.parse_args()
+    # Paths are relative to where the benchmark was started, not the scratch folder
+    args.json = os.path.abspath(args.json) if args.json else None
+    args.baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    transports = args.transports.split(',')
+    processes = []
+    if 'smtp' in transports:
+        processes.append(start_process('smtp_sink.py', args.smtp_port, args))
+    if 'gmail' in transports:
+        processes.append(start_process('fake_gmail.py', args.gmail_port, args))
+
+    # server.py keeps its data folder relative to the working directory
+    workdir = tempfile.mkdtemp(prefix='bench-campaign-')
+    os.chdir(workdir)
+    os.makedirs('data')
+    os.environ['GMAIL_API_ENDPOINT'] = f'http://127.0.0.1:{args.gmail_port}/'
+    os.environ['LOG_LEVEL'] = args.log_level
+    import server
+    logging.getLogger().setLevel(args.log_level)
+    server.oauth_tokens[GMAIL_USER] = {
+        'token': 'bench-token',
+        'refresh_token': 'bench-refresh',
+        'token_uri': f'http://127.0.0.1:{args.gmail_port}/token',
+        'client_id': 'bench',
+        'client_secret': 'bench',
+        'scopes': ['https://www.googleapis.com/auth/gmail.send'],
+        'expiry': (datetime.utcnow() + timedelta(days=1)).isoformat()
+    }
+    client = server.app.test_client()
+
+    print(f"{args.engine} engine, {'adaptive ' if args.adaptive else ''}concurrency {args.concurrency}, server latency {args.latency * 1000:.0f} ms, "
+          f"errors {args.error_rate:.1%}, throttled {args.throttle_rate:.1%}")
+    print(f"{'transport':<10} {'rows':>8} {'attach':>7} {'sent':>8} {'failed':>7} {'seconds':>8} {'msg/s':>8} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'rss MB':>7} {'cpu ms/msg':>10}")
+    results = []
+    try:
+        for rows in [int(value) for value in args.rows.split(',')]:
+            write_contacts(os.path.join('data', 'contacts.csv'), rows)
+            for size_kb in [int(value) for value in args.attachments.split(',')]:
+                write_attachment('data', size_kb)
+                for transport in transports:
+                    result = run(server, client, args, transport)
+                    mode = f'a{args.concurrency}' if args.adaptive else f'c{args.concurrency}'
+                    result['config'] = f'{transport}/{args.engine}/{mode}/{rows}/{size_kb}KB'
+                    results.append(result)
+                    p50 = f"{result['p50_ms']:.1f}" if result['p50_ms'] is not None else '-'
+                    p99 = f"{result['p99_ms']:.1f}" if result['p99_ms'] is not None else '-'
+                    cpu = f"{result['cpu_ms_per_message']:.3f}" if result['cpu_ms_per_message'] is not None else '-'
+                    print(f"{transport:<10} {rows:>8} {f'{size_kb}KB':>7} {result['sent']:>8} {result['failed']:>7} "
+                          f"{result['seconds']:>8.2f} {result['per_second']:>8.0f} {p50:>8} {p99:>8} "
+                          f"{result['peak_rss_mb']:>7.0f} {cpu:>10}", flush=True)
+                    if result['concurrency']:
+                        print(f"{'':<10} concurrency: {result['concurrency']}")
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        os.chdir(BACKEND_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        regressed = compare(results, args.baseline, args.tolerance)
+        if regressed:
+            print(f"Slower than the baseline by more than {args.tolerance:.0%}: {', '.join(regressed)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
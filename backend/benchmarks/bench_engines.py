@@ -0,0 +1,134 @@
+"""Compare the threads and async sending engines against a local SMTP sink
+
+Runs real campaigns through start_campaign in a scratch data folder, with
+the sink adding a fixed latency to every DATA reply like a remote relay.
+
+Run from the backend directory:
+    python benchmarks/bench_engines.py --contacts 5000 --concurrency 10,100,500 --latency 0.05
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import logging
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from smtp_sink import SMTPSink
+
+
+def rss_mb():
+    """Current resident set size, from /proc where available"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def write_contacts(path, count):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('email,name\n')
+        for i in range(count):
+            f.write(f'user{i}@example.com,User {i}\n')
+
+
+def run(server, sink, engine, concurrency, port, render_processes, group_recipients):
+    before = sink.stats.snapshot()
+    with server.app.test_request_context(json={}):
+        response = server.start_campaign({
+            'smtp_host': '127.0.0.1',
+            'port': port,
+            'username': 'bench',
+            'password': 'bench',
+            'smtp_starttls': False,
+            'subject': 'Benchmark',
+            'pause_between_messages': 0,
+            'retries': 0,
+            'max_connections': concurrency,
+            'engine': engine,
+            'render_processes': render_processes,
+            'group_recipients': group_recipients,
+            # Without personalization every message is identical and can be grouped
+            'templates': {'EN': 'Hello there' if group_recipients > 1 else 'Hello [NAME]'}
+        })
+    if isinstance(response, tuple):
+        raise RuntimeError(response[0].get_json())
+    campaign = server.campaigns.get(response.get_json()['campaignId'])
+
+    started = time.perf_counter()
+    peak_threads = 0
+    peak_rss = 0.0
+    while not campaign.metrics.completed:
+        peak_threads = max(peak_threads, threading.active_count())
+        peak_rss = max(peak_rss, rss_mb())
+        time.sleep(0.02)
+    elapsed = time.perf_counter() - started
+    after = sink.stats.snapshot()
+    sent = after['recipients'] - before['recipients']
+    transactions = after['messages'] - before['messages']
+    return (sent, transactions, elapsed, peak_threads, peak_rss,
+            campaign.metrics.snapshot()['failed'], campaign.stage_stats.snapshot())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--contacts', type=int, default=2000)
+    parser.add_argument('--concurrency', default='10,100,500',
+                        help='comma separated max_connections values')
+    parser.add_argument('--latency', type=float, default=0.05, help='sink delay per message in seconds')
+    parser.add_argument('--port', type=int, default=2526)
+    parser.add_argument('--engines', default='threads,async')
+    parser.add_argument('--render-processes', type=int, default=0,
+                        help='render on this many processes instead of in the senders')
+    parser.add_argument('--group-recipients', type=int, default=0,
+                        help='recipients per SMTP transaction, with an unpersonalized template')
+    parser.add_argument('--stages', action='store_true', help='print render and send throughput per run')
+    parser.add_argument('--metrics', action='store_true',
+                        help='print the /metrics stage timings and counters after all runs')
+    args = parser.parse_args()
+
+    sink = SMTPSink('127.0.0.1', args.port, args.latency).start_in_thread()
+
+    # server.py keeps its data folder relative to the working directory
+    workdir = tempfile.mkdtemp(prefix='bench-engines-')
+    os.chdir(workdir)
+    os.makedirs('data')
+    write_contacts(os.path.join('data', 'contacts.csv'), args.contacts)
+    import server
+    logging.disable(logging.INFO)
+
+    print(f"{args.contacts} contacts, sink latency {args.latency * 1000:.0f} ms")
+    print(f"{'engine':<8} {'conc':>6} {'sent':>7} {'txns':>7} {'seconds':>8} {'msg/s':>9} "
+          f"{'threads':>8} {'rss MB':>8} {'errors':>7}")
+    try:
+        for concurrency in [int(value) for value in args.concurrency.split(',')]:
+            for engine in args.engines.split(','):
+                sent, transactions, elapsed, threads, rss, errors, stages = run(
+                    server, sink, engine, concurrency, args.port, args.render_processes, args.group_recipients)
+                print(f"{engine:<8} {concurrency:>6} {sent:>7} {transactions:>7} {elapsed:>8.2f} "
+                      f"{sent / elapsed:>9.0f} {threads:>8} {rss:>8.0f} {errors:>7}")
+                if args.stages:
+                    print(f"         stages: {stages}")
+        if args.metrics:
+            exposition = server.app.test_client().get('/metrics').get_data(as_text=True)
+            # Histogram buckets are left to Prometheus, sums and counts give the mean per stage
+            print('\n'.join(line for line in exposition.splitlines()
+                            if not line.startswith('#') and '_bucket{' not in line))
+    finally:
+        sink.stop()
+        os.chdir(BACKEND_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
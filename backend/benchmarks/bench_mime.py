@@ -0,0 +1,100 @@
+"""Compare the shared MIME skeleton with building every message through email.mime
+
+Checks first that both paths produce identical bytes, then reports
+messages per second and the peak memory of rendering one message for a
+few attachment sizes.
+
+Run from the backend directory:
+    python benchmarks/bench_mime.py
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from attachment_cache import AttachmentCache
+from mime_skeleton import flatten
+from render_pipeline import MessageRenderer
+from template_engine import TemplateSet
+
+TEMPLATES = {
+    'EN': 'Hello [NAME],\n\nThanks for your interest in [COMPANY].\nBest regards\n',
+    'FR': 'Bonjour [NAME],\n\nMerci de votre intérêt pour [COMPANY].\nCordialement\n'
+}
+
+EDGE_BODIES = [
+    '',
+    'plain ascii',
+    'trailing newline\n',
+    'From the start\nand From the middle\nFrom again',
+    'mixed\r\nline\rbreaks\n',
+    'unicode é ü 日本',
+    'x' * 2000,
+]
+
+
+def make_attachments(folder, sizes):
+    for index, size in enumerate(sizes):
+        with open(os.path.join(folder, f'attachment{index}.bin'), 'wb') as f:
+            f.write(os.urandom(size))
+    return AttachmentCache(folder).load()
+
+
+def check_identical(renderer):
+    skeleton = renderer.skeleton()
+    for body in EDGE_BODIES:
+        for email in ('user@example.com', 'first.last+tag@sub.example.org'):
+            expected = flatten(renderer.message(email, 'Name', 'EN', body=body, boundary=skeleton.boundary))
+            if skeleton.fill(email, body) != expected:
+                raise AssertionError(f"Skeleton output differs for body {body[:30]!r}")
+
+
+def measure(renderer, count, budget=3.0):
+    """Messages per second over at most `count` contacts or `budget` seconds, and peak bytes of one render"""
+    contacts = [(f'user{i}@example.com', f'User {i}', 'FR' if i % 3 == 0 else 'EN', {'COMPANY': 'Acme'})
+                for i in range(count)]
+    rendered = 0
+    started = time.perf_counter()
+    for email, name, language, extra in contacts:
+        renderer.render(email, name, language, extra)
+        rendered += 1
+        if time.perf_counter() - started > budget:
+            break
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    renderer.render(*contacts[0])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rendered / elapsed, peak
+
+
+def main():
+    template_set = TemplateSet(TEMPLATES)
+    print(f"{'attachments':<16} {'path':<10} {'msg/s':>9} {'peak KB':>10}")
+    for sizes, count in (((), 20000), ((100 * 1024,), 5000), ((1024 * 1024, 200 * 1024), 1000)):
+        folder = tempfile.mkdtemp(prefix='bench-mime-')
+        try:
+            attachments = make_attachments(folder, sizes)
+            label = '+'.join(f'{size // 1024}KB' for size in sizes) or 'none'
+            results = {}
+            for path, use_skeleton in (('email.mime', False), ('skeleton', True)):
+                renderer = MessageRenderer(template_set, 'Campaign subject', 'sender@example.com',
+                                           attachments=attachments, use_skeleton=use_skeleton)
+                if use_skeleton:
+                    check_identical(renderer)
+                results[path] = measure(renderer, count)
+                rate, peak = results[path]
+                print(f"{label:<16} {path:<10} {rate:>9.0f} {peak / 1024:>10.1f}")
+            speedup = results['skeleton'][0] / results['email.mime'][0]
+            print(f"{'':<16} speedup {speedup:.1f}x")
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Compare the compiled template engine with plain str.replace personalization
+
+Run from the backend directory:
+    python benchmarks/bench_templates.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from template_engine import TemplateSet
+
+
+def replace_render(templates, language, fields):
+    """The previous path: scan for a template, then one replace per placeholder"""
+    template = templates.get(language)
+    if not template:
+        for lang, tmpl in templates.items():
+            if tmpl:
+                template = tmpl
+                break
+    for key, value in fields.items():
+        template = template.replace(f"[{key}]", value)
+    return template
+
+
+def make_case(field_count, body_size):
+    keys = ['NAME'] + [f'FIELD_{i}' for i in range(field_count - 1)]
+    filler = '<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>\n'
+    body = filler * max(1, body_size // len(filler))
+    text = 'Hello [NAME],\n' + ''.join(f'[{key}] {body}' for key in keys)
+    templates = {'EN': text, 'ES': text, 'FR': text}
+    fields = {key: f'value-{key.lower()}' for key in keys}
+    return templates, fields
+
+
+def main():
+    number = 2000
+    print(f"{'fields':>6} {'body':>8} {'replace us':>11} {'compiled us':>12} {'speedup':>8}")
+    for field_count, body_size in [(1, 200), (1, 50_000), (5, 2_000), (20, 2_000), (20, 50_000)]:
+        templates, fields = make_case(field_count, body_size)
+        template_set = TemplateSet(templates)
+        # DE is missing, so both paths exercise the fallback
+        assert replace_render(templates, 'DE', fields) == template_set.for_language('DE').render(fields)
+
+        replace_time = timeit.timeit(lambda: replace_render(templates, 'DE', fields), number=number)
+        compiled_time = timeit.timeit(lambda: template_set.for_language('DE').render(fields), number=number)
+        print(f"{field_count:>6} {body_size * field_count:>8} "
+              f"{replace_time / number * 1e6:>11.2f} {compiled_time / number * 1e6:>12.2f} "
+              f"{replace_time / compiled_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Local stand-in for the Gmail API messages.send endpoint, for benchmarks
+
+Serves messages.send, HTTP batch requests and the OAuth token endpoint,
+so campaigns run with GMAIL_API_ENDPOINT pointing here never reach
+Google. Optionally fails a share of the sends with a 400 invalidArgument
+or a 429 rateLimitExceeded, like the real API.
+
+Run from the backend directory:
+    python benchmarks/fake_gmail.py --port 8525 --latency 0.02 --throttle-rate 0.01
+"""
+import json
+import random
+import secrets
+import argparse
+import asyncio
+from email.parser import BytesParser
+
+from aiohttp import web
+
+SEND_PATH = '/gmail/v1/users/{user}/messages/send'
+BATCH_PATH = '/batch/gmail/v1'
+TOKEN_PATH = '/token'
+
+PERMANENT_ERROR = {'error': {
+    'code': 400, 'message': 'Invalid To header (injected)', 'status': 'INVALID_ARGUMENT',
+    'errors': [{'reason': 'invalidArgument', 'domain': 'global', 'message': 'Invalid To header (injected)'}]}}
+THROTTLE_ERROR = {'error': {
+    'code': 429, 'message': 'User-rate limit exceeded (injected)', 'status': 'RESOURCE_EXHAUSTED',
+    'errors': [{'reason': 'rateLimitExceeded', 'domain': 'usageLimits', 'message': 'Rate limit exceeded (injected)'}]}}
+# Seconds a throttled client is asked to wait
+RETRY_AFTER = '1'
+
+
+class FakeGmail:
+    """aiohttp application answering like the Gmail API, with counters of what it received
+
+    latency is added to every send request; a batch request waits once,
+    like the real API processing its calls in parallel.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, throttle_rate=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.stats = {'requests': 0, 'batches': 0, 'sent': 0, 'refused': 0, 'throttled': 0, 'bytes': 0}
+
+    def _outcome(self, raw):
+        """(status, headers, body) of one messages.send call"""
+        draw = self.random.random()
+        if draw < self.error_rate:
+            self.stats['refused'] += 1
+            return 400, {}, PERMANENT_ERROR
+        if draw < self.error_rate + self.throttle_rate:
+            self.stats['throttled'] += 1
+            return 429, {'Retry-After': RETRY_AFTER}, THROTTLE_ERROR
+        self.stats['sent'] += 1
+        self.stats['bytes'] += len(raw)
+        return 200, {}, {'id': secrets.token_hex(8), 'threadId': secrets.token_hex(8), 'labelIds': ['SENT']}
+
+    async def send(self, request):
+        self.stats['requests'] += 1
+        body = await request.json()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        status, headers, payload = self._outcome(body.get('raw', ''))
+        return web.json_response(payload, status=status, headers=headers)
+
+    async def batch(self, request):
+        """multipart/mixed of application/http parts in, the same shape out"""
+        self.stats['requests'] += 1
+        self.stats['batches'] += 1
+        content_type = request.headers['Content-Type']
+        message = BytesParser().parsebytes(
+            f'Content-Type: {content_type}\r\n\r\n'.encode() + await request.read())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        boundary = f'batch_{secrets.token_hex(12)}'
+        parts = []
+        for part in message.get_payload():
+            # Each part is a serialized HTTP request: request line, headers, blank line, JSON body
+            inner = part.get_payload(decode=True) or part.get_payload().encode()
+            body = inner.split(b'\r\n\r\n', 1)[1] if b'\r\n\r\n' in inner else inner.split(b'\n\n', 1)[-1]
+            try:
+                raw = json.loads(body or b'{}').get('raw', '')
+            except ValueError:
+                raw = ''
+            status, headers, payload = self._outcome(raw)
+            reason = {200: 'OK', 400: 'Bad Request', 429: 'Too Many Requests'}[status]
+            extra = ''.join(f'{name}: {value}\r\n' for name, value in headers.items())
+            content_id = part['Content-ID'].strip('<>')
+            parts.append(
+                f'--{boundary}\r\n'
+                f'Content-Type: application/http\r\n'
+                f'Content-ID: <response-{content_id}>\r\n\r\n'
+                f'HTTP/1.1 {status} {reason}\r\n'
+                f'Content-Type: application/json; charset=UTF-8\r\n{extra}\r\n'
+                f'{json.dumps(payload)}\r\n')
+        parts.append(f'--{boundary}--\r\n')
+        return web.Response(body=''.join(parts).encode(),
+                            headers={'Content-Type': f'multipart/mixed; boundary={boundary}'})
+
+    async def token(self, request):
+        return web.json_response({'access_token': f'fake-{secrets.token_hex(8)}', 'expires_in': 3600,
+                                  'token_type': 'Bearer'})
+
+    async def get_stats(self, request):
+        return web.json_response(self.stats)
+
+    def app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post(SEND_PATH, self.send)
+        app.router.add_post(BATCH_PATH, self.batch)
+        app.router.add_post(TOKEN_PATH, self.token)
+        app.router.add_get('/stats', self.get_stats)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8525)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of sends failed with 400')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of sends failed with 429')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    fake = FakeGmail(args.latency, args.error_rate, args.throttle_rate, args.seed)
+    print(f"Fake Gmail API listening on http://{args.host}:{args.port}/", flush=True)
+    web.run_app(fake.app(), host=args.host, port=args.port, print=None, access_log=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""Local SMTP server that accepts and discards every message, for benchmarks
+
+Optionally refuses a share of the recipients, permanently (550) or with a
+452 "slow down" reply, to exercise the retry and back-off paths.
+
+Run from the backend directory:
+    python benchmarks/smtp_sink.py --port 2525 --latency 0.005 --error-rate 0.01 --throttle-rate 0.01
+"""
+import argparse
+import asyncio
+import random
+import threading
+import time
+
+PERMANENT_REPLY = '550 5.1.1 Mailbox unavailable (injected)'
+THROTTLE_REPLY = '452 4.5.3 Too many recipients, slow down (injected)'
+
+
+class SinkStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0
+        self.recipients = 0
+        self.refused = 0
+        self.throttled = 0
+        self.bytes = 0
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'connections': self.connections,
+                'messages': self.messages,
+                'recipients': self.recipients,
+                'refused': self.refused,
+                'throttled': self.throttled,
+                'bytes': self.bytes
+            }
+
+
+class SMTPSink:
+    """Minimal ESMTP server: AUTH is accepted for any credentials, DATA is counted and dropped
+
+    latency is added before every reply to DATA, the way a relay spends time
+    queueing a message. error_rate and throttle_rate are the shares of RCPT
+    commands answered with a permanent 550 or a transient 452.
+    """
+
+    def __init__(self, host='127.0.0.1', port=2525, latency=0.0, error_rate=0.0, throttle_rate=0.0, seed=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.stats = SinkStats()
+        self._server = None
+
+    def _rcpt_reply(self):
+        draw = self.random.random()
+        if draw < self.error_rate:
+            with self.stats.lock:
+                self.stats.refused += 1
+            return PERMANENT_REPLY
+        if draw < self.error_rate + self.throttle_rate:
+            with self.stats.lock:
+                self.stats.throttled += 1
+            return THROTTLE_REPLY
+        with self.stats.lock:
+            self.stats.recipients += 1
+        return '250 2.1.5 OK'
+
+    async def _reply(self, writer, line):
+        writer.write(line.encode() + b'\r\n')
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        with self.stats.lock:
+            self.stats.connections += 1
+        await self._reply(writer, '220 sink ESMTP ready')
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode('utf-8', 'replace').strip()
+                verb = command.split(' ', 1)[0].upper()
+                if verb in ('EHLO', 'HELO'):
+                    writer.write(b'250-sink\r\n250-PIPELINING\r\n250-8BITMIME\r\n250-SIZE 52428800\r\n250 AUTH PLAIN LOGIN\r\n')
+                    await writer.drain()
+                elif verb == 'AUTH':
+                    parts = command.split()
+                    if len(parts) >= 2 and parts[1].upper() == 'LOGIN':
+                        # Prompt for what the client did not send inline, answers are ignored
+                        prompts = ['334 UGFzc3dvcmQ6']
+                        if len(parts) == 2:
+                            prompts.insert(0, '334 VXNlcm5hbWU6')
+                        for prompt in prompts:
+                            await self._reply(writer, prompt)
+                            await reader.readline()
+                    elif len(parts) == 2:
+                        await self._reply(writer, '334 ')
+                        await reader.readline()
+                    await self._reply(writer, '235 2.7.0 Authentication successful')
+                elif verb == 'MAIL':
+                    await self._reply(writer, '250 2.1.0 OK')
+                elif verb == 'RCPT':
+                    await self._reply(writer, self._rcpt_reply())
+                elif verb == 'DATA':
+                    await self._reply(writer, '354 End data with <CR><LF>.<CR><LF>')
+                    size = 0
+                    while True:
+                        data_line = await reader.readline()
+                        if not data_line or data_line == b'.\r\n':
+                            break
+                        size += len(data_line)
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    with self.stats.lock:
+                        self.stats.messages += 1
+                        self.stats.bytes += size
+                    await self._reply(writer, '250 2.0.0 OK queued')
+                elif verb in ('RSET', 'NOOP'):
+                    await self._reply(writer, '250 2.0.0 OK')
+                elif verb == 'QUIT':
+                    await self._reply(writer, '221 2.0.0 Bye')
+                    break
+                else:
+                    await self._reply(writer, '502 5.5.2 Command not implemented')
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        self._server = await asyncio.start_server(self.handle, self.host, self.port)
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start_in_thread(self):
+        """Run the sink on its own event loop thread, returns once it accepts connections"""
+        ready = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            self._loop = loop
+            asyncio.set_event_loop(loop)
+            self._server = loop.run_until_complete(
+                asyncio.start_server(self.handle, self.host, self.port))
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if getattr(self, '_loop', None):
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2525)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added before each DATA reply')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of recipients refused with 550')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of recipients deferred with 452')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--quiet', action='store_true', help='do not print the counters every 5 seconds')
+    args = parser.parse_args()
+
+    sink = SMTPSink(args.host, args.port, args.latency, args.error_rate, args.throttle_rate,
+                    args.seed).start_in_thread()
+    print(f"SMTP sink listening on {args.host}:{args.port}", flush=True)
+    try:
+        while True:
+            time.sleep(5)
+            if not args.quiet:
+                print(sink.stats.snapshot(), flush=True)
+    except KeyboardInterrupt:
+        sink.stop()
+
+
+if __name__ == '__main__':
+    main()
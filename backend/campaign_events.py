@@ -0,0 +1,142 @@
+import json
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# At most this many progress events per second reach a client
+DEFAULT_INTERVAL = 0.5
+# Comment lines keep proxies from closing idle streams and reveal gone clients
+HEARTBEAT_SECONDS = 15
+# Weight of the newest sample in the smoothed send rate
+RATE_SMOOTHING = 0.3
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class _Subscriber:
+    """One open event stream; deltas published while it is busy are merged, never queued"""
+
+    def __init__(self, key, snapshot):
+        self.key = key
+        self.cond = threading.Condition()
+        self.pending = dict(snapshot)
+
+    def push(self, delta):
+        with self.cond:
+            self.pending.update(delta)
+            self.cond.notify()
+
+    def take(self, timeout):
+        with self.cond:
+            if not self.pending:
+                self.cond.wait(timeout)
+            pending, self.pending = self.pending, {}
+            return pending
+
+
+class _Channel:
+    """The streams following one campaign, with the state last published to them"""
+
+    def __init__(self):
+        self.subscribers = set()
+        self.last = {}
+        self.rate = 0.0
+        self.sample = None
+
+
+class EventBroadcaster:
+    """Single thread that samples campaign progress and pushes changes to every stream
+
+    snapshot(key) returns the current progress dict of a campaign, key None
+    meaning the latest one. Every interval the broadcaster computes it once
+    per campaign followed, adds a smoothed send rate, and publishes only the
+    fields that changed, however many clients are connected.
+    """
+
+    def __init__(self, snapshot, interval=DEFAULT_INTERVAL):
+        self.snapshot = snapshot
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._subscribed = threading.Condition(self._lock)
+        self._channels = {}
+        self._thread = None
+
+    def _current(self, key, channel):
+        state = self.snapshot(key)
+        now = time.monotonic()
+        sent = state.get('sent', 0)
+        if channel.sample is not None and now > channel.sample[0]:
+            instant = max(sent - channel.sample[1], 0) / (now - channel.sample[0])
+            channel.rate += RATE_SMOOTHING * (instant - channel.rate)
+        channel.sample = (now, sent)
+        state['rate'] = round(channel.rate, 1) if state.get('isRunning') else 0.0
+        return state
+
+    def _run(self):
+        while True:
+            with self._lock:
+                # Nothing is sampled while no stream is open
+                while not self._channels:
+                    self._subscribed.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                channels = [(key, channel, list(channel.subscribers)) for key, channel in self._channels.items()]
+            for key, channel, subscribers in channels:
+                try:
+                    state = self._current(key, channel)
+                except Exception as e:
+                    logger.error(f"Error reading campaign progress: {e}")
+                    continue
+                delta = {field: value for field, value in state.items() if channel.last.get(field) != value}
+                channel.last = state
+                if delta:
+                    for subscriber in subscribers:
+                        subscriber.push(delta)
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='campaign-events', daemon=True)
+            self._thread.start()
+
+    def subscribe(self, key=None):
+        with self._lock:
+            self._ensure_thread()
+            channel = self._channels.get(key)
+            if channel is None:
+                channel = self._channels[key] = _Channel()
+            # A new stream starts from the full state, then receives deltas
+            subscriber = _Subscriber(key, channel.last or self.snapshot(key))
+            channel.subscribers.add(subscriber)
+            self._subscribed.notify()
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            channel = self._channels.get(subscriber.key)
+            if channel is not None:
+                channel.subscribers.discard(subscriber)
+                if not channel.subscribers:
+                    del self._channels[subscriber.key]
+
+    def client_count(self):
+        with self._lock:
+            return sum(len(channel.subscribers) for channel in self._channels.values())
+
+    def stream(self, key=None):
+        """Generator of SSE lines for one client following campaign key, for a streaming Flask Response"""
+        subscriber = self.subscribe(key)
+        try:
+            # Ask the browser to wait a few seconds before reconnecting
+            yield "retry: 3000\n\n"
+            while True:
+                delta = subscriber.take(HEARTBEAT_SECONDS)
+                if delta:
+                    yield format_event('progress', delta)
+                else:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscriber)
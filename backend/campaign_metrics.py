@@ -0,0 +1,162 @@
+import weakref
+import threading
+from collections import deque
+from rate_limiter import smtp_reply_code, http_status, gmail_error_reason
+
+# Recent error messages kept per campaign, older ones are only counted by class
+ERROR_RING_SIZE = 100
+
+
+def error_class(error):
+    """Group an exception for reporting: smtp_550, gmail_429_rateLimitExceeded, or the exception type"""
+    if error is None:
+        return 'other'
+    code = smtp_reply_code(error)
+    if code is not None:
+        return f'smtp_{code}'
+    status = http_status(error)
+    if status is not None:
+        reason = gmail_error_reason(error)
+        return f'gmail_{status}_{reason}' if reason else f'gmail_{status}'
+    return type(error).__name__
+
+
+def _add_counts(totals, shard):
+    """Add the numbers of a shard into totals"""
+    # Copying the items is atomic under the GIL, the owner may keep writing
+    for name, count in list(shard.items()):
+        totals[name] = totals.get(name, 0) + count
+
+
+class _ShardOwner:
+    """Only referenced from a thread's local storage, so it is freed when the thread exits"""
+
+    __slots__ = ('__weakref__',)
+
+
+def _retire_shard(counters_ref, shard):
+    counters = counters_ref()
+    if counters is not None:
+        counters._retire(shard)
+
+
+class ShardedCounters:
+    """Named counters with one shard per thread
+
+    A thread only ever writes its own shard, so increments take no lock;
+    reads sum the shards. The lock is only taken when a thread registers,
+    when it exits (its shard is folded into the totals of exited threads,
+    so worker threads of past campaigns leave no shard behind) and to read.
+    merge(totals, shard) adds a shard into totals, numbers by default.
+    """
+
+    def __init__(self, merge=_add_counts):
+        self._merge = merge
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = {}
+        self._retired = {}
+
+    def shard(self):
+        """The calling thread's dict, only that thread may write to it"""
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {}
+            owner = _ShardOwner()
+            with self._lock:
+                self._shards[id(shard)] = shard
+            # Holds the counters weakly, a thread outliving them keeps nothing alive
+            weakref.finalize(owner, _retire_shard, weakref.ref(self), shard).atexit = False
+            self._local.shard = shard
+            self._local.owner = owner
+        return shard
+
+    def _retire(self, shard):
+        with self._lock:
+            if self._shards.pop(id(shard), None) is not None:
+                self._merge(self._retired, shard)
+
+    def add(self, name, amount=1):
+        shard = self.shard()
+        shard[name] = shard.get(name, 0) + amount
+
+    def totals(self):
+        totals = {}
+        with self._lock:
+            self._merge(totals, self._retired)
+            for shard in self._shards.values():
+                self._merge(totals, shard)
+        return totals
+
+
+class ErrorRing:
+    """The last `capacity` error messages, appends are atomic and never grow memory"""
+
+    def __init__(self, capacity=ERROR_RING_SIZE):
+        self._messages = deque(maxlen=capacity)
+
+    def add(self, message):
+        self._messages.append(message)
+
+    def recent(self, count):
+        messages = list(self._messages)
+        return messages[-count:] if count else []
+
+
+class CampaignMetrics:
+    """Progress of one campaign: counters, recent errors and failures by class
+
+    Every campaign gets a fresh instance, so a reset or a new campaign never
+    mixes its numbers with workers that are still finishing.
+    """
+
+    def __init__(self, campaign_id=None, total=0, skipped=0):
+        self.campaign_id = campaign_id
+        self.total = total
+        # Recipients finished before a resume, part of total but not of this run
+        self.skipped = skipped
+        self.is_running = False
+        self.completed = False
+        self.counters = ShardedCounters()
+        self.error_classes = ShardedCounters()
+        self.errors = ErrorRing()
+
+    def record_sent(self):
+        self.counters.add('sent')
+
+    def record_retry(self):
+        self.counters.add('retried')
+
+    def record_failed(self, message, error=None):
+        self.counters.add('failed')
+        self.record_error(message, error)
+
+    def record_error(self, message, error=None):
+        """An error message for the ring; errors that are not a failed recipient go here too"""
+        self.errors.add(message)
+        self.error_classes.add(error_class(error))
+
+    def record_processed(self, count=1):
+        self.counters.add('processed', count)
+
+    def record_suppressed(self):
+        """A recipient on the suppression list, done without being sent"""
+        self.counters.add('suppressed')
+        self.counters.add('processed')
+
+    def snapshot(self, recent_errors=5):
+        counters = self.counters.totals()
+        processed = counters.get('processed', 0)
+        return {
+            'campaign_id': self.campaign_id,
+            'is_running': self.is_running,
+            'completed': self.completed,
+            'total': self.total,
+            'remaining': max(self.total - self.skipped - processed, 0),
+            'sent': counters.get('sent', 0),
+            'failed': counters.get('failed', 0),
+            'retried': counters.get('retried', 0),
+            'suppressed': counters.get('suppressed', 0),
+            'errors': self.errors.recent(recent_errors),
+            'error_classes': self.error_classes.totals()
+        }
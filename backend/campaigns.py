@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+
+# Finished campaigns kept for /campaign-status after they complete
+MAX_FINISHED = 20
+
+
+class Campaign:
+    """One campaign of this process and everything its senders share
+
+    start_campaign fills in the queue, limiters, pool and the rest as it
+    builds them; status routes and /metrics read them from here instead of
+    from process-wide globals, so campaigns run side by side.
+    """
+
+    def __init__(self, campaign_id, metrics, weight=1.0, engine='threads'):
+        self.id = campaign_id
+        self.metrics = metrics
+        self.weight = weight
+        self.engine = engine
+        self.templates = None
+        self.attachments = []
+        self.work_queue = None
+        self.retry_scheduler = None
+        self.rate_limiter = None
+        self.concurrency = None
+        self.pool = None
+        self.stage_stats = None
+        self.sent_log = None
+
+    @property
+    def is_running(self):
+        return self.metrics.is_running
+
+    def queue_depth(self):
+        return self.work_queue.qsize() if self.work_queue is not None else 0
+
+
+class CampaignRegistry:
+    """Campaigns of this process by id, in start order
+
+    Requests that name no campaign get the latest one. Running campaigns
+    stay until they finish; of the finished ones only the last
+    MAX_FINISHED are kept.
+    """
+
+    def __init__(self, max_finished=MAX_FINISHED):
+        self.max_finished = max_finished
+        self._lock = threading.Lock()
+        self._campaigns = OrderedDict()
+
+    def add(self, campaign):
+        with self._lock:
+            self._campaigns.pop(campaign.id, None)
+            self._campaigns[campaign.id] = campaign
+            finished = [key for key, other in self._campaigns.items() if not other.is_running]
+            for key in finished[:max(len(finished) - self.max_finished, 0)]:
+                del self._campaigns[key]
+
+    def get(self, campaign_id=None):
+        """The named campaign, or the latest one when campaign_id is None; None if unknown"""
+        with self._lock:
+            if campaign_id is not None:
+                return self._campaigns.get(campaign_id)
+            return next(reversed(self._campaigns.values()), None)
+
+    def all(self):
+        with self._lock:
+            return list(self._campaigns.values())
+
+    def running(self):
+        return [campaign for campaign in self.all() if campaign.is_running]
+
+    def remove_finished(self):
+        """Forget the finished campaigns, returns how many there were"""
+        with self._lock:
+            finished = [key for key, campaign in self._campaigns.items() if not campaign.is_running]
+            for key in finished:
+                del self._campaigns[key]
+        return len(finished)
@@ -0,0 +1,183 @@
+import time
+import asyncio
+import threading
+import logging
+from rate_limiter import throttle_delay, smtp_reply_code, http_status
+
+logger = logging.getLogger(__name__)
+
+# Completed sends per adjustment, at least; a window is otherwise one send per slot
+MIN_WINDOW = 10
+# Average latency above this multiple of the no-load latency counts as overload
+LATENCY_TOLERANCE = 2.0
+# How fast the no-load latency follows a lasting increase, per window
+BASELINE_DRIFT = 0.05
+# Multiplicative decreases for a throttling reply and for dropped connections or slow replies
+THROTTLE_DECREASE = 0.5
+OVERLOAD_DECREASE = 0.8
+
+OK = 'ok'
+THROTTLED = 'throttled'
+DROPPED = 'dropped'
+
+
+def classify(error):
+    """How a send outcome bears on concurrency: ok, throttled or dropped
+
+    A reply about the recipient (550 unknown user, 400 invalid address) is
+    not a sign of load; throttling replies are, and so are errors without
+    any reply such as resets and timeouts.
+    """
+    if error is None:
+        return OK
+    if throttle_delay(error) is not None:
+        return THROTTLED
+    if smtp_reply_code(error) is not None or http_status(error) is not None:
+        return OK
+    return DROPPED
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on the sends in flight, between `minimum` and `ceiling`
+
+    Starts in slow start, doubling the limit after every window in which
+    all slots were busy, then grows by one per window once the first
+    decrease happened. Throttling replies halve the limit; dropped
+    connections or an average latency over LATENCY_TOLERANCE times the
+    no-load latency cut it by a fifth.
+
+    Waiting senders are woken last in, first out, so the same few threads
+    keep sending and the pooled sessions of the others go idle and close.
+    Threads use acquire(), coroutines acquire_async(); both pass the value
+    they got to release() with the errors of the send.
+    """
+
+    def __init__(self, ceiling, minimum=1, initial=None):
+        self.ceiling = max(int(ceiling), 1)
+        self.minimum = max(min(int(minimum), self.ceiling), 1)
+        self.limit = float(initial or max(self.minimum, min(self.ceiling, 4)))
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._waiters = []
+        self._slow_start = True
+        self._baseline = None
+        self._window = self._new_window()
+        self.counters = {'increases': 0, 'decreases': 0, 'throttled': 0, 'dropped': 0}
+
+    def _new_window(self):
+        return {'samples': 0, 'latency': 0.0, 'throttled': 0, 'dropped': 0, 'saturated': False}
+
+    def _take(self):
+        """A free slot for the caller, under the lock; waiting senders go first"""
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            if self.in_flight >= int(self.limit):
+                self._window['saturated'] = True
+            return True
+        self._window['saturated'] = True
+        return False
+
+    def _wake(self):
+        # Hand free slots to the most recent waiters, in_flight counts them from here
+        while self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            self._waiters.pop()()
+
+    def acquire(self):
+        """Block until a slot is free, returns the start time to pass to release()"""
+        with self._lock:
+            if self._take():
+                return time.perf_counter()
+            event = threading.Event()
+            self._waiters.append(event.set)
+        event.wait()
+        return time.perf_counter()
+
+    async def acquire_async(self):
+        """acquire() for coroutines of the event loop thread"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._take():
+                return time.perf_counter()
+            future = loop.create_future()
+
+            def wake():
+                loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+            self._waiters.append(wake)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if wake in self._waiters:
+                    self._waiters.remove(wake)
+                else:
+                    # The slot was handed over already, give it back
+                    self.in_flight -= 1
+                    self._wake()
+            raise
+        return time.perf_counter()
+
+    def release(self, started, errors=()):
+        """Free the slot of a finished send and feed its latency and errors to the controller"""
+        latency = time.perf_counter() - started
+        outcomes = {classify(error) for error in errors if error is not None}
+        with self._lock:
+            self.in_flight -= 1
+            window = self._window
+            window['samples'] += 1
+            window['latency'] += latency
+            if THROTTLED in outcomes:
+                window['throttled'] += 1
+            elif DROPPED in outcomes:
+                window['dropped'] += 1
+            if window['samples'] >= max(int(self.limit), MIN_WINDOW):
+                self._adjust(window)
+                self._window = self._new_window()
+            self._wake()
+
+    def cancel(self):
+        """Free a slot that was given up before sending, without a latency sample"""
+        with self._lock:
+            self.in_flight -= 1
+            self._wake()
+
+    def _adjust(self, window):
+        average = window['latency'] / window['samples']
+        if self._baseline is None or average < self._baseline:
+            self._baseline = average
+        else:
+            self._baseline += (average - self._baseline) * BASELINE_DRIFT
+
+        previous = self.limit
+        if window['throttled']:
+            self.counters['throttled'] += window['throttled']
+            self.limit = max(self.minimum, self.limit * THROTTLE_DECREASE)
+        elif window['dropped'] or average > self._baseline * LATENCY_TOLERANCE:
+            self.counters['dropped'] += window['dropped']
+            self.limit = max(self.minimum, self.limit * OVERLOAD_DECREASE)
+        elif window['saturated']:
+            # No room to grow is only known when every slot was in use
+            step = self.limit if self._slow_start else 1
+            self.limit = min(self.ceiling, self.limit + step)
+
+        if self.limit < previous:
+            self._slow_start = False
+            self.counters['decreases'] += 1
+            logger.info(f"Concurrency lowered to {int(self.limit)} (average latency {average * 1000:.0f} ms, "
+                        f"{window['throttled']} throttled, {window['dropped']} dropped)")
+        elif self.limit > previous:
+            self.counters['increases'] += 1
+            logger.debug(f"Concurrency raised to {int(self.limit)}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats.update({
+                'limit': int(self.limit),
+                'ceiling': self.ceiling,
+                'in_flight': self.in_flight,
+                'waiting': len(self._waiters),
+                'baseline_ms': round(self._baseline * 1000, 1) if self._baseline is not None else None
+            })
+        return stats
@@ -0,0 +1,173 @@
+import io
+import os
+import re
+import csv
+import gzip
+import math
+import hashlib
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Addresses kept in an exact set before switching to a Bloom filter
+EXACT_LIMIT = 1_000_000
+# False positive rate of the Bloom filter: that share of unique addresses is dropped as duplicate
+BLOOM_ERROR_RATE = 0.001
+
+# Pragmatic syntax check: no spaces or specials in the local part, a dotted domain of valid labels
+EMAIL_PATTERN = re.compile(
+    r'^[^\s@"(),:;<>\[\]\\]+@[^\W_](?:[\w-]{0,61}[^\W_])?(?:\.[^\W_](?:[\w-]{0,61}[^\W_])?)+$')
+MAX_EMAIL_LENGTH = 254
+MAX_LOCAL_LENGTH = 64
+
+# Rejection categories reported by the upload
+MISSING = 'missing_email'
+INVALID = 'invalid'
+DUPLICATE = 'duplicate'
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+def is_valid_email(email):
+    local = email.split('@', 1)[0]
+    if len(email) > MAX_EMAIL_LENGTH or len(local) > MAX_LOCAL_LENGTH:
+        return False
+    if local.startswith('.') or local.endswith('.') or '..' in local:
+        return False
+    return EMAIL_PATTERN.match(email) is not None
+
+
+class BloomFilter:
+    """Fixed-size set membership with no false negatives and `error_rate` false positives at capacity"""
+
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE):
+        self.capacity = capacity
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing over one 128-bit digest instead of k separate hashes
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size
+
+    def add(self, key):
+        """Add key, returns False when it was (probably) there already"""
+        added = False
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                self.bits[byte] |= 1 << bit
+                added = True
+        return added
+
+
+class Deduplicator:
+    """Seen addresses: an exact set up to `exact_limit`, then a Bloom filter
+
+    The set costs around 100 bytes per address; past the limit its contents
+    move to a Bloom filter sized for `expected` addresses (at least four
+    times the limit), about 2 bytes per address.
+    """
+
+    def __init__(self, exact_limit=EXACT_LIMIT, expected=None):
+        self.exact_limit = exact_limit
+        self.expected = expected
+        self.seen = set()
+        self.bloom = None
+
+    def add(self, key):
+        """Add a normalized address, returns False for a duplicate"""
+        if self.bloom is not None:
+            return self.bloom.add(key)
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        if len(self.seen) > self.exact_limit:
+            self._switch()
+        return True
+
+    def _switch(self):
+        capacity = max(self.expected or 0, self.exact_limit * 4)
+        logger.info(f"Over {self.exact_limit} unique addresses, deduplicating with a Bloom filter "
+                    f"for {capacity} addresses")
+        self.bloom = BloomFilter(capacity)
+        for key in self.seen:
+            self.bloom.add(key)
+        self.seen = None
+
+
+def open_upload(stream, filename=''):
+    """Text stream of an uploaded file, decompressed when it is gzip (by magic bytes or .gz name)"""
+    if stream.seekable():
+        head = stream.read(2)
+        stream.seek(0)
+    else:
+        stream = io.BufferedReader(stream)
+        head = stream.peek(2)[:2]
+    if head == GZIP_MAGIC or filename.endswith('.gz'):
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    # utf-8-sig drops the byte order mark spreadsheet exports start with
+    return io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+
+def ingest_contacts(stream, path, process_contact, plain_list=False, default_language='FR',
+                    dedup=None):
+    """Validate and deduplicate an upload in one pass while writing the cleaned CSV to `path`
+
+    The CSV header is kept as is; a plain list (one email per line) gets
+    an email,name,language header and default_language. The file is
+    written next to `path` and moved over it only when the upload was
+    read completely, so a broken upload leaves the previous list alone.
+    Returns {'total', 'rows', 'rejected': {category: count}}.
+    """
+    dedup = dedup or Deduplicator()
+    rejected = {MISSING: 0, INVALID: 0, DUPLICATE: 0}
+    rows = 0
+    total = 0
+
+    directory = os.path.dirname(path) or '.'
+    fd, temp_path = tempfile.mkstemp(prefix='.upload-', suffix='.csv', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as out:
+            writer = csv.writer(out, lineterminator='\n')
+            if plain_list:
+                writer.writerow(['email', 'name', 'language'])
+                records = ([line.strip(), '', default_language] for line in stream if line.strip())
+            else:
+                records = csv.reader(stream)
+                header = next(records, None)
+                if header is None:
+                    raise ValueError("The file is empty")
+                writer.writerow(header)
+
+            for record in records:
+                if not any(field.strip() for field in record):
+                    continue  # Blank line
+                rows += 1
+                email = process_contact(record)[0].strip()
+                if not email:
+                    rejected[MISSING] += 1
+                    continue
+                if not is_valid_email(email):
+                    rejected[INVALID] += 1
+                    continue
+                if not dedup.add(normalize_email(email)):
+                    rejected[DUPLICATE] += 1
+                    continue
+                record[0] = email
+                writer.writerow(record)
+                total += 1
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return {'total': total, 'rows': rows, 'rejected': rejected}
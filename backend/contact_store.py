@@ -0,0 +1,694 @@
+import os
+import io
+import csv
+import sys
+import json
+import mmap
+import heapq
+import array
+import bisect
+import struct
+import secrets
+import itertools
+import tempfile
+import threading
+import logging
+from template_engine import normalize_field
+from contact_ingest import is_valid_email
+
+logger = logging.getLogger(__name__)
+
+# Store file layout: header, JSON metadata, then 8-byte aligned sections.
+# Every string column is an offsets table (rows + 1 entries, uint32 unless
+# its heap passes 4 GB) and a UTF-8 heap; languages are uint16 codes into
+# the interned table of the metadata, with one sorted uint32 row list of
+# live rows per language. Deleted rows stay as tombstones (a uint8 flag)
+# so row numbers never move.
+STORE_MAGIC = b'CSTORE02'
+STORE_HEADER = struct.Struct('<8sQQQQ')  # magic, source mtime_ns, source size, row count, metadata length
+
+# Write buffer of each column heap while building, and copy chunk size
+WRITE_BUFFER = 1024 * 1024
+
+# Edits kept in the change log before they are compacted into a new store,
+# and the longest an edit waits for a compaction
+COMPACT_OPS = 10000
+COMPACT_INTERVAL = 300.0
+
+# Patch operations
+ADD = 'add'
+UPDATE = 'update'
+DELETE = 'delete'
+
+
+def _pad(length):
+    return -length % 8
+
+
+def _little_endian(values):
+    if values.itemsize != {'B': 1, 'H': 2, 'I': 4, 'Q': 8}[values.typecode]:
+        raise RuntimeError(f"Array type {values.typecode} has an unexpected size")
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def _new_generation():
+    return secrets.randbits(63)
+
+
+class _StringColumnWriter:
+    """Offsets in memory, the UTF-8 heap spooled to a temporary file"""
+
+    def __init__(self):
+        self.offsets = array.array('Q', [0])
+        self.heap = tempfile.TemporaryFile(buffering=WRITE_BUFFER)
+
+    def add(self, text):
+        data = text.encode('utf-8')
+        self.heap.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+    def sections(self):
+        self.heap.seek(0)
+        offsets = self.offsets if self.offsets[-1] >= 2 ** 32 else array.array('I', self.offsets)
+        return _little_endian(offsets), self.heap, self.offsets[-1]
+
+
+def write_store(path, source, header, raw_positions, records, generation, previous=None, log_offset=0):
+    """Write a store file from (email, name, language, raw_values, deleted) records in row order
+
+    source is the (mtime_ns, size) of the CSV the contacts came from. A
+    compacted store names the store it replaces (previous) and how far it
+    read that store's change log (log_offset), so a crash between replacing
+    the store and the log can be recovered from.
+    """
+    email_column = _StringColumnWriter()
+    name_column = _StringColumnWriter()
+    raw_columns = [_StringColumnWriter() for _ in raw_positions]
+    codes = array.array('H')
+    deleted = array.array('B')
+    interned = {}
+    partitions = []
+    for email, name, language, raw_values, is_deleted in records:
+        code = interned.get(language)
+        if code is None:
+            if len(interned) > 0xFFFF:
+                raise ValueError("Too many distinct languages")
+            code = interned[language] = len(interned)
+            partitions.append(array.array('I'))
+        if not is_deleted:
+            partitions[code].append(len(codes))
+        codes.append(code)
+        deleted.append(is_deleted)
+        email_column.add(email)
+        name_column.add(name)
+        for column, value in zip(raw_columns, raw_values):
+            column.add(value)
+
+    # Sections in file order: (name, array or (file, size))
+    sections = []
+    for column_name, column in [('email', email_column), ('name', name_column)] + [
+            (f'raw:{position}', column) for position, column in zip(raw_positions, raw_columns)]:
+        offsets, heap, size = column.sections()
+        sections.append((f'{column_name}.offsets', offsets))
+        sections.append((f'{column_name}.heap', (heap, size)))
+    sections.append(('language', _little_endian(codes)))
+    sections.append(('deleted', deleted))
+    for code, rows in enumerate(partitions):
+        sections.append((f'partition:{code}', _little_endian(rows)))
+
+    layout = {}
+    position = 0
+    for section_name, data in sections:
+        if isinstance(data, tuple):
+            size, typecode = data[1], None
+        else:
+            size, typecode = len(data) * data.itemsize, data.typecode
+        layout[section_name] = [position, size, typecode]
+        position += size + _pad(size)
+    metadata = json.dumps({
+        'header': header,
+        'columns': [normalize_field(column) for column in header],
+        'raw_positions': raw_positions,
+        'languages': list(interned),
+        'deleted': deleted.count(1),
+        'generation': generation,
+        'previous': previous,
+        'log_offset': log_offset,
+        'sections': layout
+    }).encode('utf-8')
+    metadata += b' ' * _pad(STORE_HEADER.size + len(metadata))
+
+    with open(path, 'wb') as f:
+        f.write(STORE_HEADER.pack(STORE_MAGIC, source[0], source[1], len(codes), len(metadata)))
+        f.write(metadata)
+        for section_name, data in sections:
+            if isinstance(data, tuple):
+                heap, size = data
+                while True:
+                    chunk = heap.read(WRITE_BUFFER)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                heap.close()
+            else:
+                size = len(data) * data.itemsize
+                data.tofile(f)
+            f.write(b'\0' * _pad(size))
+        f.flush()
+        os.fsync(f.fileno())
+    logger.info(f"Contact store written: {len(codes)} rows, {deleted.count(1)} deleted, "
+                f"{len(interned)} languages")
+
+
+def build_store(csv_path, store_path, process_contact, generation):
+    """Parse the CSV once and write its contacts (rows with an email) to a store file
+
+    email and name are kept as columns, the language as an interned code.
+    Files with more columns than email,name,language also keep the raw
+    values of the columns from the third on, for templates that use them.
+    """
+    stat = os.stat(csv_path)
+    tmp_path = store_path + '.tmp'
+    with open(csv_path, mode='r', encoding='utf-8', newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader, None) or []
+        raw_positions = list(range(2, len(header))) if len(header) > 3 else []
+
+        def records():
+            for row in reader:
+                email, name, language = process_contact(row)
+                if email:
+                    raw_values = [row[position] if position < len(row) else '' for position in raw_positions]
+                    yield email, name, language, raw_values, False
+
+        write_store(tmp_path, (stat.st_mtime_ns, stat.st_size), header, raw_positions, records(), generation)
+    os.replace(tmp_path, store_path)
+
+
+class ContactTable:
+    """A mapped store file, immutable once opened
+
+    A campaign keeps the contacts it started with; a new upload or a
+    compaction maps a new file and this one is unmapped when its last
+    reader lets go of it.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = f.read(STORE_HEADER.size)
+            if len(header) < STORE_HEADER.size:
+                raise ValueError("Truncated contact store")
+            magic, mtime_ns, size, rows, metadata_length = STORE_HEADER.unpack(header)
+            if magic != STORE_MAGIC:
+                raise ValueError("Not a contact store")
+            metadata = json.loads(f.read(metadata_length))
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.source = (mtime_ns, size)
+        self.rows = rows
+        self.header = metadata['header']
+        self.columns = metadata['columns']
+        self.raw_positions = metadata['raw_positions']
+        # Column holding the language when the raw columns are kept, the one process_contact reads
+        self.language_position = 3 if len(self.header) > 3 else 2
+        self.languages = metadata['languages']
+        self.deleted_count = metadata['deleted']
+        self.generation = metadata['generation']
+        self.previous = metadata['previous']
+        self.log_offset = metadata['log_offset']
+        self._base = STORE_HEADER.size + metadata_length
+        self._layout = metadata['sections']
+        self._email = self._string_column('email')
+        self._name = self._string_column('name')
+        self._raw = [self._string_column(f'raw:{position}') for position in self.raw_positions]
+        self._codes = self._section('language')
+        self._deleted = self._section('deleted')
+        self._partitions = [self._section(f'partition:{code}') for code in range(len(self.languages))]
+
+    def _section(self, name):
+        """An array section as a typed memoryview, a heap as its start position"""
+        start, size, typecode = self._layout[name]
+        start += self._base
+        if typecode is None:
+            return start
+        return memoryview(self._mmap)[start:start + size].cast(typecode)
+
+    def _string_column(self, name):
+        return self._section(f'{name}.offsets'), self._section(f'{name}.heap')
+
+    def _string(self, column, row):
+        offsets, heap = column
+        return self._mmap[heap + offsets[row]:heap + offsets[row + 1]].decode('utf-8')
+
+    def is_deleted(self, row):
+        return self._deleted[row] == 1
+
+    def language(self, row):
+        return self.languages[self._codes[row]]
+
+    def record(self, row):
+        """(email, name, language) of a row, tombstones included"""
+        return self._string(self._email, row), self._string(self._name, row), self.language(row)
+
+    def raw_values(self, row):
+        return [self._string(column, row) for column in self._raw]
+
+    def language_counts(self):
+        return {language: len(rows) for language, rows in zip(self.languages, self._partitions)}
+
+    def partition(self, language):
+        """Sorted live rows whose language matches, case-insensitively"""
+        matches = [rows for code, rows in enumerate(self._partitions)
+                   if self.languages[code].upper() == language.upper()]
+        if len(matches) == 1:
+            return matches[0]
+        return array.array('I', heapq.merge(*matches))
+
+
+class ContactChanges:
+    """Edits made since the store was written, by row
+
+    Rows past the last row of the store are contacts added since; store
+    rows that are deleted become tombstones at the next compaction.
+    """
+
+    def __init__(self, base_rows):
+        self.base_rows = base_rows
+        self.updated = {}
+        self.deleted = set()
+        self.added = []
+        self.ops = 0
+
+    def copy(self):
+        changes = ContactChanges(self.base_rows)
+        changes.updated = dict(self.updated)
+        changes.deleted = set(self.deleted)
+        changes.added = list(self.added)
+        changes.ops = self.ops
+        return changes
+
+    def apply(self, op):
+        """Apply one change log entry; adds and updates carry the whole record"""
+        if op['op'] == DELETE:
+            self.updated.pop(op['row'], None)
+            self.deleted.add(op['row'])
+        else:
+            record = (op['email'], op['name'], op['language'])
+            if op['op'] == ADD:
+                self.added.append(record)
+            elif op['row'] >= self.base_rows:
+                self.added[op['row'] - self.base_rows] = record
+            else:
+                self.updated[op['row']] = record
+        self.ops += 1
+
+
+class ContactList:
+    """The contacts of a table with its pending changes applied
+
+    Row numbers are stable, pages, cursors and campaigns refer to them.
+    Reads cost what they cost on the table plus the pending changes.
+    """
+
+    def __init__(self, table, changes):
+        self.table = table
+        self.changes = changes
+        self.source = table.source
+        self.rows = table.rows + len(changes.added)
+
+    def __len__(self):
+        changes = self.changes
+        deleted = sum(1 for row in changes.deleted if row >= changes.base_rows or not self.table.is_deleted(row))
+        return self.table.rows - self.table.deleted_count + len(changes.added) - deleted
+
+    def record(self, row):
+        """(email, name, language) of a live row, None for deleted or unknown rows"""
+        changes = self.changes
+        if row < 0 or row >= self.rows or row in changes.deleted:
+            return None
+        if row >= changes.base_rows:
+            return changes.added[row - changes.base_rows]
+        if row in changes.updated:
+            return changes.updated[row]
+        if self.table.is_deleted(row):
+            return None
+        return self.table.record(row)
+
+    def raw_values(self, row):
+        if row < self.table.rows:
+            return self.table.raw_values(row)
+        return [''] * len(self.table.raw_positions)
+
+    def values(self, row, record):
+        """The CSV values of a live row: its current email, name and language over the stored columns"""
+        email, name, language = record
+        if not self.table.raw_positions:
+            return [email, name, language]
+        values = [email, name] + self.raw_values(row)
+        values[self.table.language_position] = language
+        return values
+
+    def fields(self, row, record):
+        """The CSV columns of a row by normalized name, for templates"""
+        return {column: value for column, value in zip(self.table.columns, self.values(row, record))}
+
+    def iter_contacts(self, with_columns=False, start_row=0):
+        """Yield (row, email, name, language, extra) of the live rows from start_row"""
+        for row in range(start_row, self.rows):
+            record = self.record(row)
+            if record is None:
+                continue
+            extra = self.fields(row, record) if with_columns else None
+            yield (row,) + record + (extra,)
+
+    def records(self):
+        """Every row as a write_store record, deleted rows as tombstones"""
+        blank = [''] * len(self.table.raw_positions)
+        for row in range(self.rows):
+            record = self.record(row)
+            if record is None:
+                yield '', '', '', blank, True
+            else:
+                raw_values = self.values(row, record)[2:] if self.table.raw_positions else blank
+                yield record + (raw_values, False)
+
+    def language_counts(self):
+        table, changes = self.table, self.changes
+        counts = table.language_counts()
+
+        def shift(language, amount):
+            counts[language] = counts.get(language, 0) + amount
+
+        for row, record in changes.updated.items():
+            if not table.is_deleted(row):
+                shift(table.language(row), -1)
+            shift(record[2], 1)
+        for row in changes.deleted:
+            if row < changes.base_rows and not table.is_deleted(row):
+                shift(table.language(row), -1)
+        for index, record in enumerate(changes.added):
+            if changes.base_rows + index not in changes.deleted:
+                shift(record[2], 1)
+        return {language: count for language, count in counts.items() if count > 0}
+
+    def _language_rows(self, language, offset):
+        """Sorted candidate rows from offset for a language filter: the table's partition
+        without the changed rows, merged with the changed rows that match"""
+        changes = self.changes
+        wanted = language.upper()
+        stored = self.table.partition(language)
+        changed = changes.updated.keys() | changes.deleted
+        unchanged = (row for row in itertools.islice(stored, bisect.bisect_left(stored, offset), None)
+                     if row not in changed)
+        edited = sorted(row for row, record in changes.updated.items()
+                        if row >= offset and record[2].upper() == wanted)
+        # Added rows come after every stored row, already in order
+        edited += [row for row in range(max(changes.base_rows, offset), self.rows)
+                   if changes.added[row - changes.base_rows][2].upper() == wanted]
+        return heapq.merge(unchanged, edited)
+
+    def page(self, offset, limit, search=None, language=None):
+        """Return (contacts, next_row, total) starting at row `offset`
+
+        A language filter reads its partition from the first row at or after
+        `offset`; a search term is matched against email and name until
+        `limit` contacts are found. next_row is where the following page
+        starts, or None at the end. total is unknown when searching.
+        """
+        if language:
+            candidates = self._language_rows(language, offset)
+            total = sum(count for name, count in self.language_counts().items()
+                        if name.upper() == language.upper())
+        else:
+            candidates = iter(range(offset, self.rows))
+            total = len(self)
+        search = search.lower() if search else None
+
+        contacts = []
+        next_row = None
+        for row in candidates:
+            record = self.record(row)
+            if record is None:
+                continue
+            if len(contacts) >= limit:
+                next_row = row
+                break
+            email, name, contact_language = record
+            if search and search not in email.lower() and search not in name.lower():
+                continue
+            contacts.append({"row": row, "email": email, "name": name, "language": contact_language})
+        return contacts, next_row, None if search else total
+
+    def to_csv(self, chunk_rows=10000):
+        """The contacts as CSV text chunks, with the header of the uploaded file"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.table.header or ['email', 'name', 'language'])
+        for count, (row, email, name, language, _) in enumerate(self.iter_contacts(), 1):
+            writer.writerow(self.values(row, (email, name, language)))
+            if count % chunk_rows == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+
+class ContactStore:
+    """The contacts of a CSV file: a memory-mapped column store plus a change log of edits
+
+    The store is built when contacts are imported, and again only when the
+    CSV is changed behind the server's back (size or mtime differ from the
+    ones the store was built from) while the list has no edits: the CSV is
+    not rewritten, so once there are edits the store and its log are the
+    list and a changed CSV is ignored with an error. patch() appends edits to the log (JSON
+    lines after a line naming the store generation they apply to) and keeps
+    them in memory; a background thread compacts them into a new store
+    after compact_ops edits or compact_interval seconds. Readers get a
+    ContactList from view().
+    """
+
+    def __init__(self, csv_path, store_path, log_path, process_contact,
+                 compact_ops=COMPACT_OPS, compact_interval=COMPACT_INTERVAL):
+        self.csv_path = csv_path
+        self.store_path = store_path
+        self.log_path = log_path
+        self.process_contact = process_contact
+        self.compact_ops = compact_ops
+        self.compact_interval = compact_interval
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._compact_wanted = threading.Event()
+        self._compactor = None
+        self._table = None
+        self._changes = None
+        self._log = None
+        # CSV size and mtime already reported as ignored because the list has edits
+        self._ignored_source = None
+
+    def _source_key(self):
+        stat = os.stat(self.csv_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    # Everything below up to the public methods runs under the lock
+
+    def _reset_log(self, generation, entries=b''):
+        """Start the change log of a store generation, keeping the given entries"""
+        if self._log is not None:
+            self._log.close()
+        tmp_path = self.log_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps({'generation': generation}).encode('utf-8') + b'\n')
+            f.write(entries)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.log_path)
+        self._log = open(self.log_path, 'ab')
+
+    def _replay(self, table, entries):
+        """Changes of the log entries on table, and the entries up to a torn last line"""
+        changes = ContactChanges(table.rows)
+        good = 0
+        for line in entries.splitlines(keepends=True):
+            try:
+                changes.apply(json.loads(line))
+            except (ValueError, KeyError, IndexError):
+                logger.warning("Dropping an incomplete entry at the end of the contact change log")
+                break
+            good += len(line)
+        return changes, entries[:good]
+
+    def _import(self):
+        self._ignored_source = None
+        generation = _new_generation()
+        build_store(self.csv_path, self.store_path, self.process_contact, generation)
+        self._table = ContactTable(self.store_path)
+        self._changes = ContactChanges(self._table.rows)
+        self._reset_log(generation)
+
+    def _open(self):
+        """Map the store and replay its change log, import the CSV when the store is missing or stale"""
+        try:
+            table = ContactTable(self.store_path)
+        except (FileNotFoundError, ValueError, KeyError):
+            table = None
+        if table is None:
+            logger.info(f"Contact store missing, building it from {self.csv_path}")
+            self._import()
+            return
+
+        try:
+            with open(self.log_path, 'rb') as f:
+                log_generation = json.loads(f.readline())['generation']
+                start = f.tell()
+                entries = f.read()
+        except (FileNotFoundError, ValueError, KeyError):
+            log_generation, entries = None, b''
+        if table.previous is not None and log_generation == table.previous:
+            # Stopped between replacing the store and its log: drop what the store already has
+            entries = entries[max(table.log_offset - start, 0):]
+        elif log_generation != table.generation:
+            if entries:
+                logger.warning("Contact change log does not belong to the contact store, ignoring it")
+            entries = b''
+        changes, entries = self._replay(table, entries)
+        source = self._source_key()
+        if table.source != source:
+            # A compacted store (previous is set) or a non-empty log holds edits the CSV lacks
+            if table.previous is None and not changes.ops:
+                logger.info(f"Contact store stale, building it from {self.csv_path}")
+                self._import()
+                return
+            if source != self._ignored_source:
+                logger.error(f"{self.csv_path} changed on disk, but the contact list has edits that are not "
+                             f"in it; keeping the edited list. Upload the file to replace the list, "
+                             f"/export-contacts downloads the edited one")
+                self._ignored_source = source
+        self._reset_log(table.generation, entries)
+        self._table = table
+        self._changes = changes
+        if changes.ops:
+            logger.info(f"Contact change log replayed: {changes.ops} edits")
+
+    def _current(self):
+        """The table of the current CSV, None when there is no contact list"""
+        if not os.path.exists(self.csv_path):
+            self._table = None
+            self._changes = None
+            return None
+        source = self._source_key()
+        if self._table is None or (self._table.source != source and source != self._ignored_source):
+            self._open()
+        return self._table
+
+    def rebuild(self):
+        """Build the store from the CSV now, after an import; edits of the previous list are dropped"""
+        with self._lock:
+            self._import()
+            return ContactList(self._table, self._changes.copy())
+
+    def view(self):
+        """The current contacts, None when there is no contact list; later edits do not change it"""
+        with self._lock:
+            if self._current() is None:
+                return None
+            return ContactList(self._table, self._changes.copy())
+
+    def patch(self, ops):
+        """Apply add, update and delete operations, all of them or none; returns their rows
+
+        An add takes email, name and language, an update a row and the
+        fields to change, a delete a row. Raises ValueError naming the first
+        invalid operation. Costs one log append, whatever the list size.
+        """
+        with self._lock:
+            if self._current() is None:
+                raise ValueError("No contacts file found")
+            contacts = ContactList(self._table, self._changes)
+            next_row = contacts.rows
+            deleting = set()
+            entries = []
+            for index, op in enumerate(ops):
+                kind = op.get('op')
+                if kind == ADD:
+                    record = (op.get('email', ''), op.get('name', ''), op.get('language', ''))
+                    entry = {'op': ADD, 'row': next_row}
+                    next_row += 1
+                elif kind in (UPDATE, DELETE):
+                    row = op.get('row')
+                    # Rows added by this same patch are not addressable yet
+                    current = contacts.record(row) if isinstance(row, int) and row not in deleting else None
+                    if current is None:
+                        raise ValueError(f"Operation {index}: no contact at row {row}")
+                    entry = {'op': kind, 'row': row}
+                    if kind == DELETE:
+                        deleting.add(row)
+                        entries.append(entry)
+                        continue
+                    record = tuple(op.get(field, value) for field, value in zip(('email', 'name', 'language'), current))
+                else:
+                    raise ValueError(f"Operation {index}: unknown op {kind!r}")
+                email, name, language = (str(value).strip() for value in record)
+                if not is_valid_email(email):
+                    raise ValueError(f"Operation {index}: invalid email {email!r}")
+                entry.update(email=email, name=name, language=language)
+                entries.append(entry)
+
+            self._log.write(b''.join(json.dumps(entry).encode('utf-8') + b'\n' for entry in entries))
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            for entry in entries:
+                self._changes.apply(entry)
+            if self._changes.ops >= self.compact_ops:
+                self._compact_wanted.set()
+            if self._compactor is None:
+                self._compactor = threading.Thread(target=self._compact_loop, name='contact-compactor',
+                                                   daemon=True)
+                self._compactor.start()
+        return [entry['row'] for entry in entries]
+
+    def _compact_loop(self):
+        while True:
+            self._compact_wanted.wait(self.compact_interval)
+            self._compact_wanted.clear()
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"Contact store compaction failed: {e}")
+
+    def compact(self):
+        """Write the pending edits into a new store and start a new change log
+
+        The store is written outside the lock; edits made meanwhile are the
+        log entries past the snapshot and carry over to the new log.
+        Returns False when there was nothing to compact.
+        """
+        with self._compact_lock:
+            with self._lock:
+                table = self._table
+                if table is None or not self._changes.ops:
+                    return False
+                contacts = ContactList(table, self._changes.copy())
+                log_offset = self._log.tell()
+
+            generation = _new_generation()
+            tmp_path = self.store_path + '.compact'
+            write_store(tmp_path, table.source, table.header, table.raw_positions, contacts.records(),
+                        generation, previous=table.generation, log_offset=log_offset)
+
+            with self._lock:
+                if self._table is not table:
+                    # Contacts were imported meanwhile
+                    os.remove(tmp_path)
+                    return False
+                with open(self.log_path, 'rb') as f:
+                    f.seek(log_offset)
+                    entries = f.read()
+                # Store first: a crash before the log is replaced is recovered by _open
+                os.replace(tmp_path, self.store_path)
+                self._table = ContactTable(self.store_path)
+                self._changes, entries = self._replay(self._table, entries)
+                self._reset_log(generation, entries)
+        logger.info(f"Contact store compacted: {contacts.changes.ops} edits, {len(contacts)} contacts")
+        return True
@@ -0,0 +1,39 @@
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bound on contacts waiting in the send queue, keeps memory flat for any list size
+QUEUE_SIZE = 1000
+
+
+class ContactFeeder(threading.Thread):
+    """Producer thread that streams contacts into a bounded queue
+
+    Puts one None sentinel per worker once the source is exhausted, so the
+    workers block on the queue instead of racing on empty(). With a
+    worker_count of 0 the caller puts them, from on_done or later.
+    """
+
+    def __init__(self, contacts, work_queue, worker_count, on_done=None):
+        super().__init__(daemon=True)
+        self.contacts = contacts
+        self.work_queue = work_queue
+        self.worker_count = worker_count
+        self.on_done = on_done
+        self.produced = 0
+        self.error = None
+
+    def run(self):
+        try:
+            for contact in self.contacts:
+                self.work_queue.put(contact)
+                self.produced += 1
+        except Exception as e:
+            logger.error(f"Error reading contacts: {e}")
+            self.error = e
+        finally:
+            if self.on_done:
+                self.on_done(self.produced, self.error)
+            for _ in range(self.worker_count):
+                self.work_queue.put(None)
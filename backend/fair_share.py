@@ -0,0 +1,195 @@
+import asyncio
+import math
+import threading
+import time
+
+DEFAULT_WEIGHT = 1.0
+# A campaign between two sends still competes for this long after its last grant
+COMPETING_SECONDS = 1.0
+
+
+class _Share:
+    """Bookkeeping of one campaign: its weight, ceiling, sends in flight and waiting senders"""
+
+    __slots__ = ('weight', 'ceiling', 'in_flight', 'virtual_time', 'granted', 'granted_at', 'waiters')
+
+    def __init__(self, weight, ceiling):
+        self.weight = weight
+        self.ceiling = ceiling
+        self.in_flight = 0
+        # Slots granted so far, each counting 1 / weight
+        self.virtual_time = 0.0
+        self.granted = 0
+        self.granted_at = 0.0
+        self.waiters = []
+
+    def is_active(self):
+        return self.in_flight > 0 or bool(self.waiters)
+
+    def is_competing(self, now):
+        return self.is_active() or now - self.granted_at < COMPETING_SECONDS
+
+
+class FairShare:
+    """Sender slots shared by every running campaign, handed out in proportion to their weights
+
+    Each send holds a slot while it is transmitted. While slots are free
+    any campaign takes one; when they run out, a freed slot goes to the
+    waiting campaign with the lowest virtual time (stride scheduling: a
+    grant advances a campaign's virtual time by 1 / weight), so a campaign
+    of weight 2 gets twice the sends of one of weight 1 and a huge campaign
+    cannot starve a small one. A campaign that was idle catches up with
+    the active ones instead of cashing in the slots it did not use.
+
+    Slots are only held during transmission, so between two sends of a
+    campaign they are often free and nobody waits for them. While several
+    campaigns compete (hold or wait for slots, or got one in the last
+    COMPETING_SECONDS), each is therefore also capped at its share of the
+    capacity, capacity * weight / sum of the competing weights, which keeps
+    the split in proportion to the weights even then.
+
+    capacity is the total number of slots; None follows the largest
+    ceiling (max_connections) of the registered campaigns, so a campaign
+    running alone is never limited and a second one shares instead of
+    adding load. Threads use acquire(), coroutines acquire_async(); both
+    release() when the send is done. As in AdaptiveConcurrency, waiters
+    of a campaign are woken last in, first out.
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._shares = {}
+
+    def register(self, key, weight=DEFAULT_WEIGHT, ceiling=1):
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+        with self._lock:
+            share = _Share(float(weight), max(int(ceiling), 1))
+            self._shares[key] = share
+
+    def unregister(self, key):
+        """Forget a finished campaign, its slots in flight are still released normally"""
+        with self._lock:
+            share = self._shares.pop(key, None)
+            if share is not None:
+                for wake in share.waiters:
+                    # Nobody should be waiting any more, let them through rather than hang
+                    self.in_flight += 1
+                    share.in_flight += 1
+                    wake()
+                share.waiters.clear()
+            self._wake()
+
+    def _capacity(self):
+        if self.capacity is not None:
+            return self.capacity
+        return max((share.ceiling for share in self._shares.values()), default=1)
+
+    def _activate(self, share):
+        """Bring a campaign that had nothing in flight up to the active ones, under the lock"""
+        if share.is_active():
+            return
+        active = [other.virtual_time for other in self._shares.values() if other.is_active()]
+        if active:
+            share.virtual_time = max(share.virtual_time, min(active))
+
+    def _grant(self, share):
+        """Give share a slot, under the lock"""
+        share.virtual_time += 1.0 / share.weight
+        share.granted += 1
+        share.granted_at = time.monotonic()
+        share.in_flight += 1
+        self.in_flight += 1
+
+    def _limit(self, share, capacity, now):
+        """Slots share may hold: its weighted part of the capacity among the competing campaigns"""
+        weights = sum(other.weight for other in self._shares.values()
+                      if other is share or other.is_competing(now))
+        return max(1, math.ceil(capacity * share.weight / weights))
+
+    def _take(self, share):
+        capacity = self._capacity()
+        if self.in_flight >= capacity:
+            return False
+        now = time.monotonic()
+        if share.in_flight >= self._limit(share, capacity, now):
+            return False
+        # Free slots go to waiting campaigns first
+        if any(other.waiters and other.in_flight < self._limit(other, capacity, now)
+               for other in self._shares.values()):
+            return False
+        self._grant(share)
+        return True
+
+    def _wake(self):
+        capacity = self._capacity()
+        while self.in_flight < capacity:
+            now = time.monotonic()
+            waiting = [share for share in self._shares.values()
+                       if share.waiters and share.in_flight < self._limit(share, capacity, now)]
+            if not waiting:
+                return
+            share = min(waiting, key=lambda share: share.virtual_time)
+            self._grant(share)
+            share.waiters.pop()()
+
+    def acquire(self, key):
+        """Block until the campaign `key` gets a slot"""
+        with self._lock:
+            share = self._shares[key]
+            self._activate(share)
+            if self._take(share):
+                return
+            event = threading.Event()
+            share.waiters.append(event.set)
+        event.wait()
+
+    async def acquire_async(self, key):
+        """acquire() for coroutines of the event loop thread"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            share = self._shares[key]
+            self._activate(share)
+            if self._take(share):
+                return
+            future = loop.create_future()
+
+            def wake():
+                loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+            share.waiters.append(wake)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if wake in share.waiters:
+                    share.waiters.remove(wake)
+                else:
+                    # The slot was handed over already, give it back
+                    share.in_flight -= 1
+                    self.in_flight -= 1
+                    self._wake()
+            raise
+
+    def release(self, key):
+        with self._lock:
+            share = self._shares.get(key)
+            if share is not None:
+                share.in_flight -= 1
+            self.in_flight -= 1
+            self._wake()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'capacity': self._capacity(),
+                'in_flight': self.in_flight,
+                'campaigns': {key: {
+                    'weight': share.weight,
+                    'in_flight': share.in_flight,
+                    'waiting': len(share.waiters),
+                    'granted': share.granted
+                } for key, share in self._shares.items()}
+            }
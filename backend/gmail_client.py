@@ -0,0 +1,230 @@
+import os
+import time
+import threading
+import logging
+from datetime import datetime, timedelta
+import httplib2
+import google_auth_httplib2
+from googleapiclient.discovery import build
+from googleapiclient.http import BatchHttpRequest
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+
+logger = logging.getLogger(__name__)
+
+# Refresh the access token this long before it expires so no send stalls on it
+REFRESH_MARGIN = timedelta(minutes=5)
+# Wait before trying again when a background refresh failed
+REFRESH_RETRY_SECONDS = 30
+
+# Override the API host, e.g. to point at a local fake Gmail server in tests
+GMAIL_API_ENDPOINT = os.environ.get('GMAIL_API_ENDPOINT', 'https://gmail.googleapis.com/')
+
+# Gmail rejects batches above 100 calls and recommends staying at 50 or less
+MAX_BATCH_SIZE = 50
+
+
+def credentials_from_dict(creds_dict):
+    """Build google Credentials from the dict stored in oauth_tokens"""
+    credentials = Credentials(
+        token=creds_dict['token'],
+        refresh_token=creds_dict['refresh_token'],
+        token_uri=creds_dict['token_uri'],
+        client_id=creds_dict['client_id'],
+        client_secret=creds_dict['client_secret'],
+        scopes=creds_dict['scopes']
+    )
+    if creds_dict.get('expiry'):
+        credentials.expiry = datetime.fromisoformat(creds_dict['expiry'])
+    return credentials
+
+
+class GmailClient:
+    """Gmail API service for one account, built once and shared by all workers
+
+    A timer refreshes the access token REFRESH_MARGIN before it expires,
+    while the senders keep using the current one; a sender only refreshes
+    it itself when the token is missing, expired or answered with a 401.
+    """
+
+    def __init__(self, email, token_store, http_timeout=60, api_endpoint=GMAIL_API_ENDPOINT):
+        self.email = email
+        self.token_store = token_store
+        self.http_timeout = http_timeout
+        self.credentials = credentials_from_dict(token_store[email])
+        # static_discovery uses the discovery document bundled with the library,
+        # so building the service needs no network fetch and no discovery cache
+        self.service = build(
+            'gmail', 'v1',
+            credentials=self.credentials,
+            cache_discovery=False,
+            static_discovery=True,
+            client_options={'api_endpoint': api_endpoint}
+        )
+        self.api_endpoint = api_endpoint
+        self.batch_uri = api_endpoint.rstrip('/') + '/batch/gmail/v1'
+        self._refresh_lock = threading.Lock()
+        self._local = threading.local()
+        self._timer_lock = threading.Lock()
+        self._timer = None
+        self._closed = False
+        self._schedule_refresh()
+
+    def _http(self):
+        """httplib2 is not thread safe, so every worker thread gets its own connection"""
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = google_auth_httplib2.AuthorizedHttp(
+                self.credentials, http=httplib2.Http(timeout=self.http_timeout))
+            self._local.http = http
+        return http
+
+    def needs_refresh(self):
+        """True when the token cannot be used any more: missing or expired"""
+        return not self.credentials.valid
+
+    def _expires_soon(self):
+        expiry = self.credentials.expiry
+        # Unknown expiry, AuthorizedHttp refreshes on a 401
+        return expiry is not None and expiry - datetime.utcnow() <= REFRESH_MARGIN
+
+    def _schedule_refresh(self, delay=None):
+        """Start the timer of the next background refresh, REFRESH_MARGIN before expiry"""
+        expiry = self.credentials.expiry
+        if delay is None:
+            if expiry is None:
+                return
+            delay = max((expiry - REFRESH_MARGIN - datetime.utcnow()).total_seconds(), 0)
+        with self._timer_lock:
+            if self._closed:
+                return
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(delay, self._refresh_ahead)
+            self._timer.daemon = True
+            self._timer.name = f"gmail-token-{self.email}"
+            self._timer.start()
+
+    def _refresh_ahead(self):
+        try:
+            self._refresh(self._expires_soon)
+        except Exception as e:
+            # The current token still works until it expires, try again shortly
+            logger.error(f"Background refresh of the Gmail access token for {self.email} failed: {e}")
+            self._schedule_refresh(REFRESH_RETRY_SECONDS)
+
+    def _refresh(self, stale):
+        """Refresh the token when stale() still holds under the lock, only one thread does it"""
+        if not stale():
+            return
+        with self._refresh_lock:
+            if not stale():
+                return
+            logger.info(f"Refreshing Gmail access token for {self.email}")
+            self.credentials.refresh(Request())
+            # Keep the stored tokens in sync so a rebuilt client starts fresh
+            stored = self.token_store.get(self.email)
+            if stored is not None:
+                stored['token'] = self.credentials.token
+                if self.credentials.expiry:
+                    stored['expiry'] = self.credentials.expiry.isoformat()
+        self._schedule_refresh()
+
+    def ensure_fresh(self, rejected_token=None):
+        """Refresh an unusable token on the calling thread, the background timer handles the rest
+
+        rejected_token forces a refresh when the API answered 401 to that token,
+        unless another caller already replaced it.
+        """
+        self._refresh(lambda: self.needs_refresh() or
+                      (rejected_token is not None and self.credentials.token == rejected_token))
+
+    def close(self):
+        """Stop refreshing the token, for a client that is dropped"""
+        with self._timer_lock:
+            self._closed = True
+            if self._timer is not None:
+                self._timer.cancel()
+
+    def execute(self, http_request):
+        """Execute a prepared API request on the calling thread's connection"""
+        self.ensure_fresh()
+        return http_request.execute(http=self._http())
+
+    def send_raw(self, raw):
+        """Send an already base64url encoded RFC 822 message"""
+        return self.execute(
+            self.service.users().messages().send(userId='me', body={'raw': raw}))
+
+    def send_batch(self, messages, retries=0, retry_delay=2):
+        """Send several raw messages through HTTP batch requests
+
+        messages maps an id to the base64url encoded message. Every failed
+        sub-request is retried on its own in a later batch. Returns a dict
+        mapping each id to None on success or to the last exception.
+        """
+        results = {}
+        pending = dict(messages)
+        for attempt in range(retries + 1):
+            failed = {}
+
+            def callback(request_id, response, exception):
+                if exception is None:
+                    results[request_id] = None
+                else:
+                    failed[request_id] = exception
+
+            ids = list(pending)
+            for start in range(0, len(ids), MAX_BATCH_SIZE):
+                batch = BatchHttpRequest(callback=callback, batch_uri=self.batch_uri)
+                for message_id in ids[start:start + MAX_BATCH_SIZE]:
+                    batch.add(
+                        self.service.users().messages().send(
+                            userId='me', body={'raw': pending[message_id]}),
+                        request_id=message_id)
+                try:
+                    self.execute(batch)
+                except Exception as e:
+                    # The whole batch request failed, every call in it counts as failed
+                    for message_id in ids[start:start + MAX_BATCH_SIZE]:
+                        if message_id not in results:
+                            failed[message_id] = e
+
+            results.update(failed)
+            if not failed:
+                break
+            logger.warning(f"{len(failed)} of {len(pending)} batched Gmail sends failed (attempt {attempt + 1})")
+            pending = {message_id: pending[message_id] for message_id in failed}
+            if attempt < retries:
+                time.sleep(retry_delay)
+        return results
+
+
+class GmailClientCache:
+    """Per-account cache of GmailClient instances"""
+
+    def __init__(self, token_store):
+        self.token_store = token_store
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, email):
+        client = self._clients.get(email)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(email)
+            if client is None:
+                if email not in self.token_store:
+                    raise KeyError(f"No OAuth tokens stored for {email}")
+                logger.info(f"Building Gmail API client for {email}")
+                client = GmailClient(email, self.token_store)
+                self._clients[email] = client
+            return client
+
+    def invalidate(self, email):
+        """Drop the cached client, e.g. after the tokens were replaced or revoked"""
+        with self._lock:
+            client = self._clients.pop(email, None)
+        if client is not None:
+            client.close()
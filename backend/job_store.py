@@ -0,0 +1,233 @@
+import json
+import time
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Recipient states
+PENDING = 'pending'
+SENT = 'sent'
+FAILED = 'failed'
+RETRYING = 'retrying'
+
+# Recipients in these states are never sent again on resume
+FINAL_STATES = (SENT, FAILED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS campaigns (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    status TEXT NOT NULL,
+    config TEXT NOT NULL,
+    contacts_mtime_ns INTEGER,
+    contacts_size INTEGER
+);
+CREATE TABLE IF NOT EXISTS recipients (
+    campaign_id TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    email TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (campaign_id, row)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS send_counts (
+    account TEXT NOT NULL,
+    minute INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (account, minute)
+) WITHOUT ROWID;
+"""
+
+INSERT_PENDING = (
+    "INSERT OR IGNORE INTO recipients (campaign_id, row, email, state, attempts, updated_at) "
+    "VALUES (?, ?, ?, 'pending', 0, ?)"
+)
+UPDATE_STATE = (
+    "UPDATE recipients SET state = ?, attempts = ?, error = ?, updated_at = ? "
+    "WHERE campaign_id = ? AND row = ?"
+)
+COUNT_SEND = (
+    "INSERT INTO send_counts (account, minute, count) VALUES (?, ?, 1) "
+    "ON CONFLICT (account, minute) DO UPDATE SET count = count + 1"
+)
+
+
+class JobStore:
+    """Per-recipient campaign state in SQLite (WAL mode)
+
+    Writes are queued and committed by one writer thread in batches, so many
+    workers share a single transaction. Callers that need durability (a
+    message was delivered) wait for the commit that contains their write.
+    """
+
+    def __init__(self, path, flush_interval=0.05, max_batch=1000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # With WAL, NORMAL still survives a process crash; only power loss can drop the last commits
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._db_lock = threading.Lock()
+
+        self._cond = threading.Condition()
+        self._ops = []
+        self._submitted = 0
+        self._committed = 0
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    # Writer
+
+    def _submit(self, sql, params, wait=False):
+        with self._cond:
+            self._ops.append((sql, params))
+            self._submitted += 1
+            seq = self._submitted
+            # A waiting caller starts a commit right away, whatever else queued up joins it
+            if wait or len(self._ops) >= self.max_batch:
+                self._cond.notify_all()
+            if wait:
+                while self._committed < seq and not self._closed:
+                    self._cond.wait()
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                if not self._ops and not self._closed:
+                    self._cond.wait(self.flush_interval)
+                if not self._ops:
+                    if self._closed:
+                        return
+                    continue
+                ops, self._ops = self._ops, []
+                seq = self._submitted
+            try:
+                self._apply(ops)
+            except Exception as e:
+                logger.error(f"Job store write failed for {len(ops)} operations: {e}")
+            with self._cond:
+                self._committed = seq
+                self._cond.notify_all()
+
+    def _apply(self, ops):
+        with self._db_lock:
+            self._conn.execute('BEGIN')
+            try:
+                # Consecutive operations with the same statement go through executemany
+                start = 0
+                while start < len(ops):
+                    sql = ops[start][0]
+                    end = start
+                    while end < len(ops) and ops[end][0] == sql:
+                        end += 1
+                    self._conn.executemany(sql, [params for _, params in ops[start:end]])
+                    start = end
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def flush(self):
+        """Block until every write submitted so far is committed"""
+        with self._cond:
+            seq = self._submitted
+            self._cond.notify_all()
+            while self._committed < seq and not self._closed:
+                self._cond.wait()
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.join()
+        self._conn.close()
+
+    # Campaigns
+
+    def create_campaign(self, campaign_id, config, contacts_fingerprint):
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT INTO campaigns (id, created_at, updated_at, status, config, contacts_mtime_ns, contacts_size) "
+                "VALUES (?, ?, ?, 'running', ?, ?, ?)",
+                (campaign_id, now, now, json.dumps(config), contacts_fingerprint[0], contacts_fingerprint[1]))
+
+    def set_campaign_status(self, campaign_id, status):
+        self._submit(
+            "UPDATE campaigns SET status = ?, updated_at = ? WHERE id = ?",
+            (status, time.time(), campaign_id), wait=True)
+
+    def mark_interrupted(self):
+        """Campaigns still marked running belong to a process that died"""
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "UPDATE campaigns SET status = 'interrupted', updated_at = ? WHERE status = 'running'",
+                (time.time(),))
+            return cursor.rowcount
+
+    def get_campaign(self, campaign_id=None):
+        """A campaign by id, or the most recent one that can be resumed"""
+        with self._db_lock:
+            if campaign_id:
+                row = self._conn.execute(
+                    "SELECT id, status, config, contacts_mtime_ns, contacts_size FROM campaigns WHERE id = ?",
+                    (campaign_id,)).fetchone()
+            else:
+                row = self._conn.execute(
+                    "SELECT id, status, config, contacts_mtime_ns, contacts_size FROM campaigns "
+                    "WHERE status IN ('running', 'interrupted') ORDER BY created_at DESC LIMIT 1").fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row[0],
+            'status': row[1],
+            'config': json.loads(row[2]),
+            'contacts_fingerprint': (row[3], row[4])
+        }
+
+    # Recipients
+
+    def add_pending(self, campaign_id, row, email):
+        self._submit(INSERT_PENDING, (campaign_id, row, email, time.time()))
+
+    def set_state(self, campaign_id, row, state, attempts=0, error=None, wait=False):
+        self._submit(UPDATE_STATE, (state, attempts, error, time.time(), campaign_id, row), wait=wait)
+
+    # Sends per account and minute, for daily quotas that outlive a restart
+
+    def record_send(self, account, minute):
+        self._submit(COUNT_SEND, (account, minute))
+
+    def send_counts(self, account, since_minute):
+        """{minute: sends} of an account from since_minute on, older minutes are deleted"""
+        self.flush()
+        with self._db_lock:
+            self._conn.execute("DELETE FROM send_counts WHERE account = ? AND minute < ?", (account, since_minute))
+            cursor = self._conn.execute(
+                "SELECT minute, count FROM send_counts WHERE account = ? AND minute >= ?", (account, since_minute))
+            return dict(cursor.fetchall())
+
+    def done_rows(self, campaign_id):
+        """Rows of the campaign that must not be sent again"""
+        self.flush()
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "SELECT row FROM recipients WHERE campaign_id = ? AND state IN (?, ?)",
+                (campaign_id,) + FINAL_STATES)
+            return {row for row, in cursor}
+
+    def state_counts(self, campaign_id):
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "SELECT state, COUNT(*) FROM recipients WHERE campaign_id = ? GROUP BY state",
+                (campaign_id,))
+            return dict(cursor.fetchall())
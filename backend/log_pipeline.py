@@ -0,0 +1,131 @@
+import json
+import queue
+import atexit
+import logging
+import itertools
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has, anything else was passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Output format chosen by setup_logging(), reused by forked children
+_json_output = False
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, with the fields passed through `extra` as keys"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            record.exc_text = self.formatException(record.exc_info)
+        # Records from the queue carry their traceback already rendered
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _PreparedQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread
+
+    The stock prepare() formats the record in the logging thread; here only
+    the message arguments are merged and the traceback rendered, because
+    those may reference objects that change after the call returns.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogSampler:
+    """Decides which per-message lines to log: the first `first`, then one in `every`
+
+    Call it before building the message, so skipped lines cost a counter
+    increment and no string formatting.
+    """
+
+    def __init__(self, logger, every=100, first=100, level=logging.INFO):
+        self.logger = logger
+        self.every = every
+        self.first = first
+        self.level = level
+        self._counter = itertools.count()
+
+    def copy(self):
+        """A sampler with the same settings that starts counting from zero"""
+        return LogSampler(self.logger, self.every, self.first, self.level)
+
+    def __call__(self):
+        if not self.logger.isEnabledFor(self.level):
+            return False
+        # next() on itertools.count is atomic under the GIL
+        seen = next(self._counter)
+        return seen < self.first or self.every <= 1 or seen % self.every == 0
+
+
+def setup_logging(level='DEBUG', json_output=False):
+    """Route every record through a queue to one listener thread that writes to stderr
+
+    Returns the listener, which is stopped at exit so queued records are flushed.
+    """
+    global _json_output
+    _json_output = json_output
+    handler = logging.StreamHandler()
+    handler.setFormatter(JSONFormatter() if json_output else logging.Formatter(TEXT_FORMAT))
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(_PreparedQueueHandler(records))
+    root.setLevel(level)
+
+    listener = QueueListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def setup_child_logging():
+    """Logging of a forked child process: straight to stderr, the listener thread stayed in the parent"""
+    handler = logging.StreamHandler()
+    handler.setFormatter(JSONFormatter() if _json_output else logging.Formatter(TEXT_FORMAT))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+
+
+def set_level(level, name=None):
+    """Change the level of a logger (the root logger by default) while running"""
+    if isinstance(level, str):
+        level = level.upper()
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"Unknown log level: {level}")
+    logging.getLogger(name).setLevel(level)
+
+
+def levels():
+    """Levels of the root logger and of every logger configured with its own level"""
+    configured = {'root': logging.getLevelName(logging.getLogger().level)}
+    for name, logger in sorted(logging.root.manager.loggerDict.items()):
+        if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET:
+            configured[name] = logging.getLevelName(logger.level)
+    return configured
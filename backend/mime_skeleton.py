@@ -0,0 +1,92 @@
+import io
+import re
+import base64
+import secrets
+from email.generator import BytesGenerator
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+# Placeholders serialized into the skeleton and cut out again
+TO_SLOT = 'to-slot@skeleton.invalid'
+BODY_SLOT = 'BODY-SLOT-a1d7e3'
+
+CRLF = b'\r\n'
+# "To: " plus the address stays under the 78 character folding limit
+MAX_INLINE_ADDRESS = 74
+# The line breaks and "From " mangling of email.generator for a 7bit text part
+NEWLINE_RE = re.compile(r'\r\n|\r|\n')
+FROM_RE = re.compile(r'^From ', re.MULTILINE)
+
+
+def make_boundary():
+    # Same shape as the boundaries email.generator picks
+    return '=' * 15 + f'{secrets.randbelow(10 ** 19):019d}' + '=='
+
+
+def flatten(msg):
+    """Serialize a message the way smtplib.send_message does before DATA"""
+    buffer = io.BytesIO()
+    BytesGenerator(buffer).flatten(msg, linesep='\r\n')
+    return buffer.getvalue()
+
+
+def _part_headers(text):
+    """Serialized headers of the text part email.mime builds for text, up to the blank line"""
+    flat = flatten(MIMEText(text, 'plain'))
+    return flat[:flat.index(CRLF + CRLF) + 4]
+
+
+class MessageSkeleton:
+    """A campaign message serialized once, with slots for the To header and the body
+
+    Subject, From, attachment parts and the boundary layout never change
+    between recipients, so fill() only joins the prebuilt segments around
+    the recipient's address and encoded body. The output is byte for byte
+    what email.mime and BytesGenerator produce with the same boundary.
+    """
+
+    def __init__(self, subject, from_addr=None, attachment_parts=(), boundary=None):
+        self.boundary = boundary or make_boundary()
+        msg = MIMEMultipart(boundary=self.boundary)
+        if from_addr:
+            msg['From'] = from_addr
+        msg['To'] = TO_SLOT
+        msg['Subject'] = subject
+        msg.attach(MIMEText(BODY_SLOT, 'plain'))
+        for part in attachment_parts:
+            msg.attach(part)
+        flat = flatten(msg)
+
+        head, rest = flat.split(TO_SLOT.encode(), 1)
+        middle, tail = rest.split(BODY_SLOT.encode(), 1)
+        ascii_headers = _part_headers('x')
+        utf8_headers = _part_headers('é')
+        if not middle.endswith(ascii_headers):
+            raise ValueError("Unexpected layout of the serialized text part")
+        self.head = head
+        self.tail = tail
+        self.middle_ascii = middle
+        self.middle_utf8 = middle[:-len(ascii_headers)] + utf8_headers
+        self.marker = self.boundary.encode()
+
+    def encode_body(self, body):
+        """Return (middle segment, encoded body) for a body, like MIMEText(body, 'plain')"""
+        try:
+            encoded = NEWLINE_RE.sub('\r\n', FROM_RE.sub('>From ', body)).encode('ascii')
+            return self.middle_ascii, encoded
+        except UnicodeEncodeError:
+            # email.mime falls back to utf-8 with a base64 body
+            return self.middle_utf8, base64.encodebytes(body.encode('utf-8')).replace(b'\n', CRLF)
+
+    def fill(self, to_addr, body):
+        """Wire bytes of the message for one recipient, or None when it cannot be spliced
+
+        Addresses that are not plain ASCII or long enough to be folded, and
+        bodies that contain the boundary, need the full email.mime path.
+        """
+        if not to_addr.isascii() or len(to_addr) > MAX_INLINE_ADDRESS or '\r' in to_addr or '\n' in to_addr:
+            return None
+        middle, encoded = self.encode_body(body)
+        if self.marker in encoded:
+            return None
+        return b''.join((self.head, to_addr.encode('ascii'), middle, encoded, self.tail))
@@ -0,0 +1,360 @@
+import json
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Published sending limits. Free Gmail accounts may send 500 messages a day,
+# Workspace accounts 2000; the Gmail API allows 250 quota units per second
+# per user and messages.send costs 100 of them.
+CONSUMER_GMAIL_DOMAINS = ('@gmail.com', '@googlemail.com')
+PROVIDER_LIMITS = {
+    'gmail_api': {'per_second': 2.5, 'per_day': 2000},
+    'gmail_api_consumer': {'per_second': 2.5, 'per_day': 500},
+    'smtp.gmail.com': {'per_second': 1.0, 'per_day': 2000},
+    'smtp.gmail.com_consumer': {'per_second': 1.0, 'per_day': 500},
+    'smtp.office365.com': {'per_minute': 30, 'per_day': 10000},
+    'smtp-mail.outlook.com': {'per_minute': 30, 'per_day': 300},
+    'smtp.mail.yahoo.com': {'per_minute': 20, 'per_day': 500},
+}
+
+# SMTP replies that mean "slow down": service unavailable / too many connections,
+# and insufficient storage / too many recipients for now. 450 and 451 (mailbox
+# busy, local error) concern one recipient and are retried like any transient failure
+THROTTLE_SMTP_CODES = {421, 452}
+THROTTLE_GMAIL_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+MIN_BACKOFF = 1.0
+MAX_BACKOFF = 300.0
+
+
+def provider_limits(transport, account=''):
+    """Default limits for an SMTP host or 'gmail_api', picking consumer quotas for gmail.com accounts"""
+    consumer = account.lower().endswith(CONSUMER_GMAIL_DOMAINS)
+    if consumer and f'{transport}_consumer' in PROVIDER_LIMITS:
+        return dict(PROVIDER_LIMITS[f'{transport}_consumer'])
+    return dict(PROVIDER_LIMITS.get(transport, {}))
+
+
+def smtp_reply_code(error):
+    """The SMTP reply code carried by an smtplib or aiosmtplib exception, else None"""
+    # smtplib names the reply code smtp_code, aiosmtplib names it code
+    code = getattr(error, 'smtp_code', None)
+    if code is None and isinstance(getattr(error, 'code', None), int):
+        code = error.code
+    if code is None and hasattr(error, 'recipients'):
+        # SMTPRecipientsRefused carries one reply per recipient
+        recipients = error.recipients
+        if isinstance(recipients, dict):
+            codes = [reply[0] for reply in recipients.values()]
+        else:
+            codes = [getattr(recipient, 'code', None) for recipient in recipients]
+        code = codes[0] if codes else None
+    return code
+
+
+def http_status(error):
+    """HTTP status of a Gmail API error (googleapiclient HttpError or the async client's), else None"""
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    return int(status) if status is not None else None
+
+
+def _error_content(error):
+    content = getattr(error, 'content', b'') or b''
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', 'replace')
+    return content
+
+
+def gmail_error_reason(error):
+    """First error reason of a Gmail API error body, e.g. rateLimitExceeded, else None"""
+    try:
+        body = json.loads(_error_content(error))
+        details = body['error']
+        errors = details.get('errors') or []
+        return errors[0].get('reason') if errors else details.get('status')
+    except (ValueError, KeyError, TypeError, AttributeError, IndexError):
+        return None
+
+
+def gmail_error_message(error):
+    """Message of a Gmail API error body, e.g. 'Invalid To header', else ''"""
+    try:
+        return str(json.loads(_error_content(error))['error'].get('message') or '')
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return ''
+
+
+def throttle_delay(error):
+    """Return a back-off delay in seconds when error is a throttling response, else None
+
+    Covers SMTP 421/452 replies and Gmail API 429 or rateLimitExceeded errors.
+    A Retry-After header is honoured when the API sends one (0 means unspecified).
+    """
+    if smtp_reply_code(error) in THROTTLE_SMTP_CODES:
+        return 0.0
+
+    status = http_status(error)
+    if status is None:
+        return None
+    content = _error_content(error)
+    if status == 429 or (status == 403 and any(reason in content for reason in THROTTLE_GMAIL_REASONS)):
+        try:
+            return float(error.resp.get('retry-after', 0))
+        except (TypeError, ValueError, AttributeError):
+            return 0.0
+    return None
+
+
+# Gmail API statuses worth another try besides throttling and 5xx: the client
+# refreshes its token on 401, 408 is a timeout and 409 a transient conflict
+TRANSIENT_HTTP_STATUSES = {401, 408, 409, 429}
+
+
+def is_permanent(error):
+    """True when retrying cannot help: SMTP 5xx replies and Gmail 4xx errors other than the transient ones
+
+    Throttling replies and errors without any reply (resets, timeouts) are transient.
+    """
+    if throttle_delay(error) is not None:
+        return False
+    code = smtp_reply_code(error)
+    if code is not None:
+        return 500 <= code < 600
+    status = http_status(error)
+    if status is not None:
+        return 400 <= status < 500 and status not in TRANSIENT_HTTP_STATUSES
+    return False
+
+
+class TokenBucket:
+    """Allows `rate` tokens per second with bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class DailyWindow:
+    """Sliding 24 hour counter with one minute resolution, for daily sending quotas
+
+    counts are the sends of earlier runs by minute (wall clock minutes since
+    the epoch), record(minute) is called for every new one.
+    """
+
+    SLOTS = 24 * 60
+
+    def __init__(self, limit, counts=None, record=None):
+        self.limit = limit
+        self.counts = dict(counts or {})
+        self.total = sum(self.counts.values())
+        self.record = record
+
+    def _expire(self, now):
+        current = int(now // 60)
+        for minute in [minute for minute in self.counts if minute <= current - self.SLOTS]:
+            self.total -= self.counts.pop(minute)
+
+    def wait_time(self, now):
+        self._expire(now)
+        if self.total < self.limit:
+            return 0.0
+        oldest = min(self.counts)
+        return (oldest + self.SLOTS) * 60 - now
+
+    def take(self, now):
+        minute = int(now // 60)
+        self.counts[minute] = self.counts.get(minute, 0) + 1
+        self.total += 1
+        if self.record is not None:
+            self.record(minute)
+
+
+class RateLimiter:
+    """Send scheduler of one account, shared by all workers of its campaigns
+
+    Each send takes one token from every configured limit (per second, per
+    minute, per day). Throttling replies pause everyone with exponential
+    back-off and halve the per-second rate, which then recovers step by step
+    as sends succeed again. day_window builds the DailyWindow of a daily
+    limit, to carry its counts over restarts.
+    """
+
+    def __init__(self, per_second=None, per_minute=None, per_day=None, day_window=DailyWindow):
+        self._lock = threading.Lock()
+        self._day_window = day_window
+        self.base_rate = per_second
+        self.second = TokenBucket(per_second, max(1.0, per_second)) if per_second else None
+        self.minute = TokenBucket(per_minute / 60.0, per_minute) if per_minute else None
+        self.day = day_window(per_day) if per_day else None
+        self.paused_until = 0.0
+        self.backoff_delay = 0.0
+        self.successes = 0
+        self.counters = {'acquired': 0, 'throttled': 0, 'waited_seconds': 0.0}
+        self._warned_daily = False
+
+    def configure(self, per_second=None, per_minute=None, per_day=None):
+        """Change the limits in place, keeping the tokens already used and the daily count"""
+        with self._lock:
+            self.base_rate = per_second
+            if not per_second:
+                self.second = None
+            elif self.second is None:
+                self.second = TokenBucket(per_second, max(1.0, per_second))
+            else:
+                self.second.rate = per_second
+                self.second.capacity = max(1.0, per_second)
+                self.second.tokens = min(self.second.tokens, self.second.capacity)
+            if not per_minute:
+                self.minute = None
+            elif self.minute is None:
+                self.minute = TokenBucket(per_minute / 60.0, per_minute)
+            else:
+                self.minute.rate = per_minute / 60.0
+                self.minute.capacity = per_minute
+                self.minute.tokens = min(self.minute.tokens, per_minute)
+            if not per_day:
+                self.day = None
+            elif self.day is None:
+                self.day = self._day_window(per_day)
+            else:
+                self.day.limit = per_day
+
+    def limits(self):
+        return {
+            'per_second': self.second.rate if self.second else None,
+            'per_minute': self.minute.capacity if self.minute else None,
+            'per_day': self.day.limit if self.day else None
+        }
+
+    def _wait_time(self, now):
+        wait = max(0.0, self.paused_until - now)
+        if self.second:
+            wait = max(wait, self.second.wait_time(now))
+        if self.minute:
+            wait = max(wait, self.minute.wait_time(now))
+        if self.day:
+            # The daily window follows the wall clock, the buckets the monotonic one
+            day_wait = self.day.wait_time(time.time())
+            if day_wait > 0 and not self._warned_daily:
+                logger.warning(f"Daily sending limit of {self.day.limit} reached, waiting {day_wait / 60:.0f} minutes")
+                self._warned_daily = True
+            wait = max(wait, day_wait)
+        return wait
+
+    def try_acquire(self):
+        """Take a token if a send is allowed right now, else return the seconds to wait"""
+        with self._lock:
+            wait = self._wait_time(time.monotonic())
+            if wait > 0:
+                return wait
+            for bucket in (self.second, self.minute):
+                if bucket:
+                    bucket.take()
+            if self.day:
+                self.day.take(time.time())
+                self._warned_daily = False
+            self.counters['acquired'] += 1
+            return 0.0
+
+    def acquire(self, stop_event=None):
+        """Block until a message may be sent; returns False if stop_event was set meanwhile"""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                if waited:
+                    with self._lock:
+                        self.counters['waited_seconds'] += waited
+                return True
+            # Sleep in short steps so a stop request is noticed quickly
+            step = min(wait, 1.0)
+            if stop_event is not None:
+                if stop_event.wait(step):
+                    return False
+            else:
+                time.sleep(step)
+            waited += step
+
+    def on_success(self):
+        with self._lock:
+            self.backoff_delay = 0.0
+            if self.second and self.base_rate and self.second.rate < self.base_rate:
+                # Additive recovery: back to the configured rate after a few dozen sends
+                self.successes += 1
+                if self.successes >= 10:
+                    self.successes = 0
+                    self.second.rate = min(self.base_rate, self.second.rate + self.base_rate * 0.1)
+
+    def backoff(self, retry_after=0.0):
+        """Pause all senders after a throttling reply"""
+        with self._lock:
+            self.counters['throttled'] += 1
+            self.backoff_delay = min(MAX_BACKOFF, max(MIN_BACKOFF, self.backoff_delay * 2))
+            delay = max(self.backoff_delay, retry_after or 0.0)
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            if self.second:
+                self.second.rate = max(self.second.rate / 2, 0.05)
+                self.successes = 0
+            logger.warning(f"Throttled by the provider, pausing sends for {delay:.1f}s")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['limits'] = self.limits()
+            stats['paused_for'] = max(0.0, self.paused_until - time.monotonic())
+            if self.day:
+                self.day._expire(time.time())
+                stats['sent_today'] = self.day.total
+        return stats
+
+
+class AccountLimiters:
+    """One RateLimiter per sending account, shared by every campaign sending from it
+
+    Provider quotas are per account, so two campaigns on one account share
+    its limits instead of getting one each. The last campaign started sets
+    the limits. load_counts(account, since_minute) and record_send(account,
+    minute) persist the daily window, so a restart does not reset the quota.
+    """
+
+    def __init__(self, load_counts=None, record_send=None):
+        self.load_counts = load_counts
+        self.record_send = record_send
+        self._lock = threading.Lock()
+        self._limiters = {}
+
+    def _day_window(self, account):
+        def day_window(limit):
+            if self.load_counts is None:
+                return DailyWindow(limit)
+            since = int(time.time() // 60) - DailyWindow.SLOTS + 1
+            record = (lambda minute: self.record_send(account, minute)) if self.record_send else None
+            return DailyWindow(limit, self.load_counts(account, since), record)
+        return day_window
+
+    def get(self, account, limits):
+        """The limiter of an account, set to the given limits"""
+        with self._lock:
+            limiter = self._limiters.get(account)
+            if limiter is None:
+                limiter = self._limiters[account] = RateLimiter(**limits, day_window=self._day_window(account))
+                return limiter
+        limiter.configure(**limits)
+        return limiter
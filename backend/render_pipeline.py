@@ -0,0 +1,202 @@
+import time
+import base64
+import itertools
+import threading
+import multiprocessing
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from attachment_cache import AttachmentCache
+from mime_skeleton import MessageSkeleton, flatten
+from log_pipeline import setup_child_logging
+
+logger = logging.getLogger(__name__)
+
+# Contacts per task sent to a render process, large enough to amortize pickling
+CHUNK_SIZE = 200
+
+
+def fork_available():
+    """Render processes are forked: spawned ones would re-import server.py and its side effects"""
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+class RenderError(Exception):
+    """A contact whose message could not be built, carried through the queue to its sender"""
+
+
+class MessageRenderer:
+    """Builds the wire payload of one contact's message
+
+    SMTP payloads are the CRLF serialized message bytes, Gmail payloads the
+    base64url string for messages.send. With use_skeleton the invariant parts
+    are serialized once and only To and the body are spliced in per contact.
+    to_header replaces the recipient's address in To, so contacts with the
+    same body render to identical bytes that one transaction can deliver.
+    Instances are pickled to the render processes without their attachments,
+    each process loads its own copy.
+    """
+
+    def __init__(self, template_set, subject, from_addr=None, for_gmail=False, attachments=(),
+                 use_skeleton=True, to_header=None):
+        self.template_set = template_set
+        self.subject = subject
+        self.from_addr = from_addr
+        self.for_gmail = for_gmail
+        self.attachments = list(attachments)
+        self.use_skeleton = use_skeleton
+        self.to_header = to_header
+        self._skeleton = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['attachments'] = []
+        state['_skeleton'] = None
+        return state
+
+    def skeleton(self):
+        """The shared message skeleton, None when attachments are too large to keep serialized"""
+        if self._skeleton is None:
+            # Attachments over the cache cap are re-encoded per message and must not be pinned here
+            if any(attachment.part is None for attachment in self.attachments):
+                self.use_skeleton = False
+                return None
+            self._skeleton = MessageSkeleton(
+                self.subject, self.from_addr, [attachment.part for attachment in self.attachments])
+        return self._skeleton
+
+    def body(self, email, name, language, extra=None):
+        # Template with fallback to first available template
+        template = self.template_set.for_language(language)
+        fields = dict(extra) if extra else {}
+        fields['EMAIL'] = email
+        fields['NAME'] = name
+        fields['LANGUAGE'] = language
+        return template.render(fields)
+
+    def message(self, email, name, language, extra=None, body=None, boundary=None):
+        """Build the personalized message for one contact"""
+        email_body = body if body is not None else self.body(email, name, language, extra)
+
+        msg = MIMEMultipart(boundary=boundary)
+        if self.from_addr:
+            msg['From'] = self.from_addr
+        msg['To'] = self.to_header or email
+        msg['Subject'] = self.subject
+        msg.attach(MIMEText(email_body, 'plain'))
+
+        # Add attachments if any, the encoded parts are shared by all messages
+        for attachment in self.attachments:
+            msg.attach(attachment.get_part())
+        return msg
+
+    def render(self, email, name, language, extra=None):
+        body = self.body(email, name, language, extra)
+        data = None
+        if self.use_skeleton and self.skeleton() is not None:
+            data = self._skeleton.fill(self.to_header or email, body)
+        if data is None:
+            data = flatten(self.message(email, name, language, body=body))
+        if self.for_gmail:
+            return base64.urlsafe_b64encode(data).decode()
+        return data
+
+
+class StageStats:
+    """Messages and busy time of each campaign stage, to show which one limits throughput"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.stages = {}
+
+    def add(self, stage, count, busy_seconds=0.0):
+        with self._lock:
+            totals = self.stages.setdefault(stage, [0, 0.0])
+            totals[0] += count
+            totals[1] += busy_seconds
+
+    def snapshot(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        with self._lock:
+            return {
+                stage: {
+                    'messages': count,
+                    'per_second': round(count / elapsed, 1),
+                    'busy_seconds': round(busy, 2)
+                }
+                for stage, (count, busy) in self.stages.items()
+            }
+
+
+# State of a render process, set once by its initializer
+_renderer = None
+
+
+def _init_process(renderer, attachment_config):
+    global _renderer
+    # The forked queue handler feeds a copy of the queue that no listener reads
+    setup_child_logging()
+    folder, reserved, max_bytes, filenames = attachment_config
+    renderer.attachments = AttachmentCache(folder, reserved, max_bytes).load(filenames)
+    _renderer = renderer
+
+
+def _render_chunk(contacts):
+    started = time.process_time()
+    rendered = []
+    for row, email, name, language, extra in contacts:
+        try:
+            payload = _renderer.render(email, name, language, extra)
+        except Exception as e:
+            payload = RenderError(str(e))
+        rendered.append((row, email, payload))
+    return rendered, time.process_time() - started
+
+
+class RenderPipeline:
+    """Renders contacts into wire payloads on a process pool, ahead of the senders
+
+    render() turns the contact stream into an ordered stream of
+    (row, email, payload) items. At most two chunks per process are in
+    flight, the bounded send queue downstream holds the finished ones.
+    """
+
+    def __init__(self, renderer, attachment_config, processes, stats, chunk_size=CHUNK_SIZE, latency=None):
+        self.renderer = renderer
+        self.attachment_config = attachment_config
+        self.processes = processes
+        self.stats = stats
+        self.chunk_size = chunk_size
+        # Processes only report the CPU time of a chunk, observed as its per-message average
+        self.latency = latency
+
+    def _collect(self, future):
+        rendered, busy = future.result()
+        self.stats.add('render', len(rendered), busy)
+        if self.latency is not None and rendered:
+            self.latency.observe('render', busy / len(rendered), len(rendered))
+        return rendered
+
+    def render(self, contacts):
+        # fork keeps process start cheap and never re-imports the Flask app
+        executor = ProcessPoolExecutor(
+            self.processes, mp_context=multiprocessing.get_context('fork'),
+            initializer=_init_process, initargs=(self.renderer, self.attachment_config))
+        logger.info(f"Rendering messages on {self.processes} processes")
+        pending = deque()
+        contacts = iter(contacts)
+        try:
+            while True:
+                chunk = list(itertools.islice(contacts, self.chunk_size))
+                if not chunk:
+                    break
+                pending.append(executor.submit(_render_chunk, chunk))
+                if len(pending) >= self.processes * 2:
+                    yield from self._collect(pending.popleft())
+            while pending:
+                yield from self._collect(pending.popleft())
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,126 @@
+import time
+import heapq
+import random
+import threading
+import itertools
+
+# Delay before the first retry, doubled for every further attempt
+BASE_DELAY = 2.0
+MAX_DELAY = 300.0
+
+
+class RetryItem:
+    """A send to try again: the queued contact, the attempt it is on and its rendered payload"""
+
+    __slots__ = ('contact', 'attempt', 'payload')
+
+    def __init__(self, contact, attempt, payload=None):
+        self.contact = contact
+        self.attempt = attempt
+        self.payload = payload
+
+
+def unpack(item):
+    """(contact, attempt, payload) of a queue item, payload None until rendered"""
+    if isinstance(item, RetryItem):
+        return item.contact, item.attempt, item.payload
+    return item, 0, None
+
+
+def backoff_delay(attempt, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    """Exponential back-off with equal jitter for the given retry attempt (1 for the first)"""
+    delay = min(max_delay, base_delay * 2 ** max(attempt - 1, 0))
+    # Half fixed, half random, so retries of one throttling burst spread out
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class RetryScheduler(threading.Thread):
+    """Holds failed sends in a delay heap and puts them back on the work queue when due
+
+    Senders never sleep on a failure: they hand the item to schedule() and
+    take the next ready one. Because retries come back after the source is
+    exhausted, the scheduler also ends the campaign: once the source reported
+    how many contacts it produced (source_done) and that many reached a
+    final state (item_done), it puts one None sentinel per worker.
+    put(item) is the blocking put of the work queue.
+    """
+
+    def __init__(self, put, worker_count, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+        super().__init__(name='retry-scheduler', daemon=True)
+        self.put = put
+        self.worker_count = worker_count
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._cond = threading.Condition()
+        self._heap = []
+        self._sequence = itertools.count()
+        self._produced = None
+        self._done = 0
+        self._closed = False
+        self.counters = {'scheduled': 0, 'requeued': 0}
+
+    def schedule(self, item, retry_after=None):
+        """Re-queue item after the back-off of its attempt, or after retry_after seconds if longer"""
+        delay = backoff_delay(item.attempt, self.base_delay, self.max_delay)
+        if retry_after:
+            delay = max(delay, retry_after)
+        with self._cond:
+            due = time.monotonic() + delay
+            heapq.heappush(self._heap, (due, next(self._sequence), item))
+            self.counters['scheduled'] += 1
+            self._cond.notify()
+        return delay
+
+    def source_done(self, produced):
+        with self._cond:
+            self._produced = produced
+            close = self._should_close()
+        if close:
+            self._close()
+
+    def item_done(self, count=1):
+        with self._cond:
+            self._done += count
+            close = self._should_close()
+        if close:
+            self._close()
+
+    def _should_close(self):
+        # Under the lock; true exactly once
+        if self._closed or self._produced is None or self._done < self._produced:
+            return False
+        self._closed = True
+        self._cond.notify()
+        return True
+
+    def _close(self):
+        for _ in range(self.worker_count):
+            self.put(None)
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if self._heap:
+                        wait = self._heap[0][0] - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+                if self._closed:
+                    return
+                _, _, item = heapq.heappop(self._heap)
+                self.counters['requeued'] += 1
+            # Outside the lock, the bounded queue may make this wait for a free slot
+            self.put(item)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.counters)
+            stats['pending'] = len(self._heap)
+        return stats
@@ -0,0 +1,145 @@
+import time
+from bisect import bisect_left
+from campaign_metrics import ShardedCounters
+
+# Upper bounds in seconds, from a local render up to a slow remote handshake
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _add_entries(totals, shard):
+    """Add the bucket counts and sums of a histogram shard into totals"""
+    for value, entry in list(shard.items()):
+        merged = totals.setdefault(value, [0] * len(entry[:-1]) + [0.0])
+        for index, count in enumerate(list(entry)):
+            merged[index] += count
+
+
+class LatencyHistogram:
+    """Durations per label value, bucketed like a Prometheus histogram
+
+    Observations go to the calling thread's shard without a lock, the
+    exposition sums the shards, so timing the send loop costs two
+    perf_counter() calls and a bisect.
+    """
+
+    def __init__(self, name, help_text, label='stage', buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._shards = ShardedCounters(merge=_add_entries)
+
+    def observe(self, value, seconds, count=1):
+        """Record `count` observations of `seconds` for a label value"""
+        shard = self._shards.shard()
+        entry = shard.get(value)
+        if entry is None:
+            # One count per bucket, the last one for +Inf, then the sum
+            entry = shard[value] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect_left(self.buckets, seconds)] += count
+        entry[-1] += seconds * count
+
+    def since(self, value, started):
+        """Observe the time elapsed since a perf_counter() reading, and return the current one"""
+        now = time.perf_counter()
+        self.observe(value, now - started)
+        return now
+
+    def totals(self):
+        return self._shards.totals()
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for value, entry in sorted(self.totals().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), entry[:-1]):
+                cumulative += count
+                labels = _labels([(self.label, value), ('le', _format_value(float(bound)))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _labels([(self.label, value)])
+            lines.append(f'{self.name}_sum{labels} {_format_value(entry[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class LabeledCounter:
+    """A monotonic counter per combination of label values"""
+
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._counts = ShardedCounters()
+
+    def inc(self, *values, amount=1):
+        self._counts.add(values, amount)
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for values, count in sorted(self._counts.totals().items()):
+            lines.append(f'{self.name}{_labels(list(zip(self.labels, values)))} {_format_value(count)}')
+        return lines
+
+
+class Gauge:
+    """A value read when /metrics is scraped; read() returns a number or {label value: number}"""
+
+    def __init__(self, name, help_text, read, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+        self.label = label
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge']
+        value = self.read()
+        if isinstance(value, dict):
+            for key, number in sorted(value.items()):
+                lines.append(f'{self.name}{_labels([(self.label, key)])} {_format_value(number)}')
+        elif value is not None:
+            lines.append(f'{self.name} {_format_value(value)}')
+        return lines
+
+
+class InFlight:
+    """Sends currently on the wire, counted as started minus finished without a shared lock"""
+
+    def __init__(self):
+        self._counts = ShardedCounters()
+
+    def start(self, count=1):
+        self._counts.add('started', count)
+
+    def finish(self, count=1):
+        self._counts.add('finished', count)
+
+    def value(self):
+        totals = self._counts.totals()
+        return max(totals.get('started', 0) - totals.get('finished', 0), 0)
+
+
+def exposition(metrics):
+    """Prometheus text format for a list of metrics"""
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.exposition())
+    return '\n'.join(lines) + '\n'
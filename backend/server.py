@@ -1,32 +1,58 @@
-from flask import Flask, request, jsonify, send_from_directory, redirect, session, url_for
+from flask import Flask, Response, request, jsonify, send_from_directory, redirect, session, url_for
 from flask_cors import CORS
-from email import encoders
-from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 import smtplib
 import os
 import csv
+import io
 import time
 import threading
 import queue
+import asyncio
+import itertools
 import json
 import base64
+import gzip
 import secrets
 import logging
-from datetime import timedelta
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import google.oauth2.credentials
 import google_auth_oauthlib.flow
 from googleapiclient.discovery import build
 from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
+from smtp_pool import SMTPConnectionPool
+from gmail_client import GmailClientCache
+from attachment_cache import AttachmentCache, list_attachment_files
+from template_engine import TemplateSet
+from contact_stream import ContactFeeder, QUEUE_SIZE
+from contact_store import ContactStore
+from contact_ingest import Deduplicator, ingest_contacts, open_upload
+from suppression_list import SuppressionList, is_bounce, BOUNCED, IMPORTED
+from job_store import JobStore, SENT, FAILED, RETRYING
+from rate_limiter import AccountLimiters, provider_limits, throttle_delay, is_permanent
+from retry_scheduler import RetryScheduler, RetryItem, unpack
+from concurrency_limit import AdaptiveConcurrency
+from fair_share import FairShare
+from campaigns import Campaign, CampaignRegistry
+import async_engine
+from campaign_events import EventBroadcaster
+from campaign_metrics import CampaignMetrics
+from send_metrics import LatencyHistogram, LabeledCounter, Gauge, InFlight, exposition
+from send_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from render_pipeline import MessageRenderer, RenderPipeline, RenderError, StageStats, fork_available
+from log_pipeline import LogSampler, setup_logging, set_level, levels as log_levels
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG, 
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                    handlers=[logging.StreamHandler()])
+# Load environment variables
+load_dotenv()
+
+# Set up logging: records are written by a listener thread, never by the senders
+setup_logging(os.environ.get('LOG_LEVEL', 'DEBUG'), json_output=os.environ.get('LOG_FORMAT') == 'json')
 logger = logging.getLogger(__name__)
+# Per-message success lines: the first 100 of a campaign, then one in LOG_SENT_EVERY;
+# every campaign counts with its own copy
+sent_log = LogSampler(logger, every=int(os.environ.get('LOG_SENT_EVERY', 100)))
 
 app = Flask(__name__)
 # Use a fixed secret key instead of a random one
@@ -44,9 +70,6 @@ CORS(app,
      allow_headers=["Content-Type", "Authorization"],
      expose_headers=["Set-Cookie"])
 
-# Load environment variables
-load_dotenv()
-
 # Google OAuth Configuration
 CLIENT_SECRETS_FILE = 'client_secret.json'
 # Gmail API requires specific scopes for sending emails and accessing profile
@@ -60,23 +83,64 @@ API_SERVICE_NAME = 'gmail'
 API_VERSION = 'v1'
 
 # Global Variables
-contact_queue = queue.Queue()
 send_lock = threading.Lock()
+# Saved templates, every campaign keeps a copy of the ones it started with
 email_templates = {
     'EN': 'Default English template. Hello [NAME]',  # Default template
 }
-campaign_status = {
-    'is_running': False,
-    'remaining': 0,
-    'total': 0,
-    'errors': [],
-    'completed': False
-}
 oauth_tokens = {}
+gmail_clients = GmailClientCache(oauth_tokens)
+# Campaigns of this process, each with its own queue, templates, attachments, pool and metrics
+campaigns = CampaignRegistry()
+# Sender slots divided between running campaigns by weight; MAX_SENDERS fixes the total,
+# by default it is the largest max_connections of the running campaigns
+sender_slots = FairShare(int(os.environ['MAX_SENDERS']) if os.environ.get('MAX_SENDERS') else None)
+
+# Process-wide send metrics for /metrics, they keep counting across campaigns
+stage_latency = LatencyHistogram(
+    'mailer_stage_duration_seconds',
+    'Time spent per message in each send stage: connect, tls, auth, render, attachment_encode, rate_limit, transmit')
+messages_total = LabeledCounter(
+    'mailer_messages_total', 'Recipients by transport and outcome (sent, retried, failed)', ('transport', 'outcome'))
+in_flight_sends = InFlight()
+# Transport labels of messages_total and how the log names them
+TRANSPORTS = {
+    'smtp': 'SMTP',
+    'smtp_grouped': 'SMTP (grouped)',
+    'gmail_api': 'Gmail API',
+    'gmail_batch': 'Gmail API (batch)'
+}
 
 # Store uploaded files
 data_folder = 'data'
 os.makedirs(data_folder, exist_ok=True)
+# Files in data_folder that are not attachments
+RESERVED_FILES = {'contacts.csv'}
+# To header of messages delivered to several recipients in one SMTP transaction
+GROUP_TO_HEADER = 'undisclosed-recipients:;'
+
+# Encoded attachment parts shared by every message of a campaign
+attachment_cache = AttachmentCache(
+    data_folder, RESERVED_FILES,
+    max_bytes=int(os.environ.get('ATTACHMENT_CACHE_MAX_BYTES', 256 * 1024 * 1024)),
+    latency=stage_latency)
+
+def rate_limit(limiter, count=1):
+    """Wait for `count` send slots, timed as the rate_limit stage"""
+    started = time.perf_counter()
+    for _ in range(count):
+        limiter.acquire()
+    stage_latency.since('rate_limit', started)
+
+def transmit(send, *args, messages=1, **kwargs):
+    """Call send(*args, **kwargs), timed as the transmit stage with its messages counted in flight"""
+    in_flight_sends.start(messages)
+    started = time.perf_counter()
+    try:
+        return send(*args, **kwargs)
+    finally:
+        stage_latency.since('transmit', started)
+        in_flight_sends.finish(messages)
 
 # Save client secrets to file
 def save_client_secrets():
@@ -274,8 +338,10 @@ def oauth2callback():
             'token_uri': credentials.token_uri,
             'client_id': credentials.client_id,
             'client_secret': credentials.client_secret,
-            'scopes': credentials.scopes
+            'scopes': credentials.scopes,
+            'expiry': credentials.expiry.isoformat() if credentials.expiry else None
         }
+        gmail_clients.invalidate(user_email)
         
         logger.info(f"OAuth tokens stored for {user_email}")
 
@@ -392,6 +458,7 @@ def revoke_oauth():
     if email and email in oauth_tokens:
         # Remove the token from our storage
         del oauth_tokens[email]
+        gmail_clients.invalidate(email)
         logger.info(f"OAuth token revoked for {email}")
         return jsonify({"message": "OAuth token revoked successfully"})
     return jsonify({"error": "Email not found or not connected"}), 404
@@ -429,36 +496,57 @@ def process_contact(contact):
     
     return email, name, language
 
+# Column store of contacts.csv, kept next to it as a hidden file and built on import;
+# edits go to the change log and are compacted into the store in the background
+contact_store = ContactStore(
+    os.path.join(data_folder, 'contacts.csv'),
+    os.path.join(data_folder, '.contacts.store'),
+    os.path.join(data_folder, '.contacts.log'),
+    process_contact)
+
+# Page size limits of /get-contacts
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def compressed_json(payload):
+    """JSON response, gzip compressed when the client accepts it"""
+    body = json.dumps(payload).encode('utf-8')
+    response = Response(body, mimetype='application/json')
+    if len(body) > 1024 and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response.set_data(gzip.compress(body, compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+def encode_cursor(row):
+    return base64.urlsafe_b64encode(str(row).encode()).decode()
+
+def decode_cursor(cursor):
+    return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+
 @app.route('/upload-contacts', methods=['POST'])
 def upload_contacts():
     try:
         file = request.files['file']
         file_path = os.path.join(data_folder, 'contacts.csv')
+        filename = file.filename.lower()
         
-        # Check if it's a CSV or TXT file
-        if file.filename.endswith('.txt'):
-            # Process TXT file (one email per line)
-            with open(file_path, 'w', encoding='utf-8') as csv_file:
-                csv_file.write("email,name,language\n")  # Write header
-                for line in file:
-                    email = line.decode('utf-8').strip()
-                    if email:  # Skip empty lines
-                        csv_file.write(f"{email},,FR\n")  # Default empty name and FR language
-        else:
-            # Save as CSV
-            file.save(file_path)
-        
-        # Count total contacts
-        with open(file_path, 'r') as f:
-            total = sum(1 for line in f) - 1  # Subtract 1 for header
-            if total < 0:
-                total = 0
-            campaign_status['total'] = total
+        # TXT files hold one email per line, either may be gzip compressed
+        plain_list = filename.endswith('.txt') or filename.endswith('.txt.gz')
+        # Very large lists switch to a Bloom filter, sized from the upload at about 20 bytes per row
+        dedup = Deduplicator(expected=(request.content_length or 0) // 20)
+        with open_upload(file.stream, filename) as stream:
+            result = ingest_contacts(stream, file_path, process_contact, plain_list=plain_list, dedup=dedup)
+        contact_store.rebuild()
+        
+        total = result['total']
             
-        logger.info(f"Contacts uploaded: {total} contacts")
+        logger.info(f"Contacts uploaded: {total} contacts of {result['rows']} rows, rejected {result['rejected']}")
         return jsonify({
             "message": "Contacts uploaded successfully!", 
-            "total": total
+            "total": total,
+            "rows": result['rows'],
+            "rejected": result['rejected']
         })
     except Exception as e:
         logger.error(f"Error uploading contacts: {str(e)}")
@@ -466,53 +554,119 @@ def upload_contacts():
 
 @app.route('/get-contacts', methods=['GET'])
 def get_contacts():
+    """One page of contacts, by offset/limit or by cursor, optionally filtered
+
+    Query parameters: offset, limit, cursor (from nextCursor of the previous
+    page), q (searches email and name) and language.
+    """
     try:
-        file_path = os.path.join(data_folder, 'contacts.csv')
-        if not os.path.exists(file_path):
-            return jsonify({"contacts": []})
-            
-        contacts = []
-        with open(file_path, 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            next(reader, None)  # Skip header
-            for row in reader:
-                email, name, language = process_contact(row)
-                if email:  # Only include if email exists
-                    contacts.append({
-                        "email": email,
-                        "name": name,
-                        "language": language
-                    })
-        
-        logger.debug(f"Retrieved {len(contacts)} contacts")
-        return jsonify({"contacts": contacts})
+        table = contact_store.view()
+        if table is None:
+            return jsonify({"contacts": [], "total": 0, "nextCursor": None})
+        
+        cursor = request.args.get('cursor')
+        try:
+            offset = decode_cursor(cursor) if cursor else int(request.args.get('offset', 0))
+            limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        except ValueError:
+            return jsonify({"error": "Invalid offset, limit or cursor"}), 400
+        offset = max(offset, 0)
+        limit = min(max(limit, 1), MAX_PAGE_SIZE)
+        search = request.args.get('q', '').strip()
+        language = request.args.get('language', '').strip()
+        
+        contacts, next_row, total = table.page(offset, limit, search=search, language=language)
+        
+        logger.debug(f"Retrieved {len(contacts)} contacts from row {offset}")
+        return compressed_json({
+            "contacts": contacts,
+            "offset": offset,
+            "limit": limit,
+            "total": total,
+            "nextCursor": encode_cursor(next_row) if next_row is not None else None
+        })
     except Exception as e:
         logger.error(f"Error getting contacts: {str(e)}")
         return jsonify({"error": str(e)}), 400
 
+@app.route('/contact-languages', methods=['GET'])
+def contact_languages():
+    """Number of contacts per language, read from the store's language partitions"""
+    table = contact_store.view()
+    if table is None:
+        return jsonify({"languages": {}, "total": 0})
+    return jsonify({"languages": table.language_counts(), "total": len(table)})
+
+@app.route('/export-contacts', methods=['GET'])
+def export_contacts():
+    """The contact list as CSV, streamed from the store"""
+    table = contact_store.view()
+    if table is None:
+        return jsonify({"error": "No contacts file found"}), 404
+    return Response(table.to_csv(), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=contacts.csv'})
+
+@app.route('/patch-contacts', methods=['POST'])
+def patch_contacts():
+    """Add, update or delete contacts without rewriting the list
+
+    Body: {"ops": [{"op": "add", "email", "name", "language"},
+    {"op": "update", "row", and the fields to change}, {"op": "delete", "row"}]},
+    rows as returned by /get-contacts. All operations apply or none does.
+    """
+    try:
+        ops = request.json.get('ops', [])
+        if not isinstance(ops, list) or not all(isinstance(op, dict) for op in ops):
+            return jsonify({"error": "ops must be a list of operations"}), 400
+        rows = contact_store.patch(ops)
+        total = len(contact_store.view())
+        
+        logger.info(f"Contacts patched: {len(ops)} operations")
+        return jsonify({
+            "message": "Contacts saved successfully!",
+            "rows": rows,
+            "total": total
+        })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error patching contacts: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+
 @app.route('/save-contacts', methods=['POST'])
 def save_contacts():
     try:
         contacts = request.json.get('contacts', [])
+        # Append to the existing list instead of replacing it
+        append = request.json.get('append', False)
         file_path = os.path.join(data_folder, 'contacts.csv')
+        append = append and os.path.exists(file_path)
         
-        with open(file_path, 'w', encoding='utf-8', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(['email', 'name', 'language'])  # Header
-            for contact in contacts:
-                writer.writerow([
-                    contact.get('email', ''),
-                    contact.get('name', ''),
-                    contact.get('language', 'FR')
-                ])
-                
-        # Update total count
-        campaign_status['total'] = len(contacts)
+        if append:
+            # Appending is a patch of adds, it costs the new rows only
+            contact_store.patch([{
+                'op': 'add',
+                'email': contact.get('email', ''),
+                'name': contact.get('name', ''),
+                'language': contact.get('language', 'FR')
+            } for contact in contacts])
+            total = len(contact_store.view())
+        else:
+            with open(file_path, 'w', encoding='utf-8', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(['email', 'name', 'language'])  # Header
+                for contact in contacts:
+                    writer.writerow([
+                        contact.get('email', ''),
+                        contact.get('name', ''),
+                        contact.get('language', 'FR')
+                    ])
+            total = len(contact_store.rebuild())
         
         logger.info(f"Contacts saved: {len(contacts)} contacts")
         return jsonify({
             "message": "Contacts saved successfully!",
-            "total": len(contacts)
+            "total": total
         })
     except Exception as e:
         logger.error(f"Error saving contacts: {str(e)}")
@@ -530,6 +684,7 @@ def upload_attachment():
             
         file_path = os.path.join(data_folder, file.filename)
         file.save(file_path)
+        attachment_cache.invalidate(file.filename)
         
         logger.info(f"Attachment uploaded: {file.filename}")
         return jsonify({
@@ -544,14 +699,13 @@ def upload_attachment():
 def get_attachments():
     try:
         attachments = []
-        for filename in os.listdir(data_folder):
-            if filename != 'contacts.csv':
-                file_path = os.path.join(data_folder, filename)
-                file_size = os.path.getsize(file_path)
-                attachments.append({
-                    "filename": filename,
-                    "size": file_size
-                })
+        for filename in list_attachment_files(data_folder, RESERVED_FILES):
+            file_path = os.path.join(data_folder, filename)
+            file_size = os.path.getsize(file_path)
+            attachments.append({
+                "filename": filename,
+                "size": file_size
+            })
         
         logger.debug(f"Retrieved {len(attachments)} attachments")
         return jsonify({"attachments": attachments})
@@ -567,8 +721,9 @@ def delete_attachment():
             return jsonify({"error": "No filename provided"}), 400
             
         file_path = os.path.join(data_folder, filename)
-        if os.path.exists(file_path) and filename != 'contacts.csv':
+        if os.path.exists(file_path) and filename not in RESERVED_FILES:
             os.remove(file_path)
+            attachment_cache.invalidate(filename)
             logger.info(f"Attachment deleted: {filename}")
             return jsonify({"message": f"Attachment {filename} deleted successfully"})
         else:
@@ -612,18 +767,8 @@ def test_email():
             if gmail_user not in oauth_tokens:
                 return jsonify({"error": "Gmail OAuth not connected or expired"}), 400
                 
-            # Send test email using Gmail API
-            creds_dict = oauth_tokens[gmail_user]
-            credentials = Credentials(
-                token=creds_dict['token'],
-                refresh_token=creds_dict['refresh_token'],
-                token_uri=creds_dict['token_uri'],
-                client_id=creds_dict['client_id'],
-                client_secret=creds_dict['client_secret'],
-                scopes=creds_dict['scopes']
-            )
-            
-            service = build('gmail', 'v1', credentials=credentials)
+            # Send test email using the cached Gmail API client
+            gmail_client = gmail_clients.get(gmail_user)
             
             message = MIMEMultipart()
             message['to'] = test_email
@@ -632,17 +777,9 @@ def test_email():
             body = "This is a test email to verify your SMTP configuration is working correctly."
             message.attach(MIMEText(body, 'plain'))
             
-            # Encode the message
+            # Encode and send the message
             encoded_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-            
-            # Create the message
-            create_message = {
-                'raw': encoded_message
-            }
-            
-            # Send the message
-            send_message = service.users().messages().send(
-                userId="me", body=create_message).execute()
+            gmail_client.send_raw(encoded_message)
             
             logger.info(f"Test email sent via Gmail API to {test_email}")
             return jsonify({"message": "Test email sent successfully via Gmail API"})
@@ -686,219 +823,844 @@ def test_email():
         logger.error(f"Error sending test email: {str(e)}")
         return jsonify({"error": str(e)}), 400
 
+def campaign_summary(campaign):
+    """Progress of a campaign for /campaigns"""
+    status = campaign.metrics.snapshot(recent_errors=0)
+    return {
+        "campaignId": campaign.id,
+        "isRunning": status['is_running'],
+        "completed": status['completed'],
+        "weight": campaign.weight,
+        "engine": campaign.engine,
+        "total": status['total'],
+        "remaining": status['remaining'],
+        "sent": status['sent'],
+        "failed": status['failed'],
+        "suppressed": status['suppressed'],
+        "queued": campaign.queue_depth()
+    }
+
+@app.route('/campaigns', methods=['GET'])
+def list_campaigns():
+    """Campaigns of this process, running and recently finished, with the sender slots they hold"""
+    return jsonify({
+        "campaigns": [campaign_summary(campaign) for campaign in campaigns.all()],
+        "senderSlots": sender_slots.stats()
+    })
+
 @app.route('/campaign-status', methods=['GET'])
 def get_campaign_status():
+    """Progress of the campaign named by campaign_id, or of the latest one"""
+    campaign_id = request.args.get('campaign_id')
+    campaign = campaigns.get(campaign_id)
+    if campaign is None and campaign_id:
+        return jsonify({"error": "Unknown campaign"}), 404
+    status = (campaign.metrics if campaign else CampaignMetrics()).snapshot()
     return jsonify({
-        "isRunning": campaign_status['is_running'],
-        "remaining": campaign_status['remaining'],
-        "total": campaign_status['total'],
-        "errors": campaign_status['errors'][-5:],  # Return last 5 errors
-        "completed": campaign_status['completed'],
-        "status": "running" if campaign_status['is_running'] else "completed"
+        "isRunning": status['is_running'],
+        "remaining": status['remaining'],
+        "total": status['total'],
+        "sent": status['sent'],
+        "failed": status['failed'],
+        "retried": status['retried'],
+        "suppressed": status['suppressed'],
+        "errors": status['errors'],  # Last 5 errors
+        "errorClasses": status['error_classes'],
+        "completed": status['completed'],
+        "status": "running" if status['is_running'] else "completed",
+        "campaignId": status['campaign_id'],
+        "weight": campaign.weight if campaign else None,
+        "runningCampaigns": len(campaigns.running()),
+        "smtpPool": campaign.pool.stats() if campaign and campaign.pool else None,
+        "rateLimiter": campaign.rate_limiter.stats() if campaign and campaign.rate_limiter else None,
+        "concurrency": campaign.concurrency.stats() if campaign and campaign.concurrency else None,
+        "retries": campaign.retry_scheduler.stats() if campaign and campaign.retry_scheduler else None,
+        "stages": campaign.stage_stats.snapshot() if campaign and campaign.stage_stats else None
     })
 
 @app.route('/reset-campaign', methods=['POST'])
 def reset_campaign():
-    global campaign_status
-    campaign_status = {
-        'is_running': False,
-        'remaining': 0,
-        'total': 0,
-        'errors': [],
-        'completed': False
-    }
-    logger.info("Campaign status reset")
+    """Forget finished campaigns, running ones are left alone"""
+    removed = campaigns.remove_finished()
+    logger.info(f"Campaign status reset: {removed} finished campaigns cleared")
     return jsonify({"message": "Campaign status reset successfully"})
 
+def progress_snapshot(campaign_id=None):
+    """The progress fields pushed to /campaign-events clients, for a campaign or the latest one"""
+    campaign = campaigns.get(campaign_id)
+    status = (campaign.metrics if campaign else CampaignMetrics()).snapshot()
+    concurrency = campaign.concurrency if campaign else None
+    return {
+        "campaignId": status['campaign_id'],
+        "isRunning": status['is_running'],
+        "completed": status['completed'],
+        "sent": status['sent'],
+        "failed": status['failed'],
+        "suppressed": status['suppressed'],
+        "remaining": status['remaining'],
+        "total": status['total'],
+        "errors": status['errors'],
+        "errorClasses": status['error_classes'],
+        "concurrency": int(concurrency.limit) if concurrency else None,
+        "runningCampaigns": len(campaigns.running())
+    }
+
+# One sampling thread for all open event streams
+campaign_events = EventBroadcaster(progress_snapshot)
+
+@app.route('/campaign-events', methods=['GET'])
+def get_campaign_events():
+    """Server-Sent Events stream of campaign progress, /campaign-status stays the polling fallback
+
+    Follows the campaign named by campaign_id, or the latest one.
+    """
+    campaign_id = request.args.get('campaign_id') or None
+    if campaign_id and campaigns.get(campaign_id) is None:
+        return jsonify({"error": "Unknown campaign"}), 404
+    return Response(campaign_events.stream(campaign_id), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Stop nginx from buffering the stream
+    })
+
+def running_total(value):
+    """Sum of value(campaign) over the running campaigns, for the process-wide gauges"""
+    return sum(value(campaign) for campaign in campaigns.running())
+
+def smtp_sessions():
+    return running_total(lambda campaign: campaign.pool.stats()['open_sessions'] if campaign.pool else 0)
+
+# Exposed by /metrics in this order
+METRICS = [
+    stage_latency,
+    messages_total,
+    Gauge('mailer_queue_depth', 'Contacts read and waiting for a sender, all campaigns',
+          lambda: running_total(Campaign.queue_depth)),
+    Gauge('mailer_in_flight_sends', 'Messages currently being transmitted', in_flight_sends.value),
+    Gauge('mailer_sender_slots_in_use', 'Sender slots held by each running campaign',
+          lambda: {key: share['in_flight'] for key, share in sender_slots.stats()['campaigns'].items()},
+          label='campaign'),
+    Gauge('mailer_smtp_sessions_open', 'Open pooled SMTP sessions', smtp_sessions),
+    Gauge('mailer_concurrency_limit', 'Sends allowed in flight by the adaptive concurrency limits',
+          lambda: running_total(lambda campaign: int(campaign.concurrency.limit) if campaign.concurrency else 0)),
+    Gauge('mailer_retry_pending', 'Failed sends waiting for their retry',
+          lambda: running_total(lambda campaign: campaign.retry_scheduler.pending() if campaign.retry_scheduler else 0)),
+    Gauge('mailer_campaign_running', 'Campaigns currently sending', lambda: len(campaigns.running())),
+    Gauge('mailer_campaign_remaining', 'Recipients of the running campaigns not processed yet',
+          lambda: running_total(lambda campaign: campaign.metrics.snapshot(recent_errors=0)['remaining']))
+]
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Send metrics in the Prometheus text format"""
+    return Response(exposition(METRICS), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/log-level', methods=['GET', 'POST'])
+def log_level():
+    """Show or change log levels and the success line sampling without a restart"""
+    if request.method == 'POST':
+        data = request.json or {}
+        try:
+            if 'level' in data:
+                set_level(data['level'], data.get('logger'))
+            if 'sentEvery' in data:
+                sent_log.every = max(int(data['sentEvery']), 1)
+                for campaign in campaigns.running():
+                    campaign.sent_log.every = sent_log.every
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        logger.warning(f"Log settings changed: {data}")
+    return jsonify({"levels": log_levels(), "sentEvery": sent_log.every})
+
+# Durable per-recipient campaign state, survives restarts
+job_store = JobStore(os.path.join(data_folder, '.campaigns.db'))
+interrupted = job_store.mark_interrupted()
+if interrupted:
+    logger.warning(f"{interrupted} campaign(s) were interrupted by a restart, see /resume-campaign")
+
+# Addresses never mailed again: unsubscribed, bounced or imported
+suppressions = SuppressionList(os.path.join(data_folder, '.suppressions.db'))
+
+# One rate limiter per sending account, its daily count is kept in the job store
+rate_limiters = AccountLimiters(job_store.send_counts, job_store.record_send)
+
+@app.route('/import-suppressions', methods=['POST'])
+def import_suppressions():
+    """Suppress addresses from an uploaded CSV/TXT file (email in the first column, gzip allowed)
+    or from a JSON body {"emails": [...], "reason": "unsubscribed"}
+    """
+    try:
+        if 'file' in request.files:
+            file = request.files['file']
+            reason = request.form.get('reason', IMPORTED)
+            with open_upload(file.stream, file.filename.lower()) as stream:
+                # A header row is skipped as it is no address
+                emails = (row[0] for row in csv.reader(stream) if row and '@' in row[0])
+                added = suppressions.add_many(emails, reason, source=file.filename)
+        else:
+            data = request.json or {}
+            added = suppressions.add_many(data.get('emails', []), data.get('reason', IMPORTED), source='api')
+        logger.info(f"Suppressions imported: {added} new addresses")
+        return jsonify({"added": added, "total": len(suppressions), "reasons": suppressions.counts()})
+    except Exception as e:
+        logger.error(f"Error importing suppressions: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/remove-suppressions', methods=['POST'])
+def remove_suppressions():
+    """Allow mailing addresses again: JSON body {"emails": [...]}"""
+    try:
+        removed = suppressions.remove_many((request.json or {}).get('emails', []))
+        logger.info(f"Suppressions removed: {removed} addresses")
+        return jsonify({"removed": removed, "total": len(suppressions)})
+    except Exception as e:
+        logger.error(f"Error removing suppressions: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/export-suppressions', methods=['GET'])
+def export_suppressions():
+    """The suppression list as CSV, streamed in batches"""
+    def rows():
+        yield 'email,reason,source,created_at\n'
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        for email, reason, source, created_at in suppressions.export():
+            writer.writerow([email, reason, source or '', datetime.fromtimestamp(created_at).isoformat()])
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    return Response(rows(), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=suppressions.csv'})
+
 @app.route('/send-emails', methods=['POST'])
 def send_emails():
-    global campaign_status
-    
+    return start_campaign(request.json)
+
+@app.route('/resume-campaign', methods=['GET', 'POST'])
+def resume_campaign():
+    """GET shows the campaign that would be resumed, POST resumes it
+
+    The POST body may name a campaign_id and must repeat the SMTP password,
+    which is never stored. Other fields override the stored settings.
+    """
+    try:
+        data = request.json if request.method == 'POST' else {}
+        data = data or {}
+        campaign_id = data.pop('campaign_id', None) or request.args.get('campaign_id')
+        campaign = job_store.get_campaign(campaign_id)
+        if campaign is None:
+            return jsonify({"error": "No campaign to resume"}), 404
+        
+        if request.method == 'GET':
+            return jsonify({
+                "campaignId": campaign['id'],
+                "status": campaign['status'],
+                "recipients": job_store.state_counts(campaign['id'])
+            })
+        
+        if campaign['status'] == 'completed':
+            return jsonify({"error": "Campaign already completed"}), 400
+        running = campaigns.get(campaign['id'])
+        if running is not None and running.is_running:
+            return jsonify({"error": "This campaign is already running"}), 409
+        
+        table = contact_store.view()
+        if table is None:
+            return jsonify({"error": "No contacts file found"}), 400
+        if table.source != campaign['contacts_fingerprint'] and not data.pop('force', False):
+            return jsonify({"error": "contacts.csv changed since the campaign started, pass force to resume anyway"}), 409
+        
+        config = dict(campaign['config'])
+        config.update(data)
+        return start_campaign(config, resume_id=campaign['id'])
+    except Exception as e:
+        logger.error(f"Error resuming campaign: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+
+def start_campaign(data, resume_id=None):
+    """Start the sender threads for a new campaign, or resume a stored one
+
+    Campaigns run side by side, each with its own queue, limiters, pool and
+    metrics; they share the sender slots in proportion to their weight.
+    """
+    metrics = None
+    # Set once the campaign is in the job store, so a failed start can be resumed
+    stored_id = resume_id
     try:
-        data = request.json
         use_gmail_oauth = data.get('use_gmail_oauth', False)
         gmail_user = data.get('gmail_user', '')
         
         if use_gmail_oauth:
             if gmail_user not in oauth_tokens:
                 return jsonify({"error": "Gmail OAuth not connected or expired"}), 400
+            # Built once per account and shared by every worker
+            gmail_client = gmail_clients.get(gmail_user)
+            # Messages per HTTP batch request, 0 or 1 sends one request per message
+            gmail_batch_size = int(data.get('gmail_batch_size', 0))
+            group_recipients = 0
         else:
             smtp_host = data['smtp_host']
             port = data['port']
             username = data['username']
             password = data['password']
+            use_ssl = data.get('use_ssl', False)
+            # Session recycling limits for the SMTP connection pool
+            max_messages_per_connection = int(data.get('max_messages_per_connection', 100))
+            max_idle_seconds = float(data.get('max_idle_seconds', 30))
+            # Only turn off for a relay on a trusted network, e.g. a local test server
+            smtp_starttls = data.get('smtp_starttls', True)
+            # Recipients per SMTP transaction for contacts whose messages are identical, 0 or 1 is off
+            group_recipients = int(data.get('group_recipients', 0))
+            gmail_batch_size = 0
         
         subject = data['subject']
         delay = int(data['pause_between_messages'])
         retries = int(data['retries'])
         max_connections = int(data['max_connections'])
+        # Adaptive concurrency treats max_connections as a ceiling and sends with as
+        # many connections as the server answers quickly without throttling
+        adaptive_concurrency = bool(data.get('adaptive_concurrency', False))
+        min_connections = int(data.get('min_connections', 1))
+        # 'threads' runs one OS thread per connection, 'async' runs max_connections
+        # coroutines on a single event loop thread and scales to thousands of sends in flight
+        engine = data.get('engine', 'threads')
+        if engine not in ('threads', 'async'):
+            return jsonify({"error": f"Unknown engine: {engine}"}), 400
+        if engine == 'async':
+            if gmail_batch_size > 1 or group_recipients > 1:
+                return jsonify({"error": "gmail_batch_size and group_recipients are only supported by the threads engine"}), 400
+            async_engine.check_available(use_gmail_oauth)
+        # Processes rendering messages ahead of the senders, opt-in: they are forked
+        # from this multithreaded server; 0 lets every sender render its own messages
+        render_processes = int(data.get('render_processes') or 0)
+        if render_processes and not fork_available():
+            return jsonify({"error": "render_processes needs the fork start method"}), 400
+        # Share of the sender slots while other campaigns are running too
+        weight = float(data.get('weight', 1))
+        if weight <= 0:
+            return jsonify({"error": "weight must be positive"}), 400
+        # Attachment filenames of this campaign, all files of the attachment folder by default
+        attachment_names = data.get('attachments')
+        if attachment_names is not None:
+            missing = set(attachment_names) - set(list_attachment_files(data_folder, RESERVED_FILES))
+            if missing:
+                return jsonify({"error": f"Unknown attachments: {', '.join(sorted(missing))}"}), 400
 
-        # Reset campaign status
-        campaign_status['errors'] = []
-        campaign_status['is_running'] = True
-        campaign_status['completed'] = False
+        # A resumed campaign keeps the templates it started with
+        templates = data.get('templates') or email_templates
         
         # Check if templates exist
-        if not email_templates or not any(email_templates.values()):
+        if not templates or not any(templates.values()):
             return jsonify({"error": "Please save at least one email template first"}), 400
 
-        # Load contacts
-        contacts_path = os.path.join(data_folder, 'contacts.csv')
-        if not os.path.exists(contacts_path):
-            return jsonify({"error": "No contacts file found"}), 400
+        # Parse the templates and resolve the language fallback once for the campaign
+        template_set = TemplateSet(templates)
+        with_columns = template_set.needs_columns()
 
-        contacts = []
-        with open(contacts_path, mode='r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            next(reader, None)  # Skip header
-            for row in reader:
-                email, name, language = process_contact(row)
-                if email:  # Only include if email exists
-                    contacts.append((email, name, language))
+        # Load contacts, the campaign keeps reading this table even if a new list is uploaded
+        table = contact_store.view()
+        if table is None:
+            return jsonify({"error": "No contacts file found"}), 400
 
-        if not contacts:
+        if resume_id:
+            # Skip recipients already sent or failed, start reading at the first pending row
+            campaign_id = resume_id
+            done_rows = job_store.done_rows(campaign_id)
+            start_row = 0
+            while start_row in done_rows:
+                start_row += 1
+            if start_row >= table.rows:
+                job_store.set_campaign_status(campaign_id, 'completed')
+                return jsonify({"error": "Nothing left to send in this campaign"}), 400
+            contacts = table.iter_contacts(with_columns, start_row=start_row)
+            contacts = (contact for contact in contacts if contact[0] not in done_rows)
+            logger.info(f"Resuming campaign {campaign_id} at row {start_row}, {len(done_rows)} recipients already done")
+        else:
+            campaign_id = secrets.token_hex(8)
+            done_rows = set()
+            # Stream contacts from the store, sending starts with the first row
+            contacts = table.iter_contacts(with_columns)
+        first_contact = next(contacts, None)
+        if first_contact is None:
             return jsonify({"error": "No valid contacts found in file"}), 400
 
-        campaign_status['remaining'] = len(contacts)
-        campaign_status['total'] = len(contacts)
+        if not resume_id:
+            # Everything needed to resume, except the password which is never stored
+            config = {key: value for key, value in data.items() if key != 'password'}
+            config['templates'] = templates
+            job_store.create_campaign(campaign_id, config, table.source)
+            stored_id = campaign_id
 
-        # Clear and fill queue
-        while not contact_queue.empty():
-            contact_queue.get()
-        
-        for contact in contacts:
-            contact_queue.put(contact)
+        # Fresh metrics for this campaign, the workers keep their own reference
+        total_contacts = len(table)
+        metrics = CampaignMetrics(campaign_id, total=total_contacts, skipped=len(done_rows))
+        metrics.is_running = True
+        campaign = Campaign(campaign_id, metrics, weight=weight, engine=engine)
+        campaign.sent_log = sent_log.copy()
+        campaign.templates = templates
+        campaigns.add(campaign)
+
+        # Suppressed recipients are dropped here, before they are rendered or queued
+        suppressions.load()
+
+        def track(contacts):
+            # Record every recipient as pending before it reaches a worker
+            for contact in contacts:
+                if contact[1] in suppressions:
+                    metrics.record_suppressed()
+                    continue
+                job_store.add_pending(campaign_id, contact[0], contact[1])
+                yield contact
+
+        # Bounded queue of this campaign, its workers only read from their own queue
+        if engine == 'async':
+            work_queue = async_engine.LoopQueue(QUEUE_SIZE)
+        else:
+            work_queue = queue.Queue(maxsize=QUEUE_SIZE)
+        campaign.work_queue = work_queue
+        # Failed sends wait here instead of in a sender, then go back on the queue
+        scheduler = campaign.retry_scheduler = RetryScheduler(work_queue.put, max_connections)
+
+        def contacts_done(produced, error):
+            if error is not None:
+                metrics.record_error(f"Error reading contacts: {str(error)}", error)
+            # Less than the store holds only when reading it failed part way
+            metrics.total = produced + metrics.snapshot(recent_errors=0)['suppressed'] + len(done_rows)
+            scheduler.source_done(produced)
+
+        # One limiter per account shared by all workers of its campaigns,
+        # defaults follow the provider's published quotas
+        if use_gmail_oauth:
+            account = f"gmail_api/{gmail_user.lower()}"
+            limits = provider_limits('gmail_api', gmail_user)
+        else:
+            account = f"{smtp_host.lower()}/{(username or '').lower()}"
+            limits = provider_limits(smtp_host, username)
+        for window in ('per_second', 'per_minute', 'per_day'):
+            if data.get(f'rate_{window}'):
+                limits[window] = float(data[f'rate_{window}'])
+        if delay > 0:
+            # The old per-worker pause becomes the same average rate, evenly spaced
+            limits['per_second'] = min(limits.get('per_second') or float('inf'), max_connections / delay)
+        limiter = campaign.rate_limiter = rate_limiters.get(account, limits)
+        logger.info(f"Send rate limits of {account}: {limiter.limits()}")
+
+        if adaptive_concurrency:
+            concurrency = AdaptiveConcurrency(max_connections, minimum=min_connections)
+        else:
+            concurrency = None
+        campaign.concurrency = concurrency
+
+        # Read and encode the attachments once for the whole campaign
+        attachments = campaign.attachments = attachment_cache.load(attachment_names)
+        logger.info(f"Attachments ready: {attachment_cache.stats()}")
+
+        # One pooled session per worker, reused across messages; workers close theirs when they exit
+        pool = None
+        if not use_gmail_oauth:
+            pool_class = async_engine.AsyncSMTPPool if engine == 'async' else SMTPConnectionPool
+            pool = pool_class(
+                smtp_host, port, username, password,
+                use_ssl=use_ssl,
+                max_messages=max_messages_per_connection,
+                max_idle=max_idle_seconds,
+                use_starttls=smtp_starttls,
+                latency=stage_latency
+            )
+        campaign.pool = pool
+
+        # Messages are rendered to wire payloads: SMTP bytes or Gmail base64url strings
+        renderer = MessageRenderer(
+            template_set, subject,
+            from_addr=None if use_gmail_oauth else username,
+            for_gmail=use_gmail_oauth,
+            attachments=attachments,
+            # Grouped recipients share one message, addressed like a Bcc
+            to_header=GROUP_TO_HEADER if group_recipients > 1 else None)
+        stats = campaign.stage_stats = StageStats()
+
+        def prepare(item):
+            """Wire payload of a queued item, rendering it here when there is no render pipeline"""
+            if render_processes:
+                payload = item[2]
+                if isinstance(payload, RenderError):
+                    raise payload
+                return payload
+            started = time.perf_counter()
+            _, email, name, language, extra = item
+            payload = renderer.render(email, name, language, extra)
+            elapsed = time.perf_counter() - started
+            stats.add('render', 1, elapsed)
+            stage_latency.observe('render', elapsed)
+            return payload
+
+        # Outcome bookkeeping shared by the threaded workers and the async engine
+
+        default_transport = 'gmail_api' if use_gmail_oauth else 'smtp'
+
+        def record_sent(row, email, attempts, wait=True, transport=default_transport):
+            limiter.on_success()
+            # Wait for the commit so a crash never re-sends this recipient
+            job_store.set_state(campaign_id, row, SENT, attempts, wait=wait)
+            metrics.record_sent()
+            messages_total.inc(transport, 'sent')
+            # Sampled before the line is built, skipped messages cost no formatting
+            if campaign.sent_log():
+                logger.info(f'Email sent to {email} via {TRANSPORTS[transport]}',
+                            extra={'campaign_id': campaign_id, 'row': row, 'transport': transport})
+
+        def record_failure(row, email, attempt, error, backoff=True, transport=default_transport):
+            """Record a failed attempt, returns True when it will be retried"""
+            logger.error(f'Error sending to {email}: {error}',
+                         extra={'campaign_id': campaign_id, 'row': row, 'transport': transport})
+            retry_after = throttle_delay(error)
+            if retry_after is not None and backoff:
+                limiter.backoff(retry_after)
+            if attempt < retries and not is_permanent(error):
+                job_store.set_state(campaign_id, row, RETRYING, attempt + 1, str(error))
+                metrics.record_retry()
+                messages_total.inc(transport, 'retried')
+                return True
+            job_store.set_state(campaign_id, row, FAILED, attempt + 1, str(error))
+            metrics.record_failed(f"Failed to send to {email}: {str(error)}", error)
+            messages_total.inc(transport, 'failed')
+            if is_bounce(error):
+                # The address does not exist, later campaigns skip it
+                suppressions.add(email, BOUNCED, source=campaign_id)
+            return False
+
+        def record_error(row, error):
+            logger.error(f"Worker error: {error}", extra={'campaign_id': campaign_id, 'row': row})
+            job_store.set_state(campaign_id, row, FAILED, 0, str(error))
+            metrics.record_failed(str(error), error)
+            messages_total.inc(default_transport, 'failed')
+
+        def retry_later(item, error):
+            """Hand a failed send to the retry scheduler, the sender moves on to the next ready item"""
+            delay = scheduler.schedule(item, retry_after=throttle_delay(error))
+            logger.debug(f"Retrying row {item.contact[0]} in {delay:.1f}s (attempt {item.attempt + 1})")
+
+        def contact_done(count=1):
+            stats.add('send', count)
+            metrics.record_processed(count)
+            # The scheduler ends the campaign once every contact reached a final state
+            scheduler.item_done(count)
+
+        def complete_campaign():
+            sender_slots.unregister(campaign_id)
+            job_store.set_campaign_status(campaign_id, 'completed')
+            metrics.is_running = False
+            metrics.completed = True
+            logger.info(f"Campaign {campaign_id} completed!")
+            if not use_gmail_oauth:
+                logger.info(f"SMTP pool stats: {pool.stats()}")
+            logger.info(f"Stage throughput: {stats.snapshot()}")
+            if concurrency:
+                logger.info(f"Concurrency: {concurrency.stats()}")
+
+        active_workers = [max_connections]
+
+        def finish_worker():
+            if not use_gmail_oauth:
+                pool.release()
+            
+            # The last worker to exit closes the campaign
+            with send_lock:
+                active_workers[0] -= 1
+                last_worker = active_workers[0] == 0
+            if last_worker:
+                complete_campaign()
+
+        def send_limited(send, *args, errors_of=None, **kwargs):
+            """transmit() in a sender slot, and in a slot of the adaptive concurrency limit
+            when the campaign has one
+
+            errors_of(result) lists the per-recipient errors of a send that
+            returns them instead of raising, so throttling still counts.
+            """
+            if concurrency is not None:
+                concurrency.acquire()
+            errors = ()
+            # The campaign's own limit first, so a sender waiting on it holds no shared slot
+            sender_slots.acquire(campaign_id)
+            # Latency counts from here, waiting for a share of the slots is not the server being slow
+            started = time.perf_counter()
+            try:
+                result = transmit(send, *args, **kwargs)
+                if concurrency is not None and errors_of is not None:
+                    errors = list(errors_of(result))
+                return result
+            except Exception as e:
+                errors = (e,)
+                raise
+            finally:
+                sender_slots.release(campaign_id)
+                if concurrency is not None:
+                    concurrency.release(started, errors)
 
         def worker():
-            while not contact_queue.empty():
+            while True:
+                item = work_queue.get()
+                if item is None:
+                    break
+                contact, attempt, payload = unpack(item)
+                row, email = contact[0], contact[1]
                 try:
-                    email, name, language = contact_queue.get()
-                    
-                    # Get template with fallback to first available template
-                    template = email_templates.get(language)
-                    if not template:
-                        # Try to get any template
-                        for lang, tmpl in email_templates.items():
-                            if tmpl:
-                                template = tmpl
-                                break
+                    # A retry carries the payload rendered for its first attempt
+                    if payload is None:
+                        payload = prepare(contact)
                     
-                    if not template:
-                        raise ValueError(f"No template found for language {language}")
-                        
-                    email_body = template.replace("[NAME]", name)
-                    
-                    for attempt in range(retries + 1):
-                        try:
-                            if use_gmail_oauth:
-                                # Send email using Gmail API
-                                creds_dict = oauth_tokens[gmail_user]
-                                credentials = Credentials(
-                                    token=creds_dict['token'],
-                                    refresh_token=creds_dict['refresh_token'],
-                                    token_uri=creds_dict['token_uri'],
-                                    client_id=creds_dict['client_id'],
-                                    client_secret=creds_dict['client_secret'],
-                                    scopes=creds_dict['scopes']
-                                )
-                                
-                                service = build('gmail', 'v1', credentials=credentials)
-                                
-                                message = MIMEMultipart()
-                                message['to'] = email
-                                message['subject'] = subject
-                                message.attach(MIMEText(email_body, 'plain'))
-                                
-                                # Add attachments if any
-                                for filename in os.listdir(data_folder):
-                                    if filename != 'contacts.csv':
-                                        attachment_path = os.path.join(data_folder, filename)
-                                        with open(attachment_path, 'rb') as attachment:
-                                            part = MIMEBase('application', 'octet-stream')
-                                            part.set_payload(attachment.read())
-                                            encoders.encode_base64(part)
-                                            part.add_header('Content-Disposition', f'attachment; filename={filename}')
-                                            message.attach(part)
-                                
-                                # Encode the message
-                                encoded_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-                                
-                                # Create the message
-                                create_message = {
-                                    'raw': encoded_message
-                                }
-                                
-                                # Send the message
-                                send_message = service.users().messages().send(
-                                    userId="me", body=create_message).execute()
-                                
-                                logger.info(f'Email sent to {email} via Gmail API')
-                            else:
-                                # Send email using SMTP
-                                msg = MIMEMultipart()
-                                msg['From'] = username
-                                msg['To'] = email
-                                msg['Subject'] = subject
-                                msg.attach(MIMEText(email_body, 'plain'))
-                                
-                                # Add attachments if any
-                                for filename in os.listdir(data_folder):
-                                    if filename != 'contacts.csv':
-                                        attachment_path = os.path.join(data_folder, filename)
-                                        with open(attachment_path, 'rb') as attachment:
-                                            part = MIMEBase('application', 'octet-stream')
-                                            part.set_payload(attachment.read())
-                                            encoders.encode_base64(part)
-                                            part.add_header('Content-Disposition', f'attachment; filename={filename}')
-                                            msg.attach(part)
-                                
-                                server = smtplib.SMTP(smtp_host, port)
-                                server.starttls()
-                                server.login(username, password)
-                                server.send_message(msg)
-                                server.quit()
-                                
-                                logger.info(f'Email sent to {email} via SMTP')
-                            
-                            break
-                        except Exception as e:
-                            logger.error(f'Error sending to {email}: {e}')
-                            if attempt < retries:
-                                time.sleep(2)
-                            else:
-                                campaign_status['errors'].append(f"Failed to send to {email}: {str(e)}")
-                    
-                    with send_lock:
-                        campaign_status['remaining'] -= 1
-                        
-                    contact_queue.task_done()
-                    time.sleep(delay)
+                    rate_limit(limiter)
+                    try:
+                        if use_gmail_oauth:
+                            # Send email using the campaign's shared Gmail API client
+                            send_limited(gmail_client.send_raw, payload)
+                        else:
+                            # Send email using SMTP
+                            send_limited(pool.sendmail, username, [email], payload)
+                    except Exception as e:
+                        if record_failure(row, email, attempt, e):
+                            retry_later(RetryItem(contact, attempt + 1, payload), e)
+                            continue
+                    else:
+                        record_sent(row, email, attempt + 1)
                 except Exception as e:
-                    logger.error(f"Worker error: {e}")
-                    campaign_status['errors'].append(str(e))
-                    with send_lock:
-                        campaign_status['remaining'] -= 1
-                    continue
+                    record_error(row, e)
+                contact_done()
+            
+            finish_worker()
+
+        def batch_worker():
+            """Gmail batch mode: send up to gmail_batch_size messages per HTTP batch request"""
+            exhausted = False
+            while not exhausted:
+                # Block for the first contact, then take whatever else is ready
+                contacts_batch = []
+                contact = work_queue.get()
+                while contact is not None:
+                    contacts_batch.append(contact)
+                    if len(contacts_batch) >= gmail_batch_size:
+                        break
+                    try:
+                        contact = work_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                exhausted = contact is None
+                if not contacts_batch:
+                    break
+                
+                messages = {}
+                entries = [unpack(item) for item in contacts_batch]
+                for index, (contact, attempt, payload) in enumerate(entries):
+                    try:
+                        if payload is None:
+                            payload = prepare(contact)
+                            entries[index] = (contact, attempt, payload)
+                        messages[str(index)] = payload
+                    except Exception as e:
+                        record_error(contact[0], e)
+                
+                results = {}
+                if messages:
+                    rate_limit(limiter, len(messages))
+                    try:
+                        # A single attempt, failed messages go back through the retry scheduler
+                        results = send_limited(gmail_client.send_batch, messages, retries=0, messages=len(messages),
+                                               errors_of=lambda results: results.values())
+                    except Exception as e:
+                        logger.error(f"Batch send error: {e}")
+                        results = {message_id: e for message_id in messages}
+                
+                throttled = False
+                requeued = 0
+                for message_id, error in results.items():
+                    contact, attempt, payload = entries[int(message_id)]
+                    row, email = contact[0], contact[1]
+                    if error is None:
+                        record_sent(row, email, attempt + 1, wait=False, transport='gmail_batch')
+                        continue
+                    # Back off once per batch, not once per message
+                    if record_failure(row, email, attempt, error, backoff=not throttled, transport='gmail_batch'):
+                        retry_later(RetryItem(contact, attempt + 1, payload), error)
+                        requeued += 1
+                    throttled = throttled or throttle_delay(error) is not None
+                # One commit for the whole batch before taking more work
+                job_store.flush()
+                contact_done(len(contacts_batch) - requeued)
             
-            # Check if all emails are sent
-            if campaign_status['remaining'] <= 0:
-                campaign_status['is_running'] = False
-                campaign_status['completed'] = True
-                logger.info("Campaign completed!")
-
-        # Start worker threads
-        threads = []
-        for _ in range(max_connections):
-            thread = threading.Thread(target=worker)
-            thread.daemon = True  # Make thread daemon so it exits when main thread exits
-            thread.start()
-            threads.append(thread)
-
-        logger.info("Email campaign started")
-        return jsonify({"message": "Email campaign started!"})
+            finish_worker()
+
+        def group_worker():
+            """SMTP grouping mode: one transaction for contacts whose messages are identical"""
+            exhausted = False
+            while not exhausted:
+                # Block for the first contact, then take whatever else is ready
+                contacts_batch = []
+                contact = work_queue.get()
+                while contact is not None:
+                    contacts_batch.append(contact)
+                    if len(contacts_batch) >= group_recipients:
+                        break
+                    try:
+                        contact = work_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                exhausted = contact is None
+                if not contacts_batch:
+                    break
+                
+                # Retries come back one by one and regroup with whatever shares their payload
+                groups = {}
+                for item in contacts_batch:
+                    contact, attempt, payload = unpack(item)
+                    try:
+                        if payload is None:
+                            payload = prepare(contact)
+                        groups.setdefault(payload, []).append((contact, attempt))
+                    except Exception as e:
+                        record_error(contact[0], e)
+                
+                requeued = 0
+                for payload, recipients in groups.items():
+                    rate_limit(limiter, len(recipients))
+                    try:
+                        refused = send_limited(
+                            pool.send_group, username, [contact[1] for contact, _ in recipients], payload,
+                            messages=len(recipients),
+                            errors_of=lambda refused: [smtplib.SMTPRecipientsRefused({email: reply})
+                                                       for email, reply in refused.items()])
+                        errors = {email: smtplib.SMTPRecipientsRefused({email: reply})
+                                  for email, reply in refused.items()}
+                    except Exception as e:
+                        errors = {contact[1]: e for contact, _ in recipients}
+                    
+                    backed_off = False
+                    for contact, attempt in recipients:
+                        row, email = contact[0], contact[1]
+                        if email not in errors:
+                            record_sent(row, email, attempt + 1, wait=False, transport='smtp_grouped')
+                            continue
+                        # One back-off per transaction, not one per recipient
+                        if record_failure(row, email, attempt, errors[email], backoff=not backed_off,
+                                          transport='smtp_grouped'):
+                            retry_later(RetryItem(contact, attempt + 1, payload), errors[email])
+                            requeued += 1
+                        backed_off = True
+                # One commit for all the transactions before taking more work
+                job_store.flush()
+                contact_done(len(contacts_batch) - requeued)
+            
+            finish_worker()
+
+        contacts = track(itertools.chain([first_contact], contacts))
+        if render_processes:
+            pipeline = RenderPipeline(
+                renderer, (data_folder, RESERVED_FILES, attachment_cache.max_bytes,
+                           [attachment.filename for attachment in attachments]),
+                render_processes, stats, latency=stage_latency)
+            contacts = pipeline.render(contacts)
+
+        if engine == 'async':
+            if use_gmail_oauth:
+                transport = async_engine.AsyncGmailSender(gmail_client, concurrency=max_connections)
+
+                def start_send(email, payload):
+                    return transport.send_raw(payload)
+            else:
+                transport = pool
+
+                def start_send(email, payload):
+                    return transport.sendmail(username, [email], payload)
+
+            async def send(email, payload):
+                if concurrency:
+                    await concurrency.acquire_async()
+                try:
+                    await sender_slots.acquire_async(campaign_id)
+                except BaseException:
+                    if concurrency:
+                        concurrency.cancel()
+                    raise
+                # Same transmit timing and in-flight count as the threaded transmit(),
+                # the adaptive limit measures the same span
+                in_flight_sends.start()
+                started = time.perf_counter()
+                error = None
+                try:
+                    await start_send(email, payload)
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    stage_latency.since('transmit', started)
+                    in_flight_sends.finish()
+                    sender_slots.release(campaign_id)
+                    if concurrency:
+                        concurrency.release(started, (error,))
+
+            async def run_async():
+                loop = asyncio.get_running_loop()
+                try:
+                    await async_engine.run_campaign(
+                        contacts, send, prepare, limiter,
+                        async_engine.GroupCommit(job_store.flush),
+                        concurrency=max_connections, work_queue=work_queue.queue,
+                        on_sent=record_sent, on_failure=record_failure, on_retry=retry_later,
+                        on_error=record_error, on_contact_done=contact_done, on_contacts_read=contacts_done,
+                        prepare_in_executor=not render_processes)
+                except Exception:
+                    # Left for /resume-campaign, like a campaign cut short by a restart
+                    await loop.run_in_executor(None, job_store.set_campaign_status, campaign_id, 'interrupted')
+                    raise
+                finally:
+                    await transport.close()
+                # Marking the campaign completed waits for a commit, keep it off the loop
+                await loop.run_in_executor(None, complete_campaign)
+
+            def async_done(future):
+                if future.exception() is not None:
+                    logger.error(f"Async campaign {campaign_id} failed: {future.exception()}")
+                    metrics.record_error(str(future.exception()), future.exception())
+                    metrics.is_running = False
+                    sender_slots.unregister(campaign_id)
+
+            sender_slots.register(campaign_id, weight, max_connections)
+            scheduler.start()
+            async_engine.event_loop_thread().submit(run_async()).add_done_callback(async_done)
+        else:
+            # Start the producer, then the worker threads; the retry scheduler
+            # puts the sentinels once retried contacts are done too
+            sender_slots.register(campaign_id, weight, max_connections)
+            scheduler.start()
+            feeder = ContactFeeder(contacts, work_queue, 0, on_done=contacts_done)
+            feeder.start()
+
+            threads = []
+            for _ in range(max_connections):
+                if gmail_batch_size > 1:
+                    target = batch_worker
+                elif group_recipients > 1:
+                    target = group_worker
+                else:
+                    target = worker
+                thread = threading.Thread(target=target)
+                thread.daemon = True  # Make thread daemon so it exits when main thread exits
+                thread.start()
+                threads.append(thread)
+
+        logger.info(f"Email campaign {campaign_id} started ({engine} engine, weight {weight:g}, "
+                    f"{len(campaigns.running())} campaigns running)")
+        return jsonify({"message": "Email campaign started!", "campaignId": campaign_id})
     except Exception as e:
         logger.error(f"Error starting campaign: {str(e)}")
-        campaign_status['is_running'] = False
+        # Only a campaign that got as far as launching has metrics to close
+        if metrics is not None:
+            metrics.is_running = False
+            sender_slots.unregister(metrics.campaign_id)
+        if stored_id is not None:
+            # Offered again by /resume-campaign instead of staying 'running'
+            job_store.set_campaign_status(stored_id, 'interrupted')
         return jsonify({"error": str(e)}), 400
 
 if __name__ == '__main__':
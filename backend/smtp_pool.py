@@ -0,0 +1,228 @@
+import smtplib
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _reset(server):
+    # Like smtplib's private _rset: a dropped connection must not mask the original error
+    try:
+        server.rset()
+    except smtplib.SMTPServerDisconnected:
+        pass
+
+
+def pipelined_sendmail(server, from_addr, to_addrs, data):
+    """smtplib's sendmail for many recipients, with MAIL and every RCPT sent in one write
+
+    Falls back to plain sendmail when the server does not advertise
+    PIPELINING (RFC 2920). Returns the refused recipients as
+    {address: (code, reply)}, and raises like sendmail otherwise, except
+    that a transaction with every recipient refused returns them all.
+    """
+    server.ehlo_or_helo_if_needed()
+    if not server.has_extn('pipelining'):
+        try:
+            return server.sendmail(from_addr, to_addrs, data)
+        except smtplib.SMTPRecipientsRefused as e:
+            return e.recipients
+
+    options = f" SIZE={len(data)}" if server.has_extn('size') else ''
+    commands = [f"MAIL FROM:{smtplib.quoteaddr(from_addr)}{options}\r\n"]
+    commands += [f"RCPT TO:{smtplib.quoteaddr(address)}\r\n" for address in to_addrs]
+    server.send(''.join(commands))
+
+    # Replies come back in command order, all of them must be read
+    mail_code, mail_reply = server.getreply()
+    refused = {}
+    for address in to_addrs:
+        code, reply = server.getreply()
+        if code not in (250, 251):
+            refused[address] = (code, reply)
+    if mail_code != 250:
+        if mail_code == 421:
+            server.close()
+        else:
+            _reset(server)
+        raise smtplib.SMTPSenderRefused(mail_code, mail_reply, from_addr)
+    if len(refused) == len(to_addrs):
+        _reset(server)
+        return refused
+
+    code, reply = server.data(data)
+    if code != 250:
+        if code == 421:
+            server.close()
+        else:
+            _reset(server)
+        raise smtplib.SMTPDataError(code, reply)
+    return refused
+
+
+class _Session:
+    """An authenticated SMTP connection and its usage since it was opened"""
+
+    def __init__(self, server):
+        self.server = server
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+
+class SMTPConnectionPool:
+    """Keep one authenticated SMTP session per worker thread and reuse it across messages"""
+
+    def __init__(self, host, port, username, password, use_ssl=False,
+                 max_messages=100, max_idle=30.0, timeout=60, use_starttls=True, latency=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        # Only disable STARTTLS for relays on a trusted network, e.g. localhost
+        self.use_starttls = use_starttls
+        # Recycle a session after this many messages or this many idle seconds
+        self.max_messages = max_messages
+        self.max_idle = max_idle
+        self.timeout = timeout
+        # Optional LatencyHistogram for the connect, tls and auth stages
+        self.latency = latency
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sessions = set()
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'reconnects': 0,
+            'recycled': 0,
+            'transactions': 0,
+            'recipients': 0
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _timed(self, stage, started):
+        if self.latency is None:
+            return time.perf_counter()
+        return self.latency.since(stage, started)
+
+    def _connect(self):
+        started = time.perf_counter()
+        if self.use_ssl:
+            # The implicit TLS handshake is part of connect here
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+            started = self._timed('connect', started)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            started = self._timed('connect', started)
+            if self.use_starttls:
+                server.starttls()
+                started = self._timed('tls', started)
+        server.login(self.username, self.password)
+        self._timed('auth', started)
+        return server
+
+    def _close(self, session):
+        with self._lock:
+            self._sessions.discard(session)
+        try:
+            session.server.quit()
+        except Exception:
+            # The connection may already be gone, just drop the socket
+            try:
+                session.server.close()
+            except Exception:
+                pass
+
+    def _acquire(self):
+        """Return this thread's session, opening or recycling it when needed"""
+        session = getattr(self._local, 'session', None)
+        if session is not None:
+            idle = time.monotonic() - session.last_used
+            if session.sent >= self.max_messages or idle >= self.max_idle:
+                logger.debug(f"Recycling SMTP session after {session.sent} messages ({idle:.1f}s idle)")
+                self._count('recycled')
+                self._close(session)
+                session = None
+            else:
+                self._count('hits')
+                return session
+
+        self._count('misses')
+        session = _Session(self._connect())
+        self._local.session = session
+        with self._lock:
+            self._sessions.add(session)
+        return session
+
+    def _discard(self):
+        session = getattr(self._local, 'session', None)
+        if session is not None:
+            self._local.session = None
+            self._close(session)
+
+    def _send(self, send):
+        """Run send(server) on the pooled session, reconnecting once if the server dropped us"""
+        session = self._acquire()
+        try:
+            send(session.server)
+        except smtplib.SMTPServerDisconnected:
+            logger.warning(f"SMTP session to {self.host} disconnected, reconnecting")
+            self._count('reconnects')
+            self._discard()
+            session = self._acquire()
+            send(session.server)
+        except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+            # The server answered, so the session is still usable for the next message
+            session.last_used = time.monotonic()
+            raise
+        except Exception:
+            # Unknown state (socket error, timeout...), never reuse this session
+            self._discard()
+            raise
+        session.sent += 1
+        session.last_used = time.monotonic()
+
+    def send_message(self, msg):
+        self._send(lambda server: server.send_message(msg))
+
+    def sendmail(self, from_addr, to_addrs, data):
+        """Send an already serialized message (CRLF line endings)"""
+        self._send(lambda server: server.sendmail(from_addr, to_addrs, data))
+
+    def send_group(self, from_addr, to_addrs, data):
+        """Deliver one message to several recipients in a single transaction
+
+        Returns {address: (code, reply)} for the recipients the server refused.
+        """
+        refused = {}
+
+        def send(server):
+            refused.clear()
+            refused.update(pipelined_sendmail(server, from_addr, to_addrs, data))
+
+        self._send(send)
+        with self._lock:
+            self.counters['transactions'] += 1
+            self.counters['recipients'] += len(to_addrs)
+        return refused
+
+    def release(self):
+        """Close the calling thread's session, used when a worker exits"""
+        self._discard()
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            self._close(session)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['open_sessions'] = len(self._sessions)
+        return stats
@@ -0,0 +1,182 @@
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+from rate_limiter import http_status, gmail_error_message
+
+logger = logging.getLogger(__name__)
+
+# Why an address is suppressed
+UNSUBSCRIBED = 'unsubscribed'
+BOUNCED = 'bounced'
+IMPORTED = 'imported'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS suppressions (
+    email TEXT PRIMARY KEY,
+    reason TEXT NOT NULL,
+    source TEXT,
+    created_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+INSERT = "INSERT OR IGNORE INTO suppressions (email, reason, source, created_at) VALUES (?, ?, ?, ?)"
+
+# Rows per transaction for bulk imports and per fetch for exports and loading
+BATCH_SIZE = 10000
+
+# Gmail API 400 messages about the recipient's address rather than the message
+GMAIL_RECIPIENT_ERRORS = ('invalid to header', 'recipient address')
+
+
+def normalize(email):
+    return email.strip().lower()
+
+
+def _key(email):
+    # 8 bytes of hash per address instead of the string, about half the memory; a lookup
+    # only matches the wrong address on a 64-bit hash collision
+    return int.from_bytes(hashlib.blake2b(email.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def is_bounce(error):
+    """True for a permanent refusal of the recipient itself: an SMTP 5xx reply to
+    RCPT TO (550 unknown user) or a Gmail API 400 rejecting the To address
+
+    Replies to the message or the session (554 spam, 535 auth, a Gmail 400 about
+    the message) are not about the address and do not count. Mailbox bounces
+    after a Gmail API send arrive by mail and are not seen here.
+    """
+    if http_status(error) == 400:
+        message = gmail_error_message(error).lower()
+        return any(text in message for text in GMAIL_RECIPIENT_ERRORS)
+    recipients = getattr(error, 'recipients', None)
+    if isinstance(recipients, dict):
+        codes = [reply[0] for reply in recipients.values()]
+    elif recipients is not None:
+        codes = [getattr(recipient, 'code', None) for recipient in recipients]
+    elif hasattr(error, 'recipient'):
+        # aiosmtplib's SMTPRecipientRefused, for a single recipient
+        codes = [getattr(error, 'code', None)]
+    else:
+        return False
+    return bool(codes) and all(isinstance(code, int) and 500 <= code < 600 for code in codes)
+
+
+class SuppressionList:
+    """Addresses never to mail again, in SQLite with an in-memory hash index
+
+    load() reads the table once into a set of address hashes, so checking a
+    recipient is one set lookup whatever the size of the list; writes go to
+    both. Addresses are compared lowercased.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._db_lock = threading.Lock()
+        self._keys = None
+
+    def load(self):
+        """Build the index unless it is loaded already, it is kept in sync afterwards"""
+        with self._db_lock:
+            if self._keys is not None:
+                return
+            started = time.perf_counter()
+            keys = set()
+            cursor = self._conn.execute("SELECT email FROM suppressions")
+            while True:
+                rows = cursor.fetchmany(BATCH_SIZE)
+                if not rows:
+                    break
+                keys.update(_key(email) for email, in rows)
+            self._keys = keys
+        logger.info(f"Suppression list loaded: {len(keys)} addresses in {time.perf_counter() - started:.2f}s")
+
+    def __contains__(self, email):
+        if self._keys is None:
+            self.load()
+        return _key(normalize(email)) in self._keys
+
+    def __len__(self):
+        if self._keys is None:
+            self.load()
+        return len(self._keys)
+
+    def add(self, email, reason, source=None):
+        """Suppress one address, returns False when it already was"""
+        return self.add_many([email], reason, source) == 1
+
+    def add_many(self, emails, reason, source=None):
+        """Suppress addresses from any iterable in batched transactions, returns how many were new"""
+        self.load()
+        added = 0
+        batch = []
+        for email in emails:
+            email = normalize(email)
+            if email:
+                batch.append(email)
+            if len(batch) >= BATCH_SIZE:
+                added += self._insert(batch, reason, source)
+                batch = []
+        if batch:
+            added += self._insert(batch, reason, source)
+        return added
+
+    def _write(self, sql, params):
+        """executemany in one transaction, under the lock; returns the rows changed"""
+        self._conn.execute('BEGIN')
+        try:
+            before = self._conn.total_changes
+            self._conn.executemany(sql, params)
+            changed = self._conn.total_changes - before
+            self._conn.execute('COMMIT')
+        except Exception:
+            self._conn.execute('ROLLBACK')
+            raise
+        return changed
+
+    def _insert(self, emails, reason, source):
+        now = time.time()
+        with self._db_lock:
+            added = self._write(INSERT, [(email, reason, source, now) for email in emails])
+            self._keys.update(_key(email) for email in emails)
+        return added
+
+    def remove_many(self, emails):
+        """Lift the suppression of addresses, returns how many were suppressed"""
+        self.load()
+        emails = [normalize(email) for email in emails if email.strip()]
+        with self._db_lock:
+            removed = self._write("DELETE FROM suppressions WHERE email = ?", [(email,) for email in emails])
+            self._keys.difference_update(_key(email) for email in emails)
+        return removed
+
+    def clear(self):
+        with self._db_lock:
+            self._conn.execute("DELETE FROM suppressions")
+            self._keys = set()
+
+    def counts(self):
+        """Suppressed addresses per reason"""
+        with self._db_lock:
+            rows = self._conn.execute("SELECT reason, COUNT(*) FROM suppressions GROUP BY reason").fetchall()
+        return dict(rows)
+
+    def export(self):
+        """Yield (email, reason, source, created_at) rows in batches, for streaming responses"""
+        last = ''
+        while True:
+            # Keyset pagination, the lock is only held for one batch at a time
+            with self._db_lock:
+                rows = self._conn.execute(
+                    "SELECT email, reason, source, created_at FROM suppressions WHERE email > ? "
+                    "ORDER BY email LIMIT ?", (last, BATCH_SIZE)).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last = rows[-1][0]
@@ -0,0 +1,76 @@
+import re
+
+# Placeholders look like [NAME] or [COMPANY], matched case-insensitively against CSV columns
+PLACEHOLDER_RE = re.compile(r'\[([A-Za-z][A-Za-z0-9_ ]*)\]')
+
+# Placeholders that are always available, whatever the CSV header says
+BUILTIN_FIELDS = {'EMAIL', 'NAME', 'LANGUAGE'}
+
+
+def normalize_field(name):
+    """Turn a CSV column name into its placeholder key: 'First name' -> 'FIRST_NAME'"""
+    return name.strip().upper().replace(' ', '_')
+
+
+class CompiledTemplate:
+    """A template parsed once into literal segments and placeholder slots"""
+
+    def __init__(self, text):
+        self.text = text
+        self._segments = []
+        self._slots = []
+        position = 0
+        for match in PLACEHOLDER_RE.finditer(text):
+            self._segments.append(text[position:match.start()])
+            # Unknown placeholders render as their original text
+            self._slots.append((len(self._segments), normalize_field(match.group(1)), match.group(0)))
+            self._segments.append(match.group(0))
+            position = match.end()
+        self._segments.append(text[position:])
+        self.placeholders = {key for _, key, _ in self._slots}
+
+    def render(self, fields):
+        """Fill the placeholder slots from fields and join, a single pass over the segments"""
+        if not self._slots:
+            return self.text
+        out = self._segments.copy()
+        for index, key, raw in self._slots:
+            out[index] = fields.get(key, raw)
+        return ''.join(out)
+
+
+class TemplateSet:
+    """Compiled templates per language with the fallback resolved up front"""
+
+    def __init__(self, templates):
+        self.templates = {}
+        self.fallback = None
+        for language, text in templates.items():
+            if not text:
+                continue
+            compiled = CompiledTemplate(text)
+            self.templates[language] = compiled
+            # Missing languages use the first non-empty template
+            if self.fallback is None:
+                self.fallback = compiled
+        self.placeholders = set()
+        for compiled in self.templates.values():
+            self.placeholders |= compiled.placeholders
+
+    def __bool__(self):
+        return self.fallback is not None
+
+    def for_language(self, language):
+        template = self.templates.get(language, self.fallback)
+        if template is None:
+            raise ValueError(f"No template found for language {language}")
+        return template
+
+    def needs_columns(self):
+        """True when some template uses CSV columns beyond the built-in fields"""
+        return bool(self.placeholders - BUILTIN_FIELDS)
+
+
+def row_fields(columns, row):
+    """Map normalized CSV column names to the values of one row"""
+    return {column: value for column, value in zip(columns, row)}
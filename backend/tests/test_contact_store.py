@@ -0,0 +1,123 @@
+import pytest
+
+from contact_store import ContactStore
+
+
+def process_contact(row):
+    # email, name, language, like server.process_contact for three columns
+    row = row + [''] * (3 - len(row))
+    return row[0], row[1], row[2] or 'EN'
+
+
+@pytest.fixture
+def paths(tmp_path):
+    csv_path = tmp_path / 'contacts.csv'
+    csv_path.write_text('email,name,language\n'
+                        'a@example.com,Ann,EN\n'
+                        'b@example.com,Bob,FR\n'
+                        'c@example.com,Cid,EN\n', encoding='utf-8')
+    return str(csv_path), str(tmp_path / '.contacts.store'), str(tmp_path / '.contacts.log')
+
+
+def open_store(paths):
+    return ContactStore(*paths, process_contact, compact_interval=3600)
+
+
+def contacts(store):
+    return [record[:4] for record in store.view().iter_contacts()]
+
+
+EDITS = [
+    {'op': 'update', 'row': 0, 'name': 'Anna'},
+    {'op': 'delete', 'row': 1},
+    {'op': 'add', 'email': 'd@example.com', 'name': 'Dee', 'language': 'FR'},
+]
+EDITED = [
+    (0, 'a@example.com', 'Anna', 'EN'),
+    (2, 'c@example.com', 'Cid', 'EN'),
+    (3, 'd@example.com', 'Dee', 'FR'),
+]
+
+
+def test_patch_applies_in_place(paths):
+    store = open_store(paths)
+    before = store.view()
+    assert store.patch(EDITS) == [0, 1, 3]
+    assert contacts(store) == EDITED
+    assert store.view().language_counts() == {'EN': 2, 'FR': 1}
+    # A view taken earlier keeps the contacts it had
+    assert len(before) == 3 and before.record(1) == ('b@example.com', 'Bob', 'FR')
+
+
+def test_invalid_patch_changes_nothing(paths):
+    store = open_store(paths)
+    with pytest.raises(ValueError, match='Operation 1'):
+        store.patch([{'op': 'update', 'row': 0, 'name': 'Anna'}, {'op': 'delete', 'row': 9}])
+    with pytest.raises(ValueError, match='invalid email'):
+        store.patch([{'op': 'add', 'email': 'nope'}])
+    assert contacts(store)[0] == (0, 'a@example.com', 'Ann', 'EN')
+
+
+def test_log_is_replayed_after_restart(paths):
+    open_store(paths).patch(EDITS)
+    assert contacts(open_store(paths)) == EDITED
+
+
+def test_torn_log_line_is_dropped(paths):
+    open_store(paths).patch(EDITS)
+    with open(paths[2], 'ab') as f:
+        f.write(b'{"op": "add", "email": "e@exa')
+    assert contacts(open_store(paths)) == EDITED
+
+
+def test_compaction_round_trip(paths):
+    store = open_store(paths)
+    store.patch(EDITS)
+    assert store.compact()
+    assert not store.compact()
+    assert contacts(store) == EDITED
+    # Edits after the compaction go to the new log
+    store.patch([{'op': 'update', 'row': 3, 'language': 'EN'}])
+    expected = EDITED[:2] + [(3, 'd@example.com', 'Dee', 'EN')]
+    assert contacts(store) == expected
+    assert contacts(open_store(paths)) == expected
+
+
+def test_crash_between_store_and_log_replacement(paths):
+    store = open_store(paths)
+    store.patch(EDITS)
+    with open(paths[2], 'rb') as f:
+        old_log = f.read()
+    store.compact()
+    store.patch([{'op': 'delete', 'row': 0}])
+    with open(paths[2], 'rb') as f:
+        new_entries = f.read().split(b'\n', 1)[1]
+    # The old log with the later edit appended, as if the log was never replaced
+    with open(paths[2], 'wb') as f:
+        f.write(old_log + new_entries)
+    assert contacts(open_store(paths)) == EDITED[1:]
+
+
+def test_changed_csv_without_edits_is_imported(paths):
+    store = open_store(paths)
+    assert len(store.view()) == 3
+    with open(paths[0], 'a', encoding='utf-8') as f:
+        f.write('e@example.com,Eve,EN\n')
+    assert len(store.view()) == 4
+
+
+def test_changed_csv_keeps_edits(paths):
+    store = open_store(paths)
+    store.patch(EDITS)
+    store.compact()
+    with open(paths[0], 'a', encoding='utf-8') as f:
+        f.write('e@example.com,Eve,EN\n')
+    assert contacts(store) == EDITED
+    assert contacts(open_store(paths)) == EDITED
+
+
+def test_rebuild_drops_edits(paths):
+    store = open_store(paths)
+    store.patch(EDITS)
+    assert len(store.rebuild()) == 3
+    assert contacts(open_store(paths))[0] == (0, 'a@example.com', 'Ann', 'EN')
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+
+from fair_share import FairShare
+
+
+def run_senders(slots, key, workers, stop, transmit=0.002, idle=0.001):
+    """Threads that take a slot, transmit, release and do some work between sends"""
+    def worker():
+        while not stop.is_set():
+            slots.acquire(key)
+            time.sleep(transmit)
+            slots.release(key)
+            time.sleep(idle)
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def test_shares_follow_weights():
+    slots = FairShare(8)
+    slots.register('heavy', 3, 8)
+    slots.register('light', 1, 8)
+    stop = threading.Event()
+    threads = run_senders(slots, 'heavy', 8, stop) + run_senders(slots, 'light', 8, stop)
+    time.sleep(1.0)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    granted = {key: share['granted'] for key, share in slots.stats()['campaigns'].items()}
+    assert 2.5 < granted['heavy'] / granted['light'] < 3.5, granted
+
+
+def test_competing_campaign_is_capped_at_its_share():
+    slots = FairShare(4)
+    slots.register('a', 1, 4)
+    slots.register('b', 1, 4)
+    slots.acquire('b')
+    slots.acquire('a')
+    slots.acquire('a')
+    # a holds its half, the free slot stays for b
+    taken = threading.Event()
+    waiter = threading.Thread(target=lambda: (slots.acquire('a'), taken.set()), daemon=True)
+    waiter.start()
+    assert not taken.wait(0.1)
+    slots.acquire('b')
+    slots.release('a')
+    assert taken.wait(1.0)
+    assert slots.stats()['in_flight'] == 4
+
+
+def test_campaign_alone_gets_every_slot():
+    slots = FairShare(4)
+    slots.register('a', 1, 4)
+    slots.register('idle', 3, 4)
+    for _ in range(4):
+        slots.acquire('a')
+    assert slots.stats()['campaigns']['a']['in_flight'] == 4
+
+
+def test_capacity_follows_largest_ceiling():
+    slots = FairShare()
+    slots.register('a', 1, 2)
+    slots.register('b', 1, 5)
+    assert slots.stats()['capacity'] == 5
+    slots.unregister('b')
+    assert slots.stats()['capacity'] == 2
+
+
+def test_async_waiter_gets_released_slot():
+    slots = FairShare(1)
+    slots.register('a', 1, 1)
+
+    async def main():
+        await slots.acquire_async('a')
+        second = asyncio.ensure_future(slots.acquire_async('a'))
+        await asyncio.sleep(0.01)
+        assert not second.done()
+        slots.release('a')
+        await asyncio.wait_for(second, 1.0)
+
+    asyncio.run(main())
+    assert slots.stats()['in_flight'] == 1
+
+
+def test_cancelled_async_waiter_gives_slot_back():
+    slots = FairShare(1)
+    slots.register('a', 1, 1)
+
+    async def main():
+        await slots.acquire_async('a')
+        second = asyncio.ensure_future(slots.acquire_async('a'))
+        await asyncio.sleep(0.01)
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        slots.release('a')
+
+    asyncio.run(main())
+    assert slots.stats()['in_flight'] == 0
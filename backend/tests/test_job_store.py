@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+from job_store import FAILED, PENDING, RETRYING, SENT, JobStore
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / '.campaigns.db')
+
+
+def test_waiting_writers_share_commits(db_path):
+    store = JobStore(db_path, flush_interval=0.05)
+    commits = []
+    apply = store._apply
+
+    def counting_apply(ops):
+        commits.append(len(ops))
+        apply(ops)
+
+    store._apply = counting_apply
+    store.create_campaign('c1', {}, (0, 0))
+    for row in range(400):
+        store.add_pending('c1', row, f'user{row}@example.com')
+
+    def worker(rows):
+        for row in rows:
+            store.set_state('c1', row, SENT, 1, wait=True)
+
+    threads = [threading.Thread(target=worker, args=(range(start, 400, 20),)) for start in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Every write was committed before set_state returned, in far fewer transactions
+    assert store.state_counts('c1') == {SENT: 400}
+    assert sum(commits) == 800
+    assert len(commits) < 400
+    store.close()
+
+
+def test_state_survives_reopen(db_path):
+    store = JobStore(db_path)
+    store.create_campaign('c1', {'subject': 'Hi'}, (123, 456))
+    for row, state in enumerate([SENT, FAILED, RETRYING, PENDING]):
+        store.add_pending('c1', row, f'user{row}@example.com')
+        if state != PENDING:
+            store.set_state('c1', row, state, 1)
+    store.close()
+
+    store = JobStore(db_path)
+    assert store.mark_interrupted() == 1
+    campaign = store.get_campaign()
+    assert campaign['id'] == 'c1' and campaign['status'] == 'interrupted'
+    assert campaign['config'] == {'subject': 'Hi'}
+    assert campaign['contacts_fingerprint'] == (123, 456)
+    assert store.done_rows('c1') == {0, 1}
+    store.set_campaign_status('c1', 'completed')
+    assert store.get_campaign() is None
+    store.close()
+
+
+def test_send_counts_drop_old_minutes(db_path):
+    store = JobStore(db_path)
+    for minute in (10, 10, 11, 500):
+        store.record_send('smtp.example.com/user', minute)
+    store.record_send('gmail_api/other@example.com', 500)
+    assert store.send_counts('smtp.example.com/user', 0) == {10: 2, 11: 1, 500: 1}
+    assert store.send_counts('smtp.example.com/user', 11) == {11: 1, 500: 1}
+    assert store.send_counts('smtp.example.com/user', 0) == {11: 1, 500: 1}
+    store.close()
@@ -0,0 +1,52 @@
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import pytest
+
+from mime_skeleton import MessageSkeleton, flatten
+
+BODIES = [
+    '',
+    'plain ascii',
+    'trailing newline\n',
+    'From the start\nand From the middle\nFrom again',
+    'mixed\r\nline\rbreaks\n',
+    'unicode é ü 日本',
+    'x' * 2000,
+]
+
+
+def attachment(data, filename):
+    part = MIMEApplication(data)
+    part.add_header('Content-Disposition', 'attachment', filename=filename)
+    return part
+
+
+def mime_message(skeleton, to_addr, body, from_addr, attachments):
+    msg = MIMEMultipart(boundary=skeleton.boundary)
+    if from_addr:
+        msg['From'] = from_addr
+    msg['To'] = to_addr
+    msg['Subject'] = 'Campaign subject'
+    msg.attach(MIMEText(body, 'plain'))
+    for part in attachments:
+        msg.attach(part)
+    return flatten(msg)
+
+
+@pytest.mark.parametrize('from_addr', [None, 'sender@example.com'])
+@pytest.mark.parametrize('attachments', [[], [attachment(bytes(range(256)) * 40, 'data.bin')]])
+@pytest.mark.parametrize('body', BODIES)
+def test_fill_matches_email_mime(body, attachments, from_addr):
+    skeleton = MessageSkeleton('Campaign subject', from_addr, attachments)
+    for to_addr in ('user@example.com', 'first.last+tag@sub.example.org'):
+        assert skeleton.fill(to_addr, body) == mime_message(skeleton, to_addr, body, from_addr, attachments)
+
+
+def test_fill_declines_what_it_cannot_splice():
+    skeleton = MessageSkeleton('Campaign subject', 'sender@example.com')
+    assert skeleton.fill('usér@example.com', 'hi') is None
+    assert skeleton.fill('a' * 70 + '@example.com', 'hi') is None
+    assert skeleton.fill('user@example.com\r\nBcc: x@example.com', 'hi') is None
+    assert skeleton.fill('user@example.com', f'--{skeleton.boundary}') is None
@@ -0,0 +1,51 @@
+from job_store import JobStore
+from rate_limiter import AccountLimiters, RateLimiter
+
+LIMITS = {'per_second': None, 'per_minute': None, 'per_day': 3}
+
+
+def registry(db_path):
+    store = JobStore(db_path)
+    return store, AccountLimiters(store.send_counts, store.record_send)
+
+
+def test_campaigns_of_an_account_share_its_limiter(tmp_path):
+    store, limiters = registry(str(tmp_path / '.campaigns.db'))
+    first = limiters.get('smtp.example.com/user', LIMITS)
+    second = limiters.get('smtp.example.com/user', dict(LIMITS, per_second=5))
+    other = limiters.get('smtp.example.com/other', LIMITS)
+    assert first is second and first is not other
+    # The last campaign started sets the limits
+    assert first.limits() == {'per_second': 5, 'per_minute': None, 'per_day': 3}
+    for _ in range(3):
+        assert second.try_acquire() == 0
+    assert first.try_acquire() > 0
+    assert other.try_acquire() == 0
+    store.close()
+
+
+def test_daily_count_survives_restart(tmp_path):
+    db_path = str(tmp_path / '.campaigns.db')
+    store, limiters = registry(db_path)
+    limiter = limiters.get('gmail_api/user@example.com', LIMITS)
+    limiter.try_acquire()
+    limiter.try_acquire()
+    store.close()
+
+    store, limiters = registry(db_path)
+    limiter = limiters.get('gmail_api/user@example.com', LIMITS)
+    assert limiter.stats()['sent_today'] == 2
+    assert limiter.try_acquire() == 0
+    assert limiter.try_acquire() > 0
+    store.close()
+
+
+def test_configure_keeps_spent_tokens():
+    limiter = RateLimiter(per_second=2, per_minute=10)
+    assert limiter.try_acquire() == 0
+    assert limiter.try_acquire() == 0
+    limiter.configure(per_second=4, per_minute=10)
+    assert limiter.try_acquire() > 0
+    limiter.configure(per_second=None, per_minute=None)
+    assert limiter.try_acquire() == 0
+    assert limiter.limits() == {'per_second': None, 'per_minute': None, 'per_day': None}
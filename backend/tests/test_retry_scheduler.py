@@ -0,0 +1,100 @@
+import queue
+import threading
+
+from retry_scheduler import RetryItem, RetryScheduler, backoff_delay, unpack
+
+
+def run_campaign(contacts, send, retries, workers=2):
+    """Workers as in start_campaign: failures go to the scheduler until `retries` are used up
+
+    Returns the attempts made per contact and the final outcome of each.
+    """
+    work_queue = queue.Queue(maxsize=10)
+    scheduler = RetryScheduler(work_queue.put, workers, base_delay=0.01, max_delay=0.05)
+    attempts = {}
+    outcome = {}
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            item = work_queue.get()
+            if item is None:
+                break
+            contact, attempt, _ = unpack(item)
+            with lock:
+                attempts[contact] = attempts.get(contact, 0) + 1
+            try:
+                send(contact)
+            except Exception:
+                if attempt < retries:
+                    scheduler.schedule(RetryItem(contact, attempt + 1))
+                    continue
+                outcome[contact] = 'failed'
+            else:
+                outcome[contact] = 'sent'
+            scheduler.item_done()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    scheduler.start()
+    for contact in contacts:
+        work_queue.put(contact)
+    scheduler.source_done(len(contacts))
+    for thread in threads:
+        thread.join(5)
+        assert not thread.is_alive()
+    scheduler.join(5)
+    assert not scheduler.is_alive()
+    return attempts, outcome, scheduler
+
+
+def test_gives_up_after_retries():
+    def send(contact):
+        raise ConnectionError("always down")
+
+    attempts, outcome, scheduler = run_campaign(['a', 'b', 'c'], send, retries=3)
+    assert attempts == {'a': 4, 'b': 4, 'c': 4}
+    assert outcome == {'a': 'failed', 'b': 'failed', 'c': 'failed'}
+    assert scheduler.stats() == {'scheduled': 9, 'requeued': 9, 'pending': 0}
+
+
+def test_retried_send_succeeds():
+    failures = {'a': 2}
+
+    def send(contact):
+        if failures.get(contact):
+            failures[contact] -= 1
+            raise ConnectionError("try again")
+
+    attempts, outcome, _ = run_campaign(['a', 'b'], send, retries=3)
+    assert attempts == {'a': 3, 'b': 1}
+    assert outcome == {'a': 'sent', 'b': 'sent'}
+
+
+def test_no_retries():
+    def send(contact):
+        raise ConnectionError("down")
+
+    attempts, outcome, scheduler = run_campaign(['a'], send, retries=0)
+    assert attempts == {'a': 1}
+    assert scheduler.stats()['scheduled'] == 0
+
+
+def test_ends_with_empty_source():
+    attempts, outcome, _ = run_campaign([], lambda contact: None, retries=3)
+    assert attempts == {} and outcome == {}
+
+
+def test_backoff_delay_doubles_with_jitter():
+    for attempt in range(1, 8):
+        delay = min(300.0, 2.0 * 2 ** (attempt - 1))
+        for _ in range(20):
+            assert delay / 2 <= backoff_delay(attempt) <= delay
+
+
+def test_retry_after_wins_when_longer():
+    scheduler = RetryScheduler(lambda item: None, 1, base_delay=0.01)
+    assert scheduler.schedule(RetryItem('a', 1), retry_after=30) == 30
+    assert scheduler.schedule(RetryItem('b', 1), retry_after=0.001) <= 0.01
+    assert scheduler.pending() == 2
@@ -0,0 +1,88 @@
+import smtplib
+
+import pytest
+
+from smtp_pool import pipelined_sendmail
+
+
+class FakeServer:
+    """The smtplib.SMTP calls pipelined_sendmail makes, with scripted replies"""
+
+    def __init__(self, replies, extensions=('pipelining', 'size'), data_reply=(250, b'queued')):
+        self.replies = list(replies)
+        self.extensions = extensions
+        self.data_reply = data_reply
+        self.writes = []
+        self.calls = []
+
+    def ehlo_or_helo_if_needed(self):
+        pass
+
+    def has_extn(self, name):
+        return name in self.extensions
+
+    def send(self, text):
+        self.writes.append(text)
+
+    def getreply(self):
+        return self.replies.pop(0)
+
+    def data(self, data):
+        self.calls.append('data')
+        return self.data_reply
+
+    def rset(self):
+        self.calls.append('rset')
+
+    def close(self):
+        self.calls.append('close')
+
+    def sendmail(self, from_addr, to_addrs, data):
+        self.calls.append('sendmail')
+        return {}
+
+
+RECIPIENTS = ['a@example.com', 'b@example.com', 'c@example.com']
+
+
+def test_mail_and_every_rcpt_in_one_write():
+    server = FakeServer([(250, b'ok')] * 4)
+    assert pipelined_sendmail(server, 'from@example.com', RECIPIENTS, b'message') == {}
+    assert server.writes == ['MAIL FROM:<from@example.com> SIZE=7\r\n'
+                             'RCPT TO:<a@example.com>\r\nRCPT TO:<b@example.com>\r\nRCPT TO:<c@example.com>\r\n']
+    assert server.calls == ['data']
+    assert server.replies == []
+
+
+def test_refused_recipients_are_returned():
+    server = FakeServer([(250, b'ok'), (250, b'ok'), (550, b'no such user'), (452, b'slow down')])
+    refused = pipelined_sendmail(server, 'from@example.com', RECIPIENTS, b'message')
+    assert refused == {'b@example.com': (550, b'no such user'), 'c@example.com': (452, b'slow down')}
+    assert server.calls == ['data']
+
+
+def test_every_recipient_refused_skips_data():
+    server = FakeServer([(250, b'ok')] + [(550, b'no')] * 3)
+    refused = pipelined_sendmail(server, 'from@example.com', RECIPIENTS, b'message')
+    assert set(refused) == set(RECIPIENTS)
+    assert server.calls == ['rset']
+
+
+def test_sender_refused_reads_every_reply():
+    server = FakeServer([(553, b'bad sender')] + [(503, b'need MAIL')] * 3)
+    with pytest.raises(smtplib.SMTPSenderRefused):
+        pipelined_sendmail(server, 'from@example.com', RECIPIENTS, b'message')
+    assert server.replies == [] and server.calls == ['rset']
+
+
+def test_data_error_closes_on_421():
+    server = FakeServer([(250, b'ok')] * 4, data_reply=(421, b'closing'))
+    with pytest.raises(smtplib.SMTPDataError):
+        pipelined_sendmail(server, 'from@example.com', RECIPIENTS, b'message')
+    assert server.calls == ['data', 'close']
+
+
+def test_without_pipelining_falls_back_to_sendmail():
+    server = FakeServer([], extensions=())
+    assert pipelined_sendmail(server, 'from@example.com', RECIPIENTS, b'message') == {}
+    assert server.writes == [] and server.calls == ['sendmail']
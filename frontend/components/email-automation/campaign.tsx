@@ -39,28 +39,50 @@ export default function CampaignTab({
 }: CampaignTabProps) {
   const [isCompletionDialogOpen, setIsCompletionDialogOpen] = useState(false)
   
-  // Poll campaign status
+  // Follow campaign progress: Server-Sent Events, falling back to polling
   useEffect(() => {
-    let intervalId: NodeJS.Timeout
+    if (!campaignStatus.isRunning) {
+      return
+    }
+    
+    let intervalId: NodeJS.Timeout | undefined
+    let events: EventSource | undefined
+    let latest: CampaignStatus = campaignStatus
+    
+    const applyStatus = (data: Partial<CampaignStatus>) => {
+      latest = {
+        ...latest,
+        ...data,
+        status: (data.isRunning ?? latest.isRunning) ? "running" : "completed"
+      }
+      setCampaignStatus(latest)
+      
+      // Show completion dialog when campaign finishes
+      if (latest.completed && !isCompletionDialogOpen) {
+        setIsCompletionDialogOpen(true)
+      }
+    }
     
-    if (campaignStatus.isRunning) {
+    // Follow this tab's campaign even when others were started after it
+    const query = latest.campaignId ? `?campaign_id=${latest.campaignId}` : ""
+    
+    const startPolling = () => {
       intervalId = setInterval(async () => {
         try {
-          const response = await fetch(`${API_URL}/campaign-status`)
+          const response = await fetch(`${API_URL}/campaign-status${query}`)
           const data = await response.json()
           
-          setCampaignStatus({
+          applyStatus({
             isRunning: data.isRunning,
             remaining: data.remaining,
-            status: data.status,
-            completed: data.completed
+            completed: data.completed,
+            sent: data.sent,
+            failed: data.failed,
+            suppressed: data.suppressed,
+            errors: data.errors,
+            concurrency: data.concurrency ? data.concurrency.limit : null
           })
           
-          // Show completion dialog when campaign finishes
-          if (data.completed && !isCompletionDialogOpen) {
-            setIsCompletionDialogOpen(true)
-          }
-          
           if (!data.isRunning) {
             clearInterval(intervalId)
           }
@@ -70,7 +92,30 @@ export default function CampaignTab({
       }, 2000)
     }
     
+    if (typeof EventSource === "undefined") {
+      startPolling()
+    } else {
+      events = new EventSource(`${API_URL}/campaign-events${query}`)
+      // Each event only carries the fields that changed since the previous one
+      events.addEventListener("progress", (event) => {
+        const delta = JSON.parse((event as MessageEvent).data)
+        applyStatus(delta)
+        if (delta.isRunning === false) {
+          events?.close()
+        }
+      })
+      events.onerror = () => {
+        // Stream unavailable (old backend, proxy): poll /campaign-status instead
+        events?.close()
+        events = undefined
+        if (!intervalId) {
+          startPolling()
+        }
+      }
+    }
+    
     return () => {
+      events?.close()
       if (intervalId) {
         clearInterval(intervalId)
       }
@@ -119,11 +164,13 @@ export default function CampaignTab({
       })
 
       if (response.ok) {
+        const data = await response.json()
         setCampaignStatus({
           isRunning: true,
           remaining: 0,
           status: "running",
-          completed: false
+          completed: false,
+          campaignId: data.campaignId
         })
         
         // Start polling for status
@@ -232,14 +279,27 @@ export default function CampaignTab({
                 />
               </div>
             </div>
-            <div className="flex flex-col space-y-1.5">
-              <Label htmlFor="retries">Retries</Label>
-              <Input 
-                id="retries" 
-                type="number"
-                value={campaignSettings.retries}
-                onChange={(e) => setCampaignSettings({...campaignSettings, retries: Number(e.target.value)})}
-              />
+            <div className="grid grid-cols-2 gap-4">
+              <div className="flex flex-col space-y-1.5">
+                <Label htmlFor="retries">Retries</Label>
+                <Input 
+                  id="retries" 
+                  type="number"
+                  value={campaignSettings.retries}
+                  onChange={(e) => setCampaignSettings({...campaignSettings, retries: Number(e.target.value)})}
+                />
+              </div>
+              <div className="flex flex-col space-y-1.5">
+                <Label htmlFor="weight">Weight (share when campaigns run together)</Label>
+                <Input 
+                  id="weight" 
+                  type="number"
+                  min={0.1}
+                  step={0.5}
+                  value={campaignSettings.weight}
+                  onChange={(e) => setCampaignSettings({...campaignSettings, weight: Number(e.target.value)})}
+                />
+              </div>
             </div>
           </div>
         </CardContent>
@@ -252,7 +312,7 @@ export default function CampaignTab({
             {campaignStatus.isRunning ? (
               <>
                 <RefreshCw className="mr-2 h-4 w-4 animate-spin" />
-                Sending Emails ({campaignStatus.remaining} remaining)
+                Sending Emails ({campaignStatus.remaining} remaining{campaignStatus.rate ? `, ${campaignStatus.rate}/s` : ""}{campaignStatus.concurrency ? `, ${campaignStatus.concurrency} connections` : ""})
               </>
             ) : (
               <>
@@ -278,6 +338,11 @@ export default function CampaignTab({
           </DialogHeader>
           <div className="py-4">
             <p>All emails have been sent. You can now start a new campaign or make changes to your settings.</p>
+            {campaignStatus.suppressed ? (
+              <p className="mt-2 text-sm text-muted-foreground">
+                {campaignStatus.suppressed} recipients on the suppression list were skipped.
+              </p>
+            ) : null}
             {campaignStatus.errors && campaignStatus.errors.length > 0 && (
               <div className="mt-4 p-3 bg-red-50 border border-red-200 rounded-md">
                 <p className="font-medium text-red-800">There were some errors:</p>
@@ -1,13 +1,13 @@
 "use client"
 
-import { useState, useEffect } from "react"
+import { useState, useEffect, useRef } from "react"
 import { Card, CardHeader, CardTitle, CardDescription, CardContent, CardFooter } from "@/components/ui/card"
 import { Button } from "@/components/ui/button"
 import { Input } from "@/components/ui/input"
 import { Label } from "@/components/ui/label"
 import { Textarea } from "@/components/ui/textarea"
 import { Table, TableBody, TableCell, TableHead, TableHeader, TableRow } from "@/components/ui/table"
-import { CheckCircle, Upload, FileText, Plus, Trash, Save } from 'lucide-react'
+import { CheckCircle, Upload, FileText, Plus, Trash, Save, ChevronLeft, ChevronRight, Search } from 'lucide-react'
 import { toast } from "@/lib/utils"
 import { API_URL } from "@/lib/constants"
 
@@ -20,30 +20,54 @@ interface Contact {
   email: string
   name: string
   language: string
+  // Row of a saved contact, used to edit or delete it
+  row?: number
 }
 
+// Contacts shown per page, fetched from the server one page at a time
+const PAGE_SIZE = 10
+
 export default function ContactsTab({ setContactsUploaded, contactsUploaded }: ContactsTabProps) {
   const [contactsFile, setContactsFile] = useState<File | null>(null)
   const [totalContacts, setTotalContacts] = useState<number>(0)
+  // Current page of saved contacts, and contacts added here but not saved yet
   const [contacts, setContacts] = useState<Contact[]>([])
+  const [newContacts, setNewContacts] = useState<Contact[]>([])
   const [newEmail, setNewEmail] = useState("")
   const [manualInput, setManualInput] = useState("")
   const [isLoading, setIsLoading] = useState(false)
+  // Cursors of the pages visited so far, the last one is the current page
+  const [cursors, setCursors] = useState<(string | null)[]>([null])
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
+  const [search, setSearch] = useState("")
+  const [languageFilter, setLanguageFilter] = useState("")
+  const [matchTotal, setMatchTotal] = useState<number | null>(null)
+  // Saved values of the contacts on the page by row, to only send the edits that change something
+  const savedContacts = useRef<Map<number, Contact>>(new Map())
 
   // Load contacts on component mount
   useEffect(() => {
     fetchContacts()
   }, [])
 
-  const fetchContacts = async () => {
+  const fetchContacts = async (cursor: string | null = null, history: (string | null)[] = [null]) => {
     try {
-      const response = await fetch(`${API_URL}/get-contacts`)
+      const params = new URLSearchParams({ limit: String(PAGE_SIZE) })
+      if (cursor) params.set("cursor", cursor)
+      if (search.trim()) params.set("q", search.trim())
+      if (languageFilter.trim()) params.set("language", languageFilter.trim())
+
+      const response = await fetch(`${API_URL}/get-contacts?${params}`)
       if (response.ok) {
         const data = await response.json()
         setContacts(data.contacts || [])
-        if (data.contacts && data.contacts.length > 0) {
+        savedContacts.current = new Map((data.contacts || []).map((contact: Contact) => [contact.row, contact]))
+        setNextCursor(data.nextCursor || null)
+        setCursors(history)
+        setMatchTotal(data.total ?? null)
+        if (data.total && data.total > 0) {
           setContactsUploaded(true)
-          setTotalContacts(data.contacts.length)
+          setTotalContacts(data.total)
         }
       }
     } catch (error) {
@@ -51,6 +75,19 @@ export default function ContactsTab({ setContactsUploaded, contactsUploaded }: C
     }
   }
 
+  const handleNextPage = () => {
+    if (nextCursor) {
+      fetchContacts(nextCursor, [...cursors, nextCursor])
+    }
+  }
+
+  const handlePreviousPage = () => {
+    if (cursors.length > 1) {
+      const history = cursors.slice(0, -1)
+      fetchContacts(history[history.length - 1], history)
+    }
+  }
+
   // Handle contacts file upload
   const handleContactsUpload = async () => {
     if (!contactsFile) {
@@ -80,9 +117,18 @@ export default function ContactsTab({ setContactsUploaded, contactsUploaded }: C
         // Refresh contacts list
         await fetchContacts()
         
+        // Rows dropped during the upload, by reason
+        const rejected = data.rejected || {}
+        const skipped = [
+          rejected.invalid ? `${rejected.invalid} invalid` : "",
+          rejected.duplicate ? `${rejected.duplicate} duplicates` : "",
+          rejected.missing_email ? `${rejected.missing_email} without email` : "",
+        ].filter(Boolean)
+        
         toast({
           title: "Success",
-          description: `${data.total} contacts uploaded successfully`,
+          description: `${data.total} contacts uploaded successfully` +
+            (skipped.length ? ` (skipped ${skipped.join(", ")})` : ""),
         })
       } else {
         throw new Error("Failed to upload contacts")
@@ -114,41 +160,98 @@ export default function ContactsTab({ setContactsUploaded, contactsUploaded }: C
       language: "FR"
     }
 
-    setContacts([...contacts, newContact])
+    setNewContacts([...newContacts, newContact])
     setNewEmail("")
   }
 
   const handleRemoveContact = (index: number) => {
-    const updatedContacts = [...contacts]
+    const updatedContacts = [...newContacts]
     updatedContacts.splice(index, 1)
-    setContacts(updatedContacts)
+    setNewContacts(updatedContacts)
   }
 
   const handleUpdateContact = (index: number, field: keyof Contact, value: string) => {
-    const updatedContacts = [...contacts]
+    const updatedContacts = [...newContacts]
     updatedContacts[index][field] = value
-    setContacts(updatedContacts)
+    setNewContacts(updatedContacts)
+  }
+
+  // Send add, update and delete operations, the server only writes the changed rows
+  const patchContacts = async (ops: object[]) => {
+    const response = await fetch(`${API_URL}/patch-contacts`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({ ops }),
+    })
+    const data = await response.json()
+    if (!response.ok) {
+      throw new Error(data.error || "Failed to save contacts")
+    }
+    return data
+  }
+
+  const handleEditSavedContact = (index: number, field: keyof Contact, value: string) => {
+    setContacts(current => current.map((contact, i) => i === index ? { ...contact, [field]: value } : contact))
+  }
+
+  const handleCommitSavedContact = async (contact: Contact) => {
+    const saved = contact.row === undefined ? undefined : savedContacts.current.get(contact.row)
+    if (saved && saved.email === contact.email && saved.name === contact.name && saved.language === contact.language) {
+      return
+    }
+    try {
+      await patchContacts([{ op: "update", row: contact.row, email: contact.email, name: contact.name, language: contact.language }])
+      if (contact.row !== undefined) {
+        savedContacts.current.set(contact.row, contact)
+      }
+    } catch (error) {
+      toast({
+        title: "Error",
+        description: error instanceof Error ? error.message : "Failed to update contact",
+        variant: "destructive",
+      })
+      await fetchContacts(cursors[cursors.length - 1], cursors)
+    }
+  }
+
+  const handleDeleteSavedContact = async (contact: Contact) => {
+    try {
+      const data = await patchContacts([{ op: "delete", row: contact.row }])
+      setTotalContacts(data.total || 0)
+      await fetchContacts(cursors[cursors.length - 1], cursors)
+    } catch (error) {
+      toast({
+        title: "Error",
+        description: error instanceof Error ? error.message : "Failed to delete contact",
+        variant: "destructive",
+      })
+    }
   }
 
   const handleSaveContacts = async () => {
     setIsLoading(true)
     try {
+      // Only the new contacts are sent, the server adds them to the list or starts one
       const response = await fetch(`${API_URL}/save-contacts`, {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
         },
-        body: JSON.stringify({ contacts }),
+        body: JSON.stringify({ contacts: newContacts, append: true }),
       })
 
       if (response.ok) {
         const data = await response.json()
         setContactsUploaded(true)
         setTotalContacts(data.total || 0)
+        setNewContacts([])
+        await fetchContacts()
         
         toast({
           title: "Success",
-          description: `${data.total} contacts saved successfully`,
+          description: `${newContacts.length} contacts saved successfully`,
         })
       } else {
         throw new Error("Failed to save contacts")
@@ -179,12 +282,12 @@ export default function ContactsTab({ setContactsUploaded, contactsUploaded }: C
     }
 
     const lines = manualInput.split('\n')
-    const newContacts: Contact[] = []
+    const parsedContacts: Contact[] = []
     
     lines.forEach(line => {
       const email = line.trim()
       if (email && email.includes('@')) {
-        newContacts.push({
+        parsedContacts.push({
           email,
           name: "",
           language: "FR"
@@ -192,7 +295,7 @@ export default function ContactsTab({ setContactsUploaded, contactsUploaded }: C
       }
     })
 
-    if (newContacts.length === 0) {
+    if (parsedContacts.length === 0) {
       toast({
         title: "Error",
         description: "No valid email addresses found",
@@ -201,12 +304,12 @@ export default function ContactsTab({ setContactsUploaded, contactsUploaded }: C
       return
     }
 
-    setContacts([...contacts, ...newContacts])
+    setNewContacts(current => [...current, ...parsedContacts])
     setManualInput("")
     
     toast({
       title: "Success",
-      description: `${newContacts.length} contacts added`,
+      description: `${parsedContacts.length} contacts added`,
     })
   }
 
@@ -226,7 +329,7 @@ export default function ContactsTab({ setContactsUploaded, contactsUploaded }: C
               <Input 
                 id="contacts" 
                 type="file" 
-                accept=".csv,.txt" 
+                accept=".csv,.txt,.gz" 
                 onChange={(e) => {
                   if (e.target.files && e.target.files.length > 0) {
                     setContactsFile(e.target.files[0])
@@ -301,19 +404,19 @@ export default function ContactsTab({ setContactsUploaded, contactsUploaded }: C
             </div>
           </div>
           
-          {contacts.length > 0 && (
+          {newContacts.length > 0 && (
             <div className="border rounded-md overflow-hidden">
               <Table>
                 <TableHeader>
                   <TableRow>
-                    <TableHead>Email</TableHead>
+                    <TableHead>New Email</TableHead>
                     <TableHead>Name</TableHead>
                     <TableHead>Language</TableHead>
                     <TableHead className="w-[50px]"></TableHead>
                   </TableRow>
                 </TableHeader>
                 <TableBody>
-                  {contacts.slice(0, 10).map((contact, index) => (
+                  {newContacts.slice(0, PAGE_SIZE).map((contact, index) => (
                     <TableRow key={index}>
                       <TableCell>
                         <Input
@@ -351,24 +454,122 @@ export default function ContactsTab({ setContactsUploaded, contactsUploaded }: C
                   ))}
                 </TableBody>
               </Table>
-              {contacts.length > 10 && (
+              {newContacts.length > PAGE_SIZE && (
                 <div className="p-2 text-center text-sm text-gray-500">
-                  Showing 10 of {contacts.length} contacts
+                  Showing {PAGE_SIZE} of {newContacts.length} new contacts
                 </div>
               )}
             </div>
           )}
           
-          {contacts.length > 0 && (
+          {newContacts.length > 0 && (
             <Button 
               onClick={handleSaveContacts}
               disabled={isLoading}
               className="w-full"
             >
               <Save className="mr-2 h-4 w-4" />
-              Save {contacts.length} Contacts
+              Save {newContacts.length} New Contacts
             </Button>
           )}
+          
+          {contactsUploaded && (
+            <div className="border-t pt-4">
+              <div className="flex items-center space-x-2 mb-4">
+                <Input
+                  placeholder="Search email or name"
+                  value={search}
+                  onChange={(e) => setSearch(e.target.value)}
+                  onKeyDown={(e) => e.key === "Enter" && fetchContacts()}
+                  className="flex-1"
+                />
+                <Input
+                  placeholder="Lang"
+                  value={languageFilter}
+                  onChange={(e) => setLanguageFilter(e.target.value)}
+                  onKeyDown={(e) => e.key === "Enter" && fetchContacts()}
+                  className="w-20"
+                />
+                <Button variant="outline" size="sm" onClick={() => fetchContacts()}>
+                  <Search className="h-4 w-4" />
+                </Button>
+              </div>
+              
+              <div className="border rounded-md overflow-hidden">
+                <Table>
+                  <TableHeader>
+                    <TableRow>
+                      <TableHead>Email</TableHead>
+                      <TableHead>Name</TableHead>
+                      <TableHead>Language</TableHead>
+                      <TableHead className="w-[50px]"></TableHead>
+                    </TableRow>
+                  </TableHeader>
+                  <TableBody>
+                    {contacts.map((contact, index) => (
+                      <TableRow key={contact.row ?? index}>
+                        <TableCell>
+                          <Input
+                            value={contact.email}
+                            onChange={(e) => handleEditSavedContact(index, 'email', e.target.value)}
+                            onBlur={() => handleCommitSavedContact(contact)}
+                            className="h-8"
+                          />
+                        </TableCell>
+                        <TableCell>
+                          <Input
+                            value={contact.name}
+                            onChange={(e) => handleEditSavedContact(index, 'name', e.target.value)}
+                            onBlur={() => handleCommitSavedContact(contact)}
+                            className="h-8"
+                          />
+                        </TableCell>
+                        <TableCell>
+                          <Input
+                            value={contact.language}
+                            onChange={(e) => handleEditSavedContact(index, 'language', e.target.value)}
+                            onBlur={() => handleCommitSavedContact(contact)}
+                            className="h-8 w-16"
+                          />
+                        </TableCell>
+                        <TableCell>
+                          <Button
+                            variant="ghost"
+                            size="icon"
+                            onClick={() => handleDeleteSavedContact(contact)}
+                          >
+                            <Trash className="h-4 w-4 text-red-500" />
+                          </Button>
+                        </TableCell>
+                      </TableRow>
+                    ))}
+                  </TableBody>
+                </Table>
+                <div className="p-2 flex items-center justify-between text-sm text-gray-500">
+                  <Button
+                    variant="ghost"
+                    size="sm"
+                    onClick={handlePreviousPage}
+                    disabled={cursors.length <= 1}
+                  >
+                    <ChevronLeft className="h-4 w-4" />
+                  </Button>
+                  <span>
+                    Page {cursors.length}
+                    {matchTotal !== null && ` of ${Math.max(1, Math.ceil(matchTotal / PAGE_SIZE))} (${matchTotal} contacts)`}
+                  </span>
+                  <Button
+                    variant="ghost"
+                    size="sm"
+                    onClick={handleNextPage}
+                    disabled={!nextCursor}
+                  >
+                    <ChevronRight className="h-4 w-4" />
+                  </Button>
+                </div>
+              </div>
+            </div>
+          )}
         </div>
       </CardContent>
       <CardFooter className="flex justify-between">
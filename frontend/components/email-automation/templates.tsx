@@ -128,7 +128,7 @@ export default function TemplatesTab({ emailTemplates, setEmailTemplates }: Temp
       <CardHeader>
         <CardTitle>Email Templates</CardTitle>
         <CardDescription>
-          Create email templates for different languages. Use [NAME] as a placeholder for the recipient's name.
+          Create email templates for different languages. Use [NAME] as a placeholder for the recipient's name, or any other CSV column such as [COMPANY].
         </CardDescription>
       </CardHeader>
       <CardContent>
@@ -22,6 +22,8 @@ export interface CampaignSettings {
   messages_per_block: number
   max_connections: number
   retries: number
+  // Share of the sender slots while other campaigns run at the same time
+  weight: number
 }
 
 export interface CampaignStatus {
@@ -30,4 +32,13 @@ export interface CampaignStatus {
   status: string
   completed?: boolean
   errors?: string[]
+  sent?: number
+  failed?: number
+  retried?: number
+  suppressed?: number
+  errorClasses?: Record<string, number>
+  total?: number
+  rate?: number
+  concurrency?: number | null
+  campaignId?: string
 }
\ No newline at end of file